@@ -1,3 +1,93 @@
-from django.test import TestCase
+import io
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from bookings.models import Tour
+from bookings.tests import IN_MEMORY_LAYER, create_tour
+
+from .models import Wishlist
+from .wishlists import is_wishlisted, recount_wishlists, wishlist_ids
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class WishlistTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user(
+            email='traveller@example.com', password='secret', username='traveller',
+        )
+        cls.tours = [create_tour(), create_tour(name='Mountain Trek')]
+
+    def setUp(self):
+        cache.clear()
+
+    def wishlist_count(self, tour):
+        return Tour.objects.get(pk=tour.pk).wishlist_count
+
+    def toggle(self, tour):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('accounts:toggle_wishlist', args=[tour.pk])).json()['status']
+
+    def test_anonymous_users_have_an_empty_wishlist(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(wishlist_ids(AnonymousUser()), frozenset())
+            self.assertEqual(is_wishlisted(AnonymousUser(), [self.tours[0].pk]), {self.tours[0].pk: False})
+
+    def test_ids_are_cached_until_the_wishlist_changes(self):
+        Wishlist.objects.create(user=self.user, tour=self.tours[0])
+        with self.assertNumQueries(1):
+            self.assertEqual(wishlist_ids(self.user), {self.tours[0].pk})
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                is_wishlisted(self.user, [tour.pk for tour in self.tours]),
+                {self.tours[0].pk: True, self.tours[1].pk: False},
+            )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Wishlist.objects.create(user=self.user, tour=self.tours[1])
+        self.assertEqual(wishlist_ids(self.user), {tour.pk for tour in self.tours})
+        with self.captureOnCommitCallbacks(execute=True):
+            Wishlist.objects.filter(tour=self.tours[0]).delete()
+        self.assertEqual(wishlist_ids(self.user), {self.tours[1].pk})
+
+    def test_toggle_adds_then_removes_and_keeps_the_count(self):
+        self.client.force_login(self.user)
+        other = get_user_model().objects.create_user(email='other@example.com', password='secret', username='other')
+        Wishlist.objects.create(user=other, tour=self.tours[0])
+        self.assertEqual(wishlist_ids(self.user), frozenset())
+
+        self.assertEqual(self.toggle(self.tours[0]), 'added')
+        self.assertEqual(wishlist_ids(self.user), {self.tours[0].pk})
+        self.assertEqual(self.wishlist_count(self.tours[0]), 2)
+        self.assertEqual(self.toggle(self.tours[0]), 'removed')
+        self.assertEqual(wishlist_ids(self.user), frozenset())
+        self.assertEqual(self.wishlist_count(self.tours[0]), 1)
+        self.assertEqual(self.wishlist_count(self.tours[1]), 0)
+
+    def test_toggle_needs_a_logged_in_post_for_an_existing_tour(self):
+        url = reverse('accounts:toggle_wishlist', args=[self.tours[0].pk])
+        self.assertEqual(self.client.post(url).status_code, 302)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 405)
+        missing = reverse('accounts:toggle_wishlist', args=[max(tour.pk for tour in self.tours) + 1])
+        self.assertEqual(self.client.post(missing).status_code, 404)
+        self.assertFalse(Wishlist.objects.exists())
+
+    def test_recount_repairs_drifted_counts(self):
+        Wishlist.objects.create(user=self.user, tour=self.tours[0])
+        Tour.objects.filter(pk=self.tours[0].pk).update(wishlist_count=5)
+        Tour.objects.filter(pk=self.tours[1].pk).update(wishlist_count=2)
+        self.assertEqual(recount_wishlists(), 2)
+        self.assertEqual([self.wishlist_count(tour) for tour in self.tours], [1, 0])
+        self.assertEqual(recount_wishlists(), 0)
+
+        Tour.objects.filter(pk=self.tours[1].pk).update(wishlist_count=3)
+        out = io.StringIO()
+        call_command('refresh_listing_summaries', stdout=out)
+        self.assertIn('Updated wishlist counts of 1 tours', out.getvalue())
+        self.assertEqual(self.wishlist_count(self.tours[1]), 0)
@@ -77,7 +77,7 @@ def toggle_wishlist(request, tour_id):
 @login_required
 def wishlist_view(request):
     """Display user's wishlist."""
-    wishlist = Wishlist.objects.filter(user=request.user).select_related('tour')
+    wishlist = list(Wishlist.objects.filter(user=request.user).select_related('tour'))
     return render(request, 'accounts/wishlist.html', {
         'wishlist': wishlist
     })
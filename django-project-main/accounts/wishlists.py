@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+from django.db.models.signals import post_delete, post_save
+
+from bookings.models import Tour
+from core.versions import bump_version, get_version
+
+from .models import Wishlist
+
+
+def _key(user_id):
+    return f'wishlist:{user_id}'
+
+
+def wishlist_ids(user):
+    """The ids of the tours on ``user``'s wishlist, from the cache when it is current."""
+    if not user.is_authenticated:
+        return frozenset()
+    version = get_version(_key(user.pk))
+    entry = cache.get(_key(user.pk))
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    tour_ids = frozenset(Wishlist.objects.filter(user_id=user.pk).values_list('tour_id', flat=True))
+    cache.set(_key(user.pk), (version, tour_ids), settings.WISHLIST_CACHE_TIMEOUT)
+    return tour_ids
+
+
+def is_wishlisted(user, tour_ids):
+    """Map each of ``tour_ids`` to whether it is on ``user``'s wishlist, with at most one query."""
+    wishlisted = wishlist_ids(user)
+    return {tour_id: tour_id in wishlisted for tour_id in tour_ids}
+
+
+def recount_wishlists():
+    """Rebuild ``Tour.wishlist_count`` for every tour; returns the number of rows updated."""
+    counts = dict(Wishlist.objects.values_list('tour_id').annotate(count=Count('id')).order_by())
+    changed = [
+        Tour(pk=pk, wishlist_count=counts.get(pk, 0))
+        for pk, current in Tour.objects.values_list('pk', 'wishlist_count')
+        if counts.get(pk, 0) != current
+    ]
+    Tour.objects.bulk_update(changed, ['wishlist_count'], batch_size=500)
+    return len(changed)
+
+
+def _wishlist_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    # One UPDATE on the row's current value, so concurrent hearts add up.
+    Tour.objects.filter(pk=instance.tour_id).update(wishlist_count=F('wishlist_count') + 1)
+    name = _key(instance.user_id)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def _wishlist_deleted(sender, instance, **kwargs):
+    Tour.objects.filter(pk=instance.tour_id, wishlist_count__gt=0).update(wishlist_count=F('wishlist_count') - 1)
+    name = _key(instance.user_id)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def connect_signals():
+    post_save.connect(_wishlist_saved, sender=Wishlist, dispatch_uid='wishlist_save')
+    post_delete.connect(_wishlist_deleted, sender=Wishlist, dispatch_uid='wishlist_delete')
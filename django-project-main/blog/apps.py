@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class BlogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'blog'
+
+    def ready(self):
+        from core import search
+        from . import comments
+        from .models import Post
+
+        search.register(
+            Post, 'post',
+            title=lambda p: p.title,
+            body=lambda p: f'{p.excerpt} {p.content}',
+            visible=lambda p: p.status == 'published',
+        )
+        comments.connect_signals()
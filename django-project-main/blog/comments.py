@@ -0,0 +1,121 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models.signals import post_delete, post_save
+from django.template.loader import render_to_string
+
+from core.caching import get_or_build
+from core.versions import bump_version
+
+from .models import Comment
+
+
+def _version_name(post_id):
+    return f'comments:{post_id}'
+
+
+def load_comment_tree(post_id, max_depth=None):
+    """Return the approved top-level comments of a post with replies attached.
+
+    All approved comments are read in one query and linked in a single pass:
+    each comment gets ``children`` (its approved replies, oldest first) and
+    ``depth``. Replies deeper than ``max_depth`` are left out and counted in
+    ``hidden_replies`` on their last visible ancestor.
+    """
+    comments = list(
+        Comment.objects.filter(post_id=post_id, is_approved=True)
+        .select_related('user')
+        .order_by('created_at', 'id')
+    )
+    by_id = {comment.id: comment for comment in comments}
+    roots = []
+    for comment in comments:
+        comment.children = []
+        comment.hidden_replies = 0
+    for comment in comments:
+        if comment.parent_id is None:
+            roots.append(comment)
+        elif comment.parent_id in by_id:
+            by_id[comment.parent_id].children.append(comment)
+        # Replies to unapproved or deleted comments are dropped with their parent.
+
+    stack = [(root, 0) for root in roots]
+    while stack:
+        comment, depth = stack.pop()
+        comment.depth = depth
+        if max_depth is not None and depth >= max_depth:
+            comment.hidden_replies = _count(comment.children)
+            comment.children = []
+        stack.extend((child, depth + 1) for child in comment.children)
+    return roots
+
+
+def _count(comments):
+    total = 0
+    stack = list(comments)
+    while stack:
+        comment = stack.pop()
+        total += 1
+        stack.extend(comment.children)
+    return total
+
+
+def paginate_threads(roots, page_number=1, per_page=None):
+    """Paginate top-level threads; replies always stay with their thread."""
+    return Paginator(roots, per_page or settings.COMMENT_THREADS_PER_PAGE).get_page(page_number)
+
+
+def _thread_count(post_id):
+    """The number of approved top-level comments, cached like the pages."""
+    return get_or_build(
+        f'comments:{post_id}:threads',
+        lambda: Comment.objects.filter(post_id=post_id, is_approved=True, parent__isnull=True).count(),
+        version_names=[_version_name(post_id)], timeout=settings.COMMENT_CACHE_TIMEOUT,
+    )
+
+
+def render_comment_tree(post_id, page_number=1, max_depth=None):
+    """Render one page of comment threads, cached until a comment on the post changes.
+
+    Returns a dict of page details plus the rendered ``html``, which does not
+    depend on the viewer and so is shared between users. Out of range page
+    numbers are clamped before the cache lookup, so they share the entry of
+    the page actually shown instead of each adding one.
+    """
+    max_depth = max_depth if max_depth is not None else settings.COMMENT_MAX_DEPTH
+    try:
+        page_number = max(int(page_number), 1)
+    except (TypeError, ValueError):
+        page_number = 1
+    threads = Paginator(range(_thread_count(post_id)), settings.COMMENT_THREADS_PER_PAGE)
+    page_number = threads.get_page(page_number).number
+
+    def build():
+        page = paginate_threads(load_comment_tree(post_id, max_depth), page_number)
+        html = render_to_string('blog/partials/comment_tree.html', {'comments': page.object_list})
+        # Keep the page picklable: the Paginator would drag the whole tree along.
+        return {
+            'number': page.number,
+            'num_pages': page.paginator.num_pages,
+            'count': page.paginator.count,
+            'has_next': page.has_next(),
+            'has_previous': page.has_previous(),
+            'html': html,
+        }
+
+    return get_or_build(
+        f'comments:{post_id}:{page_number}:{max_depth}', build,
+        version_names=[_version_name(post_id)], timeout=settings.COMMENT_CACHE_TIMEOUT,
+    )
+
+
+def invalidate(post_id):
+    bump_version(_version_name(post_id))
+
+
+def _on_comment_change(sender, instance, **kwargs):
+    invalidate(instance.post_id)
+
+
+def connect_signals():
+    post_save.connect(_on_comment_change, sender=Comment, dispatch_uid='comments_tree')
+    post_delete.connect(_on_comment_change, sender=Comment, dispatch_uid='comments_tree')
@@ -0,0 +1,38 @@
+from django.db import IntegrityError, transaction
+from django.db.models import BooleanField, Exists, F, OuterRef, Value
+
+from .models import Post, PostLike
+
+
+def toggle_like(post_id, user_id):
+    """Like or unlike a post; returns ``(liked, like_count)``.
+
+    The toggle is a single DELETE, or an INSERT when there was nothing to
+    delete, and the counter moves with an ``F()`` UPDATE in the same
+    transaction. The unique (post, user) constraint settles two concurrent
+    likes, so double clicks cannot skew the count.
+    """
+    with transaction.atomic():
+        deleted, _ = PostLike.objects.filter(post_id=post_id, user_id=user_id).delete()
+        if deleted:
+            liked = False
+            Post.objects.filter(pk=post_id, like_count__gt=0).update(like_count=F('like_count') - 1)
+        else:
+            liked = True
+            try:
+                with transaction.atomic():
+                    PostLike.objects.create(post_id=post_id, user_id=user_id)
+            except IntegrityError:
+                # A concurrent request liked it first and already counted it.
+                pass
+            else:
+                Post.objects.filter(pk=post_id).update(like_count=F('like_count') + 1)
+        like_count = Post.objects.filter(pk=post_id).values_list('like_count', flat=True).first()
+    return liked, like_count or 0
+
+
+def with_liked(queryset, user):
+    """Annotate posts with ``is_liked`` for ``user`` as part of the listing query."""
+    if not user.is_authenticated:
+        return queryset.annotate(is_liked=Value(False, output_field=BooleanField()))
+    return queryset.annotate(is_liked=Exists(PostLike.objects.filter(post=OuterRef('pk'), user=user)))
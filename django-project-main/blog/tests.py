@@ -1,3 +1,136 @@
-from django.test import TestCase
+import threading
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from core.testing import QueryBudgetTestMixin
+
+from .comments import render_comment_tree
+from .likes import toggle_like
+from .models import BlogCategory, Comment, Post, PostLike, Tag
+
+
+@override_settings(COMMENT_THREADS_PER_PAGE=2, COMMENT_MAX_DEPTH=5)
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = get_user_model().objects.create_user(email='reader@example.com', password='secret', username='reader')
+        self.post = Post.objects.create(
+            title='Lisbon in Spring', author=user, content='', featured_image='blog/lisbon.jpg', status='published',
+        )
+        for number in range(3):
+            Comment.objects.create(post=self.post, user=user, content=f'Thread {number}', is_approved=True)
+
+    def test_out_of_range_pages_share_the_last_page_entry(self):
+        last = render_comment_tree(self.post.pk, 2)
+        self.assertEqual((last['number'], last['num_pages']), (2, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(render_comment_tree(self.post.pk, 999), last)
+            self.assertEqual(render_comment_tree(self.post.pk, 12345), last)
+        self.assertIsNone(cache.get(f'comments:{self.post.pk}:999:5'))
+        self.assertEqual(render_comment_tree(self.post.pk, 'x')['number'], 1)
+
+
+class PostListQueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User = get_user_model()
+        categories = [BlogCategory.objects.create(name=f'Category {number}') for number in range(3)]
+        tags = [Tag.objects.create(name=f'Tag {number}') for number in range(3)]
+        cls.reader = User.objects.create_user(email='reader@example.com', password='secret', username='reader')
+        for number in range(8):
+            author = User.objects.create_user(
+                email=f'author{number}@example.com', password='secret', username=f'author{number}'
+            )
+            post = Post.objects.create(
+                title=f'Post {number}', author=author, content='', featured_image='blog/post.jpg', status='published',
+            )
+            post.categories.add(categories[number % 3])
+            post.tags.add(*tags)
+            if number % 2:
+                PostLike.objects.create(post=post, user=cls.reader)
+
+    def test_post_list(self):
+        self.assertWithinQueryBudget(reverse('blog:list'))
+        self.client.force_login(self.reader)
+        self.assertWithinQueryBudget(reverse('blog:list'))
+
+
+class LikeTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        author = User.objects.create_user(email='author@example.com', password='secret', username='author')
+        self.reader = User.objects.create_user(email='reader@example.com', password='secret', username='reader')
+        self.post = Post.objects.create(
+            title='Porto by Tram', author=author, content='', featured_image='blog/porto.jpg', status='published',
+        )
+        self.client.force_login(self.reader)
+        self.url = reverse('blog:like', args=[self.post.slug])
+
+    def test_toggling_likes_and_unlikes(self):
+        self.assertEqual(self.client.post(self.url).json(), {'likes': 1, 'liked': True})
+        self.assertTrue(PostLike.objects.filter(post=self.post, user=self.reader).exists())
+        self.assertEqual(self.client.post(self.url).json(), {'likes': 0, 'liked': False})
+        self.assertFalse(PostLike.objects.exists())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 0)
+
+    def test_post_list_shows_the_readers_like(self):
+        response = self.client.get(reverse('blog:list'))
+        self.assertContains(response, 'aria-pressed="false"')
+        self.client.post(self.url)
+        response = self.client.get(reverse('blog:list'))
+        self.assertTrue(response.context['posts'][0].is_liked)
+        self.assertContains(response, 'aria-pressed="true"')
+        self.assertContains(response, '<span class="like-count">1</span>', html=True)
+
+        self.client.logout()
+        response = self.client.get(reverse('blog:list'))
+        self.assertNotContains(response, f'hx-post="{self.url}"')
+
+
+class ConcurrentLikeTests(TransactionTestCase):
+    threads = 8
+
+    def test_concurrent_likes_and_unlikes_keep_the_count(self):
+        User = get_user_model()
+        users = [
+            User.objects.create_user(email=f'reader{number}@example.com', password='secret', username=f'reader{number}')
+            for number in range(self.threads)
+        ]
+        post = Post.objects.create(
+            title='Algarve Coves', author=users[0], content='', featured_image='blog/coves.jpg', status='published',
+        )
+        errors = []
+        start = threading.Barrier(self.threads * 2)
+
+        def worker(user, toggles):
+            try:
+                start.wait()
+                for _ in range(toggles):
+                    toggle_like(post.pk, user.pk)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        # Two threads per reader, like a double click: each reader toggles an
+        # odd number of times in total unless their number is odd.
+        threads = [
+            threading.Thread(target=worker, args=(user, toggles))
+            for number, user in enumerate(users)
+            for toggles in (3, 2 + number % 2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        likes = PostLike.objects.filter(post=post)
+        self.assertEqual(set(likes.values_list('user__username', flat=True)), {
+            user.username for number, user in enumerate(users) if number % 2 == 0
+        })
+        self.assertEqual(Post.objects.get(pk=post.pk).like_count, likes.count())
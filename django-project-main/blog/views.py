@@ -2,11 +2,18 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
-from django.db.models import Q
-from .models import Post, BlogCategory, Tag, Comment, PostLike
+from core.counters import BufferedCounter
+from core.querylog import query_budget
+from core.search import search_objects
+from .comments import render_comment_tree
+from .likes import toggle_like, with_liked
+from .models import Post, BlogCategory, Tag, Comment
 
+post_views = BufferedCounter(Post, 'view_count')
+
+@query_budget(6)
 def post_list(request):
-    posts = Post.objects.filter(status='published')
+    posts = with_liked(Post.objects.filter(status='published').select_related('author'), request.user)
     categories = BlogCategory.objects.all()
     tags = Tag.objects.all()
     return render(request, 'blog/post_list.html', {
@@ -17,7 +24,7 @@ def post_list(request):
 
 def category_posts(request, slug):
     category = get_object_or_404(BlogCategory, slug=slug)
-    posts = Post.objects.filter(status='published', categories=category)
+    posts = with_liked(Post.objects.filter(status='published', categories=category), request.user)
     return render(request, 'blog/category_posts.html', {
         'category': category,
         'posts': posts
@@ -25,7 +32,7 @@ def category_posts(request, slug):
 
 def tag_posts(request, slug):
     tag = get_object_or_404(Tag, slug=slug)
-    posts = Post.objects.filter(status='published', tags=tag)
+    posts = with_liked(Post.objects.filter(status='published', tags=tag), request.user)
     return render(request, 'blog/tag_posts.html', {
         'tag': tag,
         'posts': posts
@@ -34,12 +41,8 @@ def tag_posts(request, slug):
 def post_search(request):
     query = request.GET.get('q', '')
     if query:
-        posts = Post.objects.filter(
-            Q(title__icontains=query) |
-            Q(content__icontains=query) |
-            Q(excerpt__icontains=query),
-            status='published'
-        )
+        # Ranked matches, each with a highlighted search_snippet
+        posts = search_objects(with_liked(Post.objects.filter(status='published'), request.user), query)
     else:
         posts = Post.objects.none()
     return render(request, 'blog/post_search.html', {
@@ -48,7 +51,7 @@ def post_search(request):
     })
 
 def author_posts(request, username):
-    posts = Post.objects.filter(status='published', author__username=username)
+    posts = with_liked(Post.objects.filter(status='published', author__username=username), request.user)
     return render(request, 'blog/author_posts.html', {
         'posts': posts,
         'author': username
@@ -56,15 +59,15 @@ def author_posts(request, username):
 
 def post_detail(request, slug):
     post = get_object_or_404(Post, slug=slug, status='published')
-    comments = Comment.objects.filter(post=post, is_approved=True, parent=None)
+    comments = render_comment_tree(post.id, request.GET.get('comments_page', 1))
     related_posts = Post.objects.filter(
         status='published',
         categories__in=post.categories.all()
     ).exclude(id=post.id)[:3]
     
-    # Increment view count
-    post.view_count += 1
-    post.save()
+    # Buffered increment, flushed in batches
+    post_views.incr(post.pk)
+    post.view_count = post_views.value(post)
     
     return render(request, 'blog/post_detail.html', {
         'post': post,
@@ -74,19 +77,12 @@ def post_detail(request, slug):
 
 @login_required
 def post_like(request, slug):
-    post = get_object_or_404(Post, slug=slug)
-    like, created = PostLike.objects.get_or_create(post=post, user=request.user)
-    
-    if not created:
-        like.delete()
-        post.like_count -= 1
-    else:
-        post.like_count += 1
-    post.save()
+    post_id = get_object_or_404(Post.objects.values_list('id', flat=True), slug=slug)
+    liked, like_count = toggle_like(post_id, request.user.id)
     
     return JsonResponse({
-        'likes': post.like_count,
-        'liked': created
+        'likes': like_count,
+        'liked': liked
     })
 
 @login_required
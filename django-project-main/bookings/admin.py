@@ -1,5 +1,13 @@
-from django.contrib import admin
-from .models import Tour, TourDate, TourReview, Booking, Payment
+import os
+import uuid
+
+from django.contrib import admin, messages
+from django.http import FileResponse, Http404, HttpResponse
+from django.urls import path, reverse
+from django.utils import timezone
+
+from .invoices import INVOICE_STATUSES, export_path, start_export
+from .models import Tour, TourDate, TourReview, Booking, Payment, SeatHold, TourRecommendations, WebhookEvent
 
 class TourDateInline(admin.TabularInline):
     model = TourDate
@@ -35,6 +43,57 @@ class BookingAdmin(admin.ModelAdmin):
     list_filter = ['status', 'created_at']
     search_fields = ['booking_reference', 'user__email', 'tour__name']
     readonly_fields = ['booking_reference', 'created_at', 'updated_at']
+    actions = ['export_invoices_zip']
+    date_hierarchy = 'created_at'
+
+    @admin.action(description='Export invoices of selected bookings as ZIP')
+    def export_invoices_zip(self, request, queryset):
+        # The queryset already carries the changelist's date and status
+        # filters; without a status filter only invoiced bookings go in.
+        if 'status__exact' not in request.GET:
+            queryset = queryset.filter(status__in=INVOICE_STATUSES)
+        count = queryset.count()
+        if not count:
+            self.message_user(request, 'None of the selected bookings has an invoice.', messages.WARNING)
+            return None
+        token = uuid.uuid4().hex
+        link = request.build_absolute_uri(reverse('admin:bookings_booking_invoice_export', args=[token]))
+        start_export(token, queryset.select_related('tour', 'tour_date').order_by('created_at'), request.user.email, link)
+        self.message_user(
+            request,
+            f'Exporting {count} invoices in the background. The ZIP will be at {link}'
+            + (f' and the link emailed to {request.user.email}.' if request.user.email else '.'),
+        )
+        return None
+
+    def get_urls(self):
+        return [
+            path(
+                'invoice-export/<str:token>/',
+                self.admin_site.admin_view(self.download_invoice_export),
+                name='bookings_booking_invoice_export',
+            ),
+        ] + super().get_urls()
+
+    def download_invoice_export(self, request, token):
+        if not self.has_view_permission(request):
+            raise Http404
+        try:
+            archive = export_path(uuid.UUID(hex=token).hex)
+        except ValueError:
+            raise Http404
+        if not os.path.exists(archive):
+            if not os.path.exists(f'{archive}.tmp'):
+                raise Http404
+            response = HttpResponse('The export is still running, please retry shortly', status=503)
+            response['Retry-After'] = '10'
+            return response
+        return FileResponse(
+            open(archive, 'rb'),
+            as_attachment=True,
+            filename=f'invoices_{timezone.now():%Y%m%d_%H%M}.zip',
+            content_type='application/zip',
+        )
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -42,3 +101,24 @@ class PaymentAdmin(admin.ModelAdmin):
     list_filter = ['status', 'payment_method', 'created_at']
     search_fields = ['booking__booking_reference', 'transaction_id']
     readonly_fields = ['created_at']
+
+@admin.register(SeatHold)
+class SeatHoldAdmin(admin.ModelAdmin):
+    list_display = ['booking', 'tour_date', 'seats', 'expires_at']
+    list_filter = ['expires_at']
+    search_fields = ['booking__booking_reference']
+    readonly_fields = ['created_at']
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ['provider', 'event_type', 'event_id', 'status', 'attempts', 'received_at', 'processed_at']
+    list_filter = ['provider', 'status', 'event_type']
+    search_fields = ['event_id']
+    readonly_fields = ['received_at', 'processed_at']
+
+@admin.register(TourRecommendations)
+class TourRecommendationsAdmin(admin.ModelAdmin):
+    list_display = ['user', 'built_at']
+    search_fields = ['user__username', 'user__email']
+    raw_id_fields = ['user']
+    readonly_fields = ['built_at']
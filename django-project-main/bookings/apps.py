@@ -4,3 +4,25 @@ from django.apps import AppConfig
 class BookingsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bookings'
+
+    def ready(self):
+        from core import search
+        from core.models import Destination
+        from core.ratings import track_ratings
+        from . import availability, facets, invoices, seat_updates, summaries
+        from .models import Tour, TourReview
+
+        track_ratings(TourReview, 'tour')
+        search.register(
+            Tour, 'tour',
+            title=lambda t: t.name,
+            body=lambda t: f'{t.destination.name} {t.destination.city} {t.destination.country} {t.description}',
+            visible=lambda t: t.is_active,
+            queryset=lambda: Tour.objects.select_related('destination'),
+            follows={Destination: 'destination'},
+        )
+        availability.connect_signals()
+        facets.connect_signals()
+        invoices.connect_signals()
+        seat_updates.connect_signals()
+        summaries.connect_signals()
@@ -0,0 +1,18 @@
+from django.contrib.auth import get_user_model
+
+from accounts.models import Wishlist
+
+from .models import Booking
+
+ACTIVE_BOOKING_STATUSES = ('pending', 'confirmed')
+
+
+def booked_on(tour_date_id):
+    """Users holding a pending or confirmed booking on a departure."""
+    bookings = Booking.objects.filter(tour_date_id=tour_date_id, status__in=ACTIVE_BOOKING_STATUSES)
+    return get_user_model().objects.filter(pk__in=bookings.values('user_id'))
+
+
+def wishlisters(tour_id):
+    """Users who have a tour on their wishlist."""
+    return get_user_model().objects.filter(pk__in=Wishlist.objects.filter(tour_id=tour_id).values('user_id'))
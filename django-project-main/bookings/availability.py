@@ -0,0 +1,184 @@
+import bisect
+import calendar
+import threading
+import time
+from array import array
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from core.versions import bump_version, get_version
+
+from .models import TourDate
+
+VERSION_PREFIX = 'availability:'
+
+
+def version_name(tour_id):
+    return f'{VERSION_PREFIX}{tour_id}'
+
+
+class TourCalendar:
+    """Open seats per day for one tour.
+
+    Seats live in an array indexed by days since ``origin``, with the
+    offsets that have departures kept sorted beside it, so a month view or
+    a "first available date" lookup only touches the departures in range.
+    """
+
+    def __init__(self, version, departures, loaded_at=None):
+        self.version = version
+        self.loaded_at = loaded_at if loaded_at is not None else time.monotonic()
+        departures = list(departures)  # (tour_date_id, start_date, seats)
+        self.origin = min((start for _, start, _ in departures), default=None)
+        span = max(((start - self.origin).days for _, start, _ in departures), default=-1) + 1
+        self.seats = array('l', [0]) * span
+        self.departures = {}  # tour_date_id -> offset
+        self.days = {}  # offset -> [tour_date_id, ...]
+        for tour_date_id, start, seats in departures:
+            offset = (start - self.origin).days
+            self.seats[offset] += seats
+            self.departures[tour_date_id] = offset
+            self.days.setdefault(offset, []).append(tour_date_id)
+        self.offsets = sorted(self.days)
+
+    @classmethod
+    def load(cls, tour_id, version=None):
+        loaded_at = time.monotonic()
+        rows = TourDate.objects.filter(
+            tour_id=tour_id, start_date__gte=timezone.localdate()
+        ).values_list('pk', 'start_date', 'available_seats')
+        return cls(version, rows, loaded_at)
+
+    def _offset(self, day):
+        return (day - self.origin).days
+
+    def _date(self, offset):
+        return self.origin + timedelta(days=offset)
+
+    def apply(self, tour_date_id, delta):
+        """Add ``delta`` seats to a departure; False if it is not in this calendar."""
+        offset = self.departures.get(tour_date_id)
+        if offset is None:
+            return False
+        self.seats[offset] += delta
+        return True
+
+    def seats_on(self, day):
+        if self.origin is None:
+            return 0
+        offset = self._offset(day)
+        return self.seats[offset] if 0 <= offset < len(self.seats) else 0
+
+    def _between(self, start, end):
+        """Departure offsets in [start, end), as an index range of ``offsets``."""
+        low = bisect.bisect_left(self.offsets, self._offset(start))
+        high = bisect.bisect_left(self.offsets, self._offset(end))
+        return low, high
+
+    def month(self, year, month):
+        """Departure days of a month as ``(date, seats, tour_date_ids)``, sold-out days included."""
+        if self.origin is None:
+            return []
+        first = date(year, month, 1)
+        end = first + timedelta(days=calendar.monthrange(year, month)[1])
+        low, high = self._between(max(first, timezone.localdate()), end)
+        return [
+            (self._date(offset), self.seats[offset], self.days[offset])
+            for offset in self.offsets[low:high]
+        ]
+
+    def first_available(self, seats=1, after=None):
+        """The first departure day on or after ``after`` (default today) with ``seats`` open."""
+        if self.origin is None:
+            return None
+        today = timezone.localdate()
+        after = max(after, today) if after else today
+        low = bisect.bisect_left(self.offsets, self._offset(after))
+        for offset in self.offsets[low:]:
+            if self.seats[offset] >= seats:
+                return self._date(offset)
+        return None
+
+
+_calendars = {}
+_tour_of_date = {}  # tour_date_id -> tour_id, for seat deltas
+_lock = threading.Lock()
+
+
+def _current(tour_calendar, version):
+    return (
+        tour_calendar is not None
+        and tour_calendar.version == version
+        and time.monotonic() - tour_calendar.loaded_at < settings.AVAILABILITY_CALENDAR_TTL
+    )
+
+
+def get_calendar(tour_id):
+    """Return the process-wide calendar of ``tour_id``, reloading it when its version moved.
+
+    Versions only cross processes through a shared cache, and even then a
+    bump can be lost to eviction, so a calendar is also reloaded once it is
+    AVAILABILITY_CALENDAR_TTL seconds old.
+    """
+    version = get_version(version_name(tour_id))
+    tour_calendar = _calendars.get(tour_id)
+    if not _current(tour_calendar, version):
+        with _lock:
+            tour_calendar = _calendars.get(tour_id)
+            if not _current(tour_calendar, version):
+                tour_calendar = TourCalendar.load(tour_id, version)
+                _calendars[tour_id] = tour_calendar
+                for tour_date_id in tour_calendar.departures:
+                    _tour_of_date[tour_date_id] = tour_id
+    return tour_calendar
+
+
+def tour_of(tour_date_id):
+    """The tour of a departure, from memory when its calendar is loaded."""
+    tour_id = _tour_of_date.get(tour_date_id)
+    if tour_id is None:
+        tour_id = TourDate.objects.filter(pk=tour_date_id).values_list('tour_id', flat=True).first()
+    return tour_id
+
+
+def _apply_delta(tour_date_id, delta, changed_at):
+    tour_id = tour_of(tour_date_id)
+    if tour_id is None:
+        return
+    version = bump_version(version_name(tour_id))
+    with _lock:
+        tour_calendar = _calendars.get(tour_id)
+        # Patch in place only if nobody else changed the tour in between and
+        # the calendar was read before the change was made (so it lacks it);
+        # otherwise the next read reloads it.
+        if (
+            tour_calendar is not None
+            and tour_calendar.version == version - 1
+            and tour_calendar.loaded_at < changed_at
+            and tour_calendar.apply(tour_date_id, delta)
+        ):
+            tour_calendar.version = version
+
+
+def seats_changed(tour_date_id, delta):
+    """Record a seat change on a departure once the current transaction commits.
+
+    This process patches its calendar in place; other processes see the
+    version bump through a shared cache, or reload once their copy expires.
+    """
+    changed_at = time.monotonic()
+    transaction.on_commit(lambda: _apply_delta(tour_date_id, delta, changed_at))
+
+
+def _tour_date_changed(sender, instance, **kwargs):
+    name = version_name(instance.tour_id)
+    transaction.on_commit(lambda: bump_version(name))
+
+
+def connect_signals():
+    post_save.connect(_tour_date_changed, sender=TourDate, dispatch_uid='availability_tour_date_save')
+    post_delete.connect(_tour_date_changed, sender=TourDate, dispatch_uid='availability_tour_date_delete')
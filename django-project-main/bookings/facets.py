@@ -0,0 +1,231 @@
+import bisect
+import threading
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+from core.models import Amenity, Category, Destination
+from core.versions import bumps, get_version
+
+from .models import Tour
+
+# (label, lower bound inclusive, upper bound exclusive or None)
+PRICE_BUCKETS = [
+    ('under-500', 0, 500),
+    ('500-1000', 500, 1000),
+    ('1000-2500', 1000, 2500),
+    ('2500-plus', 2500, None),
+]
+DURATION_BUCKETS = [
+    ('1-3', 1, 4),
+    ('4-7', 4, 8),
+    ('8-14', 8, 15),
+    ('15-plus', 15, None),
+]
+
+BUCKET_LABELS = {
+    'price': {'under-500': 'Under $500', '500-1000': '$500 - $1,000', '1000-2500': '$1,000 - $2,500', '2500-plus': '$2,500+'},
+    'duration': {'1-3': '1-3 days', '4-7': '4-7 days', '8-14': '8-14 days', '15-plus': '15+ days'},
+}
+
+VERSION_NAME = 'facets:tours'
+
+
+def bitmap_from_ids(ids):
+    """Pack integer ids into a bitmap stored as a Python int."""
+    ids = list(ids)
+    if not ids:
+        return 0
+    buf = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        buf[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(buf, 'little')
+
+
+def ids_from_bitmap(bitmap):
+    """Yield the ids set in ``bitmap`` in ascending order."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for byte_index, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield byte_index * 8 + low.bit_length() - 1
+            byte ^= low
+
+
+def bucket_bounds(buckets, label):
+    """Return ``(low, high)`` for a bucket label, or None if it is unknown."""
+    for bucket_label, low, high in buckets:
+        if bucket_label == label:
+            return low, high
+    return None
+
+
+def _bucket(buckets, value):
+    for label, low, high in buckets:
+        if value >= low and (high is None or value < high):
+            return label
+    return None
+
+
+class FacetIndex:
+    """Bitmaps of tour ids per facet value.
+
+    Counting a facet value under the current filters is a single AND and
+    popcount, so every facet of the sidebar is answered from memory.
+    """
+
+    FACETS = ('category', 'country', 'price', 'duration', 'amenity')
+
+    def __init__(self, version):
+        self.version = version
+        self.facets = {name: {} for name in self.FACETS}
+        self.all = 0
+        self.destinations = {}  # tour id -> destination id
+        self.labels = {'category': {}, 'amenity': {}}  # slug or id -> display name
+        self._prices = []  # sorted (price, tour_id) for arbitrary price ranges
+        self._price_keys = []
+
+    def _add(self, facet, value, ids):
+        values = self.facets[facet]
+        values[value] = values.get(value, 0) | bitmap_from_ids(ids)
+
+    @classmethod
+    def build(cls, version=None):
+        index = cls(version)
+        by_category, by_country, by_price, by_duration, by_amenity = {}, {}, {}, {}, {}
+        tour_ids = []
+        # Prices are the maintained ``min_price`` (cheapest bookable departure,
+        # discounts included) that tour_list filters on; tours whose summary
+        # has not been computed yet match no price.
+        rows = Tour.objects.filter(is_active=True).values_list(
+            'id', 'destination_id', 'destination__country', 'min_price', 'duration_days'
+        )
+        for tour_id, destination_id, country, price, duration in rows.iterator():
+            tour_ids.append(tour_id)
+            index.destinations[tour_id] = destination_id
+            by_country.setdefault(country, []).append(tour_id)
+            by_duration.setdefault(_bucket(DURATION_BUCKETS, duration), []).append(tour_id)
+            if price is not None:
+                by_price.setdefault(_bucket(PRICE_BUCKETS, price), []).append(tour_id)
+                index._prices.append((price, tour_id))
+        index._prices.sort()
+        index._price_keys = [price for price, _ in index._prices]
+
+        categories = Tour.categories.through.objects.filter(tour__is_active=True).values_list(
+            'tour_id', 'category__slug', 'category__name'
+        )
+        for tour_id, slug, name in categories.iterator():
+            by_category.setdefault(slug, []).append(tour_id)
+            index.labels['category'][slug] = name
+        amenities = Tour.amenities.through.objects.filter(tour__is_active=True).values_list(
+            'tour_id', 'amenity_id', 'amenity__name'
+        )
+        for tour_id, amenity_id, name in amenities.iterator():
+            by_amenity.setdefault(amenity_id, []).append(tour_id)
+            index.labels['amenity'][amenity_id] = name
+
+        index.all = bitmap_from_ids(tour_ids)
+        for facet, groups in (
+            ('category', by_category), ('country', by_country), ('price', by_price),
+            ('duration', by_duration), ('amenity', by_amenity),
+        ):
+            for value, ids in groups.items():
+                if value is not None:
+                    index._add(facet, value, ids)
+        return index
+
+    def price_range(self, min_price=None, max_price=None):
+        """Bitmap of tours whose price lies in [min_price, max_price]."""
+        start = bisect.bisect_left(self._price_keys, min_price) if min_price is not None else 0
+        end = bisect.bisect_right(self._price_keys, max_price) if max_price is not None else len(self._price_keys)
+        return bitmap_from_ids(tour_id for _, tour_id in self._prices[start:end])
+
+    def destination_counts(self, facet):
+        """Count distinct destinations with an active tour per value of ``facet``."""
+        return {
+            value: len({self.destinations[tour_id] for tour_id in ids_from_bitmap(bitmap)})
+            for value, bitmap in self.facets[facet].items()
+        }
+
+    def match(self, facet, values):
+        """Bitmap of tours having any of ``values`` for ``facet``."""
+        result = 0
+        for value in values:
+            result |= self.facets[facet].get(value, 0)
+        return result
+
+    def options(self, counts, facet, selected=()):
+        """The sidebar entries of ``facet`` from ``counts``: ``(value, label, count)``.
+
+        Buckets keep their natural order, other values are sorted by label.
+        Values no tour matches are left out unless they are ``selected``.
+        """
+        values = counts[facet]
+        if facet in BUCKET_LABELS:
+            entries = [(value, label) for value, label in BUCKET_LABELS[facet].items() if value in values]
+        else:
+            labels = self.labels.get(facet, {})
+            entries = sorted(((value, labels.get(value, str(value))) for value in values), key=lambda e: e[1])
+        return [
+            (value, label, values[value])
+            for value, label in entries
+            if values[value] or value in selected
+        ]
+
+    def counts(self, selected=None, restrict=None):
+        """Count tours per facet value under the current selection.
+
+        ``selected`` maps facet names to chosen values; ``restrict`` is an
+        extra bitmap (search results, price range) applied to every facet.
+        As usual for facets, a facet's own selection is ignored when
+        counting its values so alternatives stay visible.
+        """
+        selected = {facet: values for facet, values in (selected or {}).items() if values}
+        base = self.all if restrict is None else self.all & restrict
+        matches = {facet: self.match(facet, values) for facet, values in selected.items()}
+        result = {}
+        for facet in self.FACETS:
+            scope = base
+            for other, bitmap in matches.items():
+                if other != facet:
+                    scope &= bitmap
+            result[facet] = {
+                value: (bitmap & scope).bit_count()
+                for value, bitmap in self.facets[facet].items()
+            }
+        total = base
+        for bitmap in matches.values():
+            total &= bitmap
+        result['total'] = total.bit_count()
+        return result
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_tour_index():
+    """Return the process-wide facet index, rebuilding it after catalog changes."""
+    global _index
+    version = get_version(VERSION_NAME)
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                _index = FacetIndex.build(version)
+            index = _index
+    return index
+
+
+invalidate = bumps(VERSION_NAME)
+
+
+def connect_signals():
+    for signal in (post_save, post_delete):
+        signal.connect(invalidate, sender=Tour, dispatch_uid='facets_tour')
+        signal.connect(invalidate, sender=Destination, dispatch_uid='facets_destination')
+        # Renamed or deleted categories and amenities change the sidebar
+        # labels; deleting one also drops its tour links without m2m_changed.
+        signal.connect(invalidate, sender=Category, dispatch_uid='facets_category')
+        signal.connect(invalidate, sender=Amenity, dispatch_uid='facets_amenity')
+    m2m_changed.connect(invalidate, sender=Tour.categories.through, dispatch_uid='facets_categories')
+    m2m_changed.connect(invalidate, sender=Tour.amenities.through, dispatch_uid='facets_amenities')
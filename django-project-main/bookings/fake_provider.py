@@ -0,0 +1,112 @@
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.test import RequestFactory
+from django.utils import timezone
+
+from . import views
+
+
+class FakeProvider:
+    """Produces Stripe- and PayPal-shaped webhook events for local replay and tests.
+
+    Events carry the booking in metadata the way our checkout sets it up
+    and go through the real webhook views. Stripe events are signed with
+    ``stripe_secret``. PayPal signs with a certificate we cannot forge, so
+    PayPal events carry an HMAC of the body in their transmission signature
+    instead, and ``verify_paypal`` stands in for the SDK's check of it.
+    """
+
+    def __init__(self, seed=None, stripe_secret='', paypal_key='fake-paypal'):
+        self.rng = random.Random(seed)
+        self.stripe_secret = stripe_secret
+        self.paypal_key = paypal_key
+        self.factory = RequestFactory()
+
+    def stripe_payment(self, booking, succeeded=True, intent_id=None, amount=None, currency=None):
+        intent_id = intent_id or f'pi_{uuid.uuid4().hex[:24]}'
+        amount = booking.total_amount if amount is None else Decimal(amount)
+        return {
+            'id': f'evt_{uuid.uuid4().hex[:24]}',
+            'type': 'payment_intent.succeeded' if succeeded else 'payment_intent.payment_failed',
+            'data': {'object': {
+                'id': intent_id,
+                'object': 'payment_intent',
+                'amount': int(amount * 100),
+                'currency': currency or settings.PAYMENT_CURRENCY.lower(),
+                'metadata': {'booking_id': str(booking.pk)},
+            }},
+        }
+
+    def paypal_sale(self, booking, completed=True, sale_id=None):
+        return {
+            'id': f'WH-{uuid.uuid4().hex[:17].upper()}',
+            'event_type': 'PAYMENT.SALE.COMPLETED' if completed else 'PAYMENT.SALE.DENIED',
+            'resource': {
+                'id': sale_id or uuid.uuid4().hex[:17].upper(),
+                'amount': {'total': str(booking.total_amount), 'currency': settings.PAYMENT_CURRENCY},
+                'invoice_number': booking.booking_reference,
+            },
+        }
+
+    def payment_events(self, booking, failure_rate=0.1):
+        """Events for one booking being paid, sometimes after a failed attempt."""
+        events = []
+        provider = self.rng.choice(['stripe', 'paypal'])
+        if self.rng.random() < failure_rate:
+            failed = self.stripe_payment(booking, succeeded=False) if provider == 'stripe' else self.paypal_sale(booking, completed=False)
+            events.append((provider, failed))
+        paid = self.stripe_payment(booking) if provider == 'stripe' else self.paypal_sale(booking)
+        events.append((provider, paid))
+        return events
+
+    def with_redeliveries(self, events, duplicate_rate=0.2, retry_rate=0.0):
+        """Shuffle ``events`` and redeliver a share of them, as providers do on timeouts.
+
+        A ``retry_rate`` share of the redeliveries comes back under a new
+        event id, as a provider-side retry of the same money movement does.
+        """
+        events = list(events)
+        redelivered = []
+        for provider, payload in events:
+            if self.rng.random() < duplicate_rate:
+                if self.rng.random() < retry_rate:
+                    payload = dict(payload, id=f'{payload["id"]}-retry')
+                redelivered.append((provider, payload))
+        events += redelivered
+        self.rng.shuffle(events)
+        return events
+
+    def _stripe_signature(self, body):
+        timestamp = int(time.time())
+        signature = hmac.new(self.stripe_secret.encode(), f'{timestamp}.{body}'.encode(), hashlib.sha256).hexdigest()
+        return f't={timestamp},v1={signature}'
+
+    def _paypal_signature(self, transmission_id, body):
+        return hmac.new(self.paypal_key.encode(), f'{transmission_id}|{body}'.encode(), hashlib.sha256).hexdigest()
+
+    def verify_paypal(self, transmission_id, timestamp, webhook_id, event_body, cert_url, actual_sig, auth_algo):
+        """Drop-in for ``paypalrestsdk.WebhookEvent.verify`` that checks our own signatures."""
+        return hmac.compare_digest(self._paypal_signature(transmission_id, event_body), actual_sig)
+
+    def deliver(self, provider, payload, **headers):
+        """POST ``payload`` to our webhook view; returns the response status code."""
+        body = json.dumps(payload)
+        if provider == 'stripe' and self.stripe_secret:
+            headers.setdefault('HTTP_STRIPE_SIGNATURE', self._stripe_signature(body))
+        elif provider == 'paypal':
+            transmission_id = str(uuid.uuid4())
+            headers.setdefault('HTTP_PAYPAL_TRANSMISSION_ID', transmission_id)
+            headers.setdefault('HTTP_PAYPAL_TRANSMISSION_TIME', timezone.now().isoformat())
+            headers.setdefault('HTTP_PAYPAL_TRANSMISSION_SIG', self._paypal_signature(transmission_id, body))
+            headers.setdefault('HTTP_PAYPAL_CERT_URL', 'https://api.sandbox.paypal.com/v1/notifications/certs/CERT-fake')
+            headers.setdefault('HTTP_PAYPAL_AUTH_ALGO', 'SHA256withRSA')
+        request = self.factory.post(f'/{provider}-webhook/', body, content_type='application/json', **headers)
+        view = views.stripe_webhook if provider == 'stripe' else views.paypal_webhook
+        return view(request).status_code
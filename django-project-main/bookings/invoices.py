@@ -0,0 +1,314 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zipfile
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.template.loader import get_template
+
+from core import outbox
+
+from .models import Booking
+from .pdf import write_pdf
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_NAME = 'bookings/invoice_pdf.html'
+# Exported unless a status is asked for explicitly.
+INVOICE_STATUSES = ['confirmed', 'completed']
+
+ExportStats = namedtuple('ExportStats', ['invoices', 'rendered', 'seconds', 'failed'])
+PruneStats = namedtuple('PruneStats', ['removed', 'kept'])
+
+_executor = None
+_in_flight = {}
+_lock = threading.Lock()
+_executor_lock = threading.Lock()
+_template_hash = None
+
+
+def _new_executor(workers):
+    # spawn: forking a threaded server process is not safe
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = _new_executor(settings.INVOICE_RENDER_WORKERS)
+    return _executor
+
+
+def _submit_render(html, path):
+    """Submit a render to the shared pool, replacing the pool once if it is broken.
+
+    A worker that dies (killed for memory, say) breaks the whole pool and
+    every later submit raises BrokenProcessPool until it is replaced.
+    """
+    global _executor
+    executor = _get_executor()
+    try:
+        return executor.submit(write_pdf, html, path)
+    except BrokenProcessPool:
+        with _executor_lock:
+            if _executor is executor:
+                _executor = None
+        executor.shutdown(wait=False)
+        return _get_executor().submit(write_pdf, html, path)
+
+
+def template_hash():
+    """Hash of the invoice template source, so template edits re-render invoices."""
+    global _template_hash
+    if _template_hash is None:
+        _template_hash = hashlib.sha256(get_template(TEMPLATE_NAME).template.source.encode()).hexdigest()
+    return _template_hash
+
+
+def invoice_fields(booking):
+    """Everything printed on the invoice; the cache key is derived from it."""
+    tour_date = booking.tour_date
+    return {
+        'reference': booking.booking_reference,
+        'full_name': booking.full_name,
+        'email': booking.email,
+        'phone': booking.phone,
+        'tour': booking.tour.name,
+        'start_date': str(tour_date.start_date) if tour_date else None,
+        'end_date': str(tour_date.end_date) if tour_date else None,
+        'participants': booking.participants,
+        'base_price': str(booking.base_price),
+        'gst_amount': str(booking.gst_amount),
+        'sgst_amount': str(booking.sgst_amount),
+        'total_amount': str(booking.total_amount),
+        'status': booking.status,
+        'payment_method': booking.payment_method,
+        'transaction_id': booking.transaction_id,
+        'created_at': booking.created_at.isoformat(),
+    }
+
+
+def invoice_digest(booking):
+    payload = json.dumps(invoice_fields(booking), sort_keys=True)
+    return hashlib.sha256(f'{template_hash()}:{payload}'.encode()).hexdigest()
+
+
+def invoice_path(digest):
+    return os.path.join(settings.INVOICE_ROOT, digest[:2], f'{digest}.pdf')
+
+
+def render_html(booking):
+    return get_template(TEMPLATE_NAME).render({'booking': booking})
+
+
+def submit(booking):
+    """Queue the invoice of ``booking`` for rendering; returns ``(digest, future)``.
+
+    The future is None when the PDF is already on disk. Concurrent requests
+    for the same content share one render.
+    """
+    digest = invoice_digest(booking)
+    path = invoice_path(digest)
+    if _touch(path):
+        return digest, None
+    with _lock:
+        future = _in_flight.get(digest)
+        # A done future here failed; its callback has not dropped it yet.
+        if future is None or future.done():
+            future = _submit_render(render_html(booking), path)
+            _in_flight[digest] = future
+            future.add_done_callback(lambda f: _in_flight.pop(digest, None))
+    return digest, future
+
+
+def get_invoice(booking, timeout=None):
+    """Return ``(digest, path)`` of the invoice PDF, waiting for it to render if needed."""
+    timeout = timeout if timeout is not None else settings.INVOICE_RENDER_TIMEOUT
+    digest, future = submit(booking)
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except BrokenProcessPool:
+            # The pool broke under this render; submit() replaces it.
+            digest, future = submit(booking)
+            if future is not None:
+                future.result(timeout=timeout)
+    return digest, invoice_path(digest)
+
+
+def _touch(path):
+    """Mark a cached PDF as used, so pruning keeps it; returns whether it exists."""
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def prune_invoices(days=None):
+    """Delete cached PDFs not used in ``days`` (INVOICE_RETENTION_DAYS); returns PruneStats.
+
+    A PDF's digest changes whenever the booking or the template does, so
+    outdated copies are never served again and only age out here. Old
+    export archives and files left by renders that died midway are
+    removed too.
+    """
+    days = days if days is not None else settings.INVOICE_RETENTION_DAYS
+    cutoff = time.time() - days * 24 * 60 * 60
+    removed = kept = 0
+    for directory, _, filenames in os.walk(settings.INVOICE_ROOT):
+        for filename in filenames:
+            if not filename.endswith(('.pdf', '.zip', '.tmp')):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    removed += 1
+                else:
+                    kept += 1
+            except FileNotFoundError:
+                pass
+    return PruneStats(removed, kept)
+
+
+def export_invoices(bookings, fileobj, workers=None):
+    """Write the invoices of ``bookings`` into a ZIP archive on ``fileobj``.
+
+    Missing PDFs are rendered on a dedicated process pool with at most a few
+    jobs per worker in flight, and every PDF is copied into the archive from
+    the on-disk cache, so memory use does not grow with the number of
+    invoices. An invoice that cannot be rendered is logged and left out
+    rather than failing the whole export; ``failed`` lists the booking ids.
+    Returns ``ExportStats``.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    window = workers * 4
+    exported = rendered = 0
+    failed = []
+    pending = {}  # future -> (booking id, arcname)
+
+    with _new_executor(workers) as executor, zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_STORED) as archive:
+        def collect(futures):
+            nonlocal exported, rendered
+            for future in futures:
+                booking_id, arcname = pending.pop(future)
+                try:
+                    path = future.result()
+                except Exception:
+                    logger.exception('Could not render the invoice of booking %s for export', booking_id)
+                    failed.append(booking_id)
+                    continue
+                archive.write(path, arcname)
+                exported += 1
+                rendered += 1
+
+        for booking in bookings:
+            arcname = f'invoice_{booking.booking_reference}.pdf'
+            path = invoice_path(invoice_digest(booking))
+            if _touch(path):
+                archive.write(path, arcname)
+                exported += 1
+                continue
+            try:
+                future = executor.submit(write_pdf, render_html(booking), path)
+            except Exception:
+                logger.exception('Could not render the invoice of booking %s for export', booking.pk)
+                failed.append(booking.pk)
+                continue
+            pending[future] = (booking.pk, arcname)
+            if len(pending) >= window:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(list(pending))
+
+    return ExportStats(exported, rendered, time.perf_counter() - started, sorted(failed))
+
+
+def export_path(token):
+    return os.path.join(settings.INVOICE_ROOT, 'exports', f'{token}.zip')
+
+
+def start_export(token, bookings, email, link):
+    """Export the invoices of ``bookings`` to ``export_path(token)`` on a background thread.
+
+    The thread starts once the caller's transaction commits and evaluates
+    ``bookings`` itself, so the request returns straight away. When the
+    archive is complete ``link`` is emailed to ``email`` through the outbox.
+    """
+    def start():
+        threading.Thread(
+            target=run_export, args=(token, bookings, email, link), name=f'invoice-export-{token}', daemon=True
+        ).start()
+
+    transaction.on_commit(start)
+
+
+def run_export(token, bookings, email, link):
+    path = export_path(token)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        # Written aside and renamed, so the download only ever sees a whole archive.
+        with open(f'{path}.tmp', 'wb') as fileobj:
+            stats = export_invoices(bookings.iterator(chunk_size=500), fileobj)
+        os.replace(f'{path}.tmp', path)
+        rate = stats.invoices / stats.seconds if stats.seconds else 0
+        if email:
+            missing = ''
+            if stats.failed:
+                missing = (
+                    f'{len(stats.failed)} could not be rendered and are missing '
+                    f'(booking ids {", ".join(map(str, stats.failed))}).\n\n'
+                )
+            outbox.enqueue(
+                'Your invoice export is ready',
+                f'{stats.invoices} invoices were exported in {stats.seconds:.1f}s ({rate:.1f}/sec).\n\n'
+                f'{missing}Download them from {link}\n',
+                [email],
+            )
+    except Exception:
+        logger.exception('Invoice export %s failed', token)
+        if os.path.exists(f'{path}.tmp'):
+            os.unlink(f'{path}.tmp')
+        if email:
+            outbox.enqueue('Your invoice export failed', 'Please try again or contact a developer.\n', [email])
+    finally:
+        # Runs on its own thread, which owns its connection.
+        connection.close()
+
+
+def render_for(booking_ids):
+    """Queue invoices for bookings confirmed through bulk updates, which send no signals."""
+    if not settings.INVOICE_RENDER_ON_CONFIRM:
+        return
+    for booking in Booking.objects.select_related('tour', 'tour_date').filter(pk__in=booking_ids):
+        submit(booking)
+
+
+def _render_confirmed(sender, instance, raw=False, **kwargs):
+    if raw or instance.status != 'confirmed' or not settings.INVOICE_RENDER_ON_CONFIRM:
+        return
+    booking_id = instance.pk
+
+    def schedule():
+        booking = Booking.objects.select_related('tour', 'tour_date').filter(pk=booking_id).first()
+        if booking is not None:
+            submit(booking)
+
+    transaction.on_commit(schedule)
+
+
+def connect_signals():
+    post_save.connect(_render_confirmed, sender=Booking, dispatch_uid='invoices_render')
@@ -0,0 +1,89 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from bookings.models import TourRecommendations
+from bookings.recommendations import BOOKING_WEIGHTS, WISHLIST_WEIGHT, item_similarity, recommend_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Times a full recommendation rebuild on synthetic interactions with skewed tour popularity: '
+        'similarity, scoring and, with --write, storing the rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interactions', type=int, default=1000000)
+        parser.add_argument('--users', type=int, default=100000)
+        parser.add_argument('--tours', type=int, default=2000)
+        parser.add_argument('--features', type=int, default=40, help='Distinct categories and amenities')
+        parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of tour popularity')
+        parser.add_argument('--write', action='store_true', help='Also time the INSERTs, rolled back afterwards')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        if min(options['interactions'], options['users'], options['tours']) < 1:
+            raise CommandError('--interactions, --users and --tours must be positive.')
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        user_tours, tour_features = self.generate(rng, options)
+        interactions = sum(len(row) for row in user_tours.values())
+        self.stdout.write(
+            f'Generated {interactions} distinct interactions of {len(user_tours)} users '
+            f'over {options["tours"]} tours in {time.perf_counter() - started:.2f}s'
+        )
+
+        started = time.perf_counter()
+        similarity = item_similarity(user_tours, tour_features)
+        similarity_seconds = time.perf_counter() - started
+        pairs = sum(len(row) for row in similarity.values())
+        self.stdout.write(f'Similarity: {similarity_seconds:.2f}s, {pairs} neighbour pairs kept')
+
+        started = time.perf_counter()
+        rows = {
+            user_id: [tour_id for tour_id, _ in recommend_for(row, similarity)]
+            for user_id, row in user_tours.items()
+        }
+        scoring_seconds = time.perf_counter() - started
+        self.stdout.write(
+            f'Scoring: {scoring_seconds:.2f}s for {len(user_tours)} users '
+            f'({scoring_seconds / len(user_tours) * 1e6:.0f}us per user)'
+        )
+
+        total = similarity_seconds + scoring_seconds
+        if options['write']:
+            started = time.perf_counter()
+            built_at = timezone.now()
+            with transaction.atomic():
+                TourRecommendations.objects.bulk_create(
+                    [TourRecommendations(user_id=user_id, tour_ids=tour_ids, built_at=built_at)
+                     for user_id, tour_ids in rows.items()],
+                    batch_size=1000,
+                )
+                write_seconds = time.perf_counter() - started
+                transaction.set_rollback(True)
+            self.stdout.write(f'Write: {write_seconds:.2f}s ({len(rows) / write_seconds:,.0f} rows/s)')
+            total += write_seconds
+        self.stdout.write(self.style.SUCCESS(
+            f'Full rebuild of {interactions} interactions: {total:.2f}s'
+            + ('' if options['write'] else ' excluding the write (pass --write)')
+        ))
+
+    def generate(self, rng, options):
+        tours = list(range(1, options['tours'] + 1))
+        popularity = [1 / rank ** options['skew'] for rank in range(1, len(tours) + 1)]
+        rng.shuffle(popularity)
+        picks = rng.choices(tours, weights=popularity, k=options['interactions'])
+        owners = [rng.randrange(1, options['users'] + 1) for _ in range(options['interactions'])]
+        weights = list(BOOKING_WEIGHTS.values()) + [WISHLIST_WEIGHT] * 3
+        user_tours = {}
+        for user_id, tour_id in zip(owners, picks):
+            row = user_tours.setdefault(user_id, {})
+            row[tour_id] = max(row.get(tour_id, 0), rng.choice(weights))
+        features = [('category', pk) for pk in range(options['features'] // 4)]
+        features += [('amenity', pk) for pk in range(options['features'] - len(features))]
+        tour_features = {tour_id: set(rng.sample(features, min(len(features), 5))) for tour_id in tours}
+        return user_tours, tour_features
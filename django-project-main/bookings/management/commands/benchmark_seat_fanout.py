@@ -0,0 +1,120 @@
+import asyncio
+import random
+import time
+
+from channels.routing import URLRouter
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from bookings import seat_updates
+from bookings.models import TourDate
+from bookings.seat_updates import SeatPublisher
+from core.loadtest import IN_MEMORY_LAYER, SimulatedClient
+from core.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = (
+        'Connects simulated websocket clients to BookingConsumer on the in-memory channel layer, '
+        'publishes a burst of seat changes and reports snapshot and fan-out costs'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=2000)
+        parser.add_argument('--tours', type=int, default=5, help='Spread clients over this many tours')
+        parser.add_argument('--changes', type=int, default=1000, help='Seat changes to publish')
+        parser.add_argument('--seconds', type=float, default=3.0, help='Spread the changes over this long')
+        parser.add_argument('--rate', type=float, default=None, help='Updates per second per tour')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        departures = {}
+        for pk, tour_id in TourDate.objects.filter(start_date__gte=timezone.localdate()).values_list('pk', 'tour_id'):
+            departures.setdefault(tour_id, []).append(pk)
+        tours = sorted(departures)[:options['tours']]
+        if not tours:
+            raise CommandError('No tours with upcoming departures to benchmark against.')
+        departures = {tour_id: departures[tour_id] for tour_id in tours}
+
+        with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+            asyncio.run(self.run(departures, options))
+
+    async def run(self, departures, options):
+        rng = random.Random(options['seed'])
+        tours = list(departures)
+        application = URLRouter(websocket_urlpatterns)
+
+        # Count snapshot queries: every client connects, few should hit the database.
+        builds = 0
+        seat_rows = seat_updates._seat_rows
+
+        def counted_seat_rows(*args, **kwargs):
+            nonlocal builds
+            if kwargs.get('tour_date_ids') is None:
+                builds += 1
+            return seat_rows(*args, **kwargs)
+
+        seat_updates._seat_rows = counted_seat_rows
+        clients = []
+        try:
+            started = time.perf_counter()
+            for index in range(options['clients']):
+                tour_id = tours[index % len(tours)]
+                client = SimulatedClient(application, f'ws/booking/{tour_id}/')
+                clients.append((tour_id, client))
+            connected = await asyncio.gather(*(client.connect() for _, client in clients))
+            if not all(connected):
+                raise CommandError('Some clients could not connect.')
+            await asyncio.gather(*(client.receive_message() for _, client in clients))
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'Connected {len(clients)} clients with snapshots in {elapsed:.2f}s '
+                f'({builds} snapshot queries)'
+            )
+
+            publisher = SeatPublisher(rate=options['rate'])
+            pause = options['seconds'] / max(options['changes'], 1)
+            started = time.perf_counter()
+            for _ in range(options['changes']):
+                tour_id = rng.choice(tours)
+                await publisher.apublish(tour_id, [rng.choice(departures[tour_id])])
+                await asyncio.sleep(pause)
+            # Let the trailing, coalesced sends go out.
+            await asyncio.sleep(publisher.interval * 2)
+            await self.settle(clients)
+            elapsed = time.perf_counter() - started
+            received = [client.output_queue.qsize() for _, client in clients]
+            self.stdout.write(
+                f"Published {options['changes']} changes in {elapsed:.2f}s: "
+                f'{sum(received)} messages delivered, '
+                f'{sum(received) / len(received):.1f} per client (max {max(received)}), '
+                f'at most {1 / publisher.interval:g}/s per tour'
+            )
+
+            # Latency of one update to every client of a tour, outside the throttle window.
+            await asyncio.sleep(publisher.interval)
+            tour_id = tours[0]
+            watched = [client for client_tour, client in clients if client_tour == tour_id]
+            before = [client.output_queue.qsize() for client in watched]
+            started = time.perf_counter()
+            await publisher.apublish(tour_id, departures[tour_id][:1])
+            while any(client.output_queue.qsize() <= seen for client, seen in zip(watched, before)):
+                await asyncio.sleep(0)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f'One update reached {len(watched)} clients of tour {tour_id} in {elapsed * 1000:.1f}ms'
+            ))
+        finally:
+            seat_updates._seat_rows = seat_rows
+            await asyncio.gather(*(client.disconnect() for _, client in clients), return_exceptions=True)
+
+    async def settle(self, clients, quiet=0.2):
+        """Wait until no client has received anything for ``quiet`` seconds."""
+        sizes = None
+        while True:
+            current = [client.output_queue.qsize() for _, client in clients]
+            if current == sizes:
+                return
+            sizes = current
+            await asyncio.sleep(quiet)
@@ -0,0 +1,46 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings.invoices import INVOICE_STATUSES, export_invoices
+from bookings.models import Booking
+
+
+class Command(BaseCommand):
+    help = 'Exports the invoices of bookings made in a date range as a ZIP of PDFs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', help='First booking date, YYYY-MM-DD')
+        parser.add_argument('end', help='Last booking date (inclusive), YYYY-MM-DD')
+        parser.add_argument('--status', action='append', help='Booking status to include (repeatable); defaults to confirmed and completed')
+        parser.add_argument('--workers', type=int, default=None, help='Render processes; defaults to the CPU count')
+        parser.add_argument('--output', default=None, help='ZIP path; defaults to invoices_<start>_<end>.zip')
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start'])
+            end = date.fromisoformat(options['end'])
+        except ValueError as exc:
+            raise CommandError(exc)
+        if end < start:
+            raise CommandError('end must not be before start')
+
+        bookings = Booking.objects.filter(
+            created_at__date__gte=start,
+            created_at__date__lte=end,
+            status__in=options['status'] or INVOICE_STATUSES,
+        ).select_related('tour', 'tour_date').order_by('created_at')
+        output = options['output'] or f'invoices_{start}_{end}.zip'
+
+        with open(output, 'wb') as fileobj:
+            stats = export_invoices(bookings.iterator(chunk_size=500), fileobj, workers=options['workers'])
+
+        rate = stats.invoices / stats.seconds if stats.seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {stats.invoices} invoices ({stats.rendered} rendered) to {output} '
+            f'in {stats.seconds:.1f}s, {rate:.1f} invoices/sec'
+        ))
+        if stats.failed:
+            self.stdout.write(self.style.WARNING(
+                f'{len(stats.failed)} invoices could not be rendered; booking ids: {", ".join(map(str, stats.failed))}'
+            ))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from bookings import summaries
+from bookings.webhooks import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Applies stored payment webhook events with a pool of worker threads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new events')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write(f"Processing webhooks every {options['interval']}s")
+        handled = run_workers(
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            loop=options['loop'],
+            interval=options['interval'],
+        )
+        # Refresh now rather than on a timer that dies with the process.
+        summaries.refresher.flush()
+        self.stdout.write(self.style.SUCCESS(f'Processed {handled} webhook events'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from bookings.invoices import prune_invoices
+
+
+class Command(BaseCommand):
+    help = 'Deletes cached invoice PDFs that have not been used for a while'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Defaults to INVOICE_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        stats = prune_invoices(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Removed {stats.removed} invoice files, kept {stats.kept}'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from bookings.recommendations import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes tour similarity from bookings, wishlists, categories and amenities and '
+        'stores every user\'s top recommendations. Run nightly.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=None, help='Recommendations stored per user')
+
+    def handle(self, *args, **options):
+        stats = rebuild(options['limit'])
+        timings = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in stats.timings.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored recommendations for {stats.users} users over {stats.tours} tours '
+            f'from {stats.interactions} interactions ({timings})'
+        ))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from accounts.wishlists import recount_wishlists
+from bookings.summaries import refresh_tours
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes min price, next departure and open seats for every tour and destination, '
+        'and tour wishlist counts. Bookings refresh their tours a few seconds later in batches; run this '
+        'daily so departures that have started drop out of the summaries, or more often as a backstop.'
+    )
+
+    def handle(self, *args, **options):
+        updated = refresh_tours()
+        self.stdout.write(self.style.SUCCESS(f'Updated listing summaries of {updated} tours'))
+        recounted = recount_wishlists()
+        self.stdout.write(self.style.SUCCESS(f'Updated wishlist counts of {recounted} tours'))
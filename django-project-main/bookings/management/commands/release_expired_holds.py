@@ -0,0 +1,26 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from bookings import summaries
+from bookings.reservations import release_expired_holds, sweep_expired_holds
+
+
+class Command(BaseCommand):
+    help = 'Releases seats held by bookings that were not paid before their hold expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep sweeping on an asyncio loop')
+        parser.add_argument('--interval', type=int, default=30, help='Seconds between sweeps with --loop')
+
+    def handle(self, *args, **options):
+        if options['loop']:
+            self.stdout.write(f"Sweeping expired holds every {options['interval']}s")
+            asyncio.run(sweep_expired_holds(options['interval'], options['batch_size']))
+            return
+
+        released = release_expired_holds(batch_size=options['batch_size'])
+        # Refresh now rather than on a timer that dies with the process.
+        summaries.refresher.flush()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired holds'))
@@ -0,0 +1,100 @@
+import secrets
+import time
+import uuid
+from collections import Counter
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.test.utils import override_settings
+
+from bookings.fake_provider import FakeProvider
+from bookings.models import Booking, Payment, Tour, WebhookEvent
+from bookings.webhooks import run_workers
+
+
+class Command(BaseCommand):
+    help = 'Replays fake provider webhooks for throwaway bookings and checks each is applied exactly once'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=10000, help='Approximate number of events to deliver')
+        parser.add_argument('--duplicates', type=float, default=0.2, help='Share of events delivered twice')
+        parser.add_argument(
+            '--retries', type=float, default=0.25, help='Share of redeliveries that come back under a new event id'
+        )
+        parser.add_argument('--workers', type=int, default=None)
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated bookings and events')
+
+    def handle(self, *args, **options):
+        tour = Tour.objects.filter(is_active=True).first()
+        if tour is None:
+            raise CommandError('Need at least one active tour')
+        user, _ = get_user_model().objects.get_or_create(
+            username='webhook-replay', defaults={'email': 'webhook-replay@localhost'}
+        )
+
+        prefix = f'R{uuid.uuid4().hex[:5].upper()}'
+        count = max(1, int(options['events'] / (1 + options['duplicates'])))
+        Booking.objects.bulk_create([
+            Booking(
+                user=user, tour=tour, booking_reference=f'{prefix}{i:07d}',
+                full_name='Replay', email='webhook-replay@localhost', total_amount=tour.price,
+            )
+            for i in range(count)
+        ], batch_size=1000)
+        bookings = list(Booking.objects.filter(booking_reference__startswith=prefix))
+
+        # Sign with throwaway credentials so the replay goes through the same
+        # verification as live traffic without needing the real secrets.
+        provider = FakeProvider(seed=options['seed'], stripe_secret=f'whsec_{secrets.token_hex(16)}')
+        events = []
+        for booking in bookings:
+            events.extend(provider.payment_events(booking))
+        events = provider.with_redeliveries(events, options['duplicates'], options['retries'])
+        event_ids = {payload['id'] for _, payload in events}
+
+        with override_settings(
+            STRIPE_WEBHOOK_SECRET=provider.stripe_secret, PAYPAL_WEBHOOK_ID='WH-replay',
+            INVOICE_RENDER_ON_CONFIRM=False,
+        ), mock.patch('paypalrestsdk.WebhookEvent.verify', side_effect=provider.verify_paypal):
+            started = time.perf_counter()
+            statuses = Counter(provider.deliver(name, payload) for name, payload in events)
+            ingest_seconds = time.perf_counter() - started
+            self.stdout.write(
+                f'Delivered {len(events)} events ({len(event_ids)} unique) in {ingest_seconds:.1f}s, '
+                f'{len(events) / ingest_seconds:.0f}/sec; responses {dict(statuses)}'
+            )
+
+            started = time.perf_counter()
+            handled = run_workers(workers=options['workers'], batch_size=options['batch_size'])
+            process_seconds = time.perf_counter() - started
+            self.stdout.write(
+                f'Processed {handled} events in {process_seconds:.1f}s, {handled / process_seconds:.0f}/sec'
+            )
+
+        replayed = Booking.objects.filter(booking_reference__startswith=prefix)
+        unconfirmed = replayed.exclude(status='confirmed').count()
+        double_paid = replayed.annotate(
+            paid=Count('payment', filter=Q(payment__status='completed'))
+        ).exclude(paid=1).count()
+        left = WebhookEvent.objects.filter(event_id__in=event_ids).exclude(status__in=['processed', 'ignored']).count()
+        stored = WebhookEvent.objects.filter(event_id__in=event_ids).count()
+
+        ok = (
+            set(statuses) == {200} and not unconfirmed and not double_paid and not left
+            and stored == len(event_ids)
+        )
+        summary = (
+            f'{stored} events stored for {len(event_ids)} unique; {unconfirmed} bookings unconfirmed, '
+            f'{double_paid} without exactly one payment, {left} events unprocessed'
+        )
+        if not options['keep']:
+            WebhookEvent.objects.filter(event_id__in=event_ids).delete()
+            Payment.objects.filter(booking__in=replayed).delete()
+            replayed.delete()
+        if not ok:
+            raise CommandError(summary)
+        self.stdout.write(self.style.SUCCESS(summary))
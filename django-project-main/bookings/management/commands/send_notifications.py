@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from bookings import audiences
+from core.notifications import dispatch
+
+
+class Command(BaseCommand):
+    help = (
+        'Sends a notification to everyone booked on a departure or wishlisting a tour, '
+        'storing it in their inbox and pushing it to those online, and reports the throughput'
+    )
+
+    def add_arguments(self, parser):
+        audience = parser.add_mutually_exclusive_group(required=True)
+        audience.add_argument('--tour-date', type=int, help='Users with an active booking on this departure')
+        audience.add_argument('--tour', type=int, help='Users with this tour on their wishlist')
+        parser.add_argument('--title', required=True)
+        parser.add_argument('--body', default='')
+        parser.add_argument('--url', default='')
+        parser.add_argument('--kind', default='announcement')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--concurrency', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['tour_date'] is not None:
+            audience = audiences.booked_on(options['tour_date'])
+        else:
+            audience = audiences.wishlisters(options['tour'])
+        for option in ('chunk_size', 'concurrency'):
+            if options[option] is not None and options[option] < 1:
+                raise CommandError(f"--{option.replace('_', '-')} must be at least 1.")
+
+        stats = dispatch(
+            audience, options['kind'], options['title'],
+            body=options['body'], url=options['url'],
+            chunk_size=options['chunk_size'], concurrency=options['concurrency'],
+        )
+        rate = stats.recipients / stats.seconds if stats.seconds else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Notified {stats.recipients} users in {stats.chunks} chunks in {stats.seconds:.2f}s '
+            f'({rate:.0f} recipients/s)'
+        ))
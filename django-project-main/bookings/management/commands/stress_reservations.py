@@ -0,0 +1,95 @@
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+
+from bookings.models import TourDate
+from bookings.reservations import reserve_seats
+
+
+def _hammer(tour_date_id, attempts, seats):
+    """Try to reserve ``seats`` up to ``attempts`` times; return (won, sold_out, errors)."""
+    won = sold_out = errors = 0
+    try:
+        for _ in range(attempts):
+            try:
+                result = reserve_seats(tour_date_id, seats)
+            except OperationalError:
+                # SQLite reports "database is locked" once its busy timeout expires.
+                errors += 1
+                continue
+            if result.reserved:
+                won += 1
+            else:
+                sold_out += 1
+    finally:
+        connection.close()
+    return won, sold_out, errors
+
+
+def _hammer_threads(tour_date_id, threads, attempts, seats):
+    """Run ``_hammer`` from several threads inside one worker process."""
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(_hammer, tour_date_id, attempts, seats) for _ in range(threads)]
+        totals = [f.result() for f in futures]
+    return tuple(sum(column) for column in zip(*totals))
+
+
+class Command(BaseCommand):
+    help = 'Hammers one TourDate with concurrent seat reservations and checks for overselling'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tour_date_id', type=int)
+        parser.add_argument('--seats', type=int, default=100, help='Seats to put on sale for the run')
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--threads', type=int, default=8, help='Threads per process')
+        parser.add_argument('--attempts', type=int, default=50, help='Reservation attempts per thread')
+        parser.add_argument('--party-size', type=int, default=1, help='Seats taken per reservation')
+
+    def handle(self, *args, **options):
+        tour_date_id = options['tour_date_id']
+        try:
+            tour_date = TourDate.objects.get(pk=tour_date_id)
+        except TourDate.DoesNotExist:
+            raise CommandError(f'TourDate {tour_date_id} does not exist')
+
+        original_seats = tour_date.available_seats
+        seats = options['seats']
+        party_size = options['party_size']
+        TourDate.objects.filter(pk=tour_date_id).update(available_seats=seats)
+
+        self.stdout.write(
+            f"{connection.vendor}: {options['processes']} processes x {options['threads']} threads "
+            f"competing for {seats} seats"
+        )
+
+        # Forked workers must not share the parent's database connection.
+        connections.close_all()
+        started = time.perf_counter()
+        try:
+            with ProcessPoolExecutor(max_workers=options['processes']) as pool:
+                futures = [
+                    pool.submit(_hammer_threads, tour_date_id, options['threads'], options['attempts'], party_size)
+                    for _ in range(options['processes'])
+                ]
+                results = [f.result() for f in futures]
+            elapsed = time.perf_counter() - started
+
+            won, sold_out, errors = (sum(column) for column in zip(*results))
+            remaining = TourDate.objects.get(pk=tour_date_id).available_seats
+        finally:
+            TourDate.objects.filter(pk=tour_date_id).update(available_seats=original_seats)
+
+        attempts = won + sold_out + errors
+        self.stdout.write(
+            f'{attempts} attempts in {elapsed:.2f}s ({attempts / elapsed:.0f}/s): '
+            f'{won} reserved, {sold_out} sold out, {errors} lock errors, {remaining} seats left'
+        )
+        if won * party_size + remaining != seats:
+            raise CommandError(
+                f'Seat accounting mismatch: {won * party_size} reserved + {remaining} left != {seats}'
+            )
+        if won * party_size > seats:
+            raise CommandError('Oversold the departure')
+        self.stdout.write(self.style.SUCCESS('No overselling detected'))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0003_seathold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0004_tour_rating_avg_tour_rating_count'),
+        ('core', '0001_initial'),
+        ('vendors', '0002_vendor_rating_avg_vendor_rating_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['is_active', '-created_at', '-id'], name='tour_active_created_idx'),
+        ),
+    ]
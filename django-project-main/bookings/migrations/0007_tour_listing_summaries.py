@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0006_webhookevent'),
+        ('core', '0005_destination_listing_summaries'),
+        ('vendors', '0002_vendor_rating_avg_vendor_rating_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='next_departure',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tour',
+            name='open_seats',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['is_active', 'next_departure', 'id'], name='tour_departure_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tour',
+            index=models.Index(fields=['is_active', 'min_price'], name='tour_price_idx'),
+        ),
+    ]
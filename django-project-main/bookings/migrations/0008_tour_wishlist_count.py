@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0007_tour_listing_summaries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='wishlist_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0008_tour_wishlist_count'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TourRecommendations',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='tour_recommendations', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('tour_ids', models.JSONField(default=list)),
+                ('built_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'tour recommendations',
+            },
+        ),
+    ]
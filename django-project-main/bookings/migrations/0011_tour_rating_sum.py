@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:00
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_rating_sums(apps, schema_editor):
+    Tour = apps.get_model('bookings', 'Tour')
+    TourReview = apps.get_model('bookings', 'TourReview')
+    sums = TourReview.objects.values('tour').annotate(total=Sum('rating')).order_by()
+    Tour.objects.bulk_update(
+        [Tour(pk=row['tour'], rating_sum=row['total']) for row in sums], ['rating_sum'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0010_alter_payment_status_alter_webhookevent_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tour',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_sums, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,7 @@ from django.utils.text import slugify
 from django.conf import settings
 from core.models import Destination, Category, Amenity, Review
 from tours.models import Tour
+from .pricing import quote
 
 class Tour(models.Model):
     name = models.CharField(max_length=200)
@@ -27,6 +28,27 @@ class Tour(models.Model):
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    
+    # Review aggregates, maintained from TourReview signals
+    rating_avg = models.FloatField(default=0)  # rating_sum / rating_count, kept for ordering
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+
+    # Listing summaries over upcoming departures, maintained by bookings.summaries
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    next_departure = models.DateField(null=True, blank=True)
+    open_seats = models.PositiveIntegerField(default=0)
+
+    # Wishlist entries, maintained by accounts.wishlists
+    wishlist_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of active tours, newest first
+            models.Index(fields=['is_active', '-created_at', '-id'], name='tour_active_created_idx'),
+            models.Index(fields=['is_active', 'next_departure', 'id'], name='tour_departure_idx'),
+            models.Index(fields=['is_active', 'min_price'], name='tour_price_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
@@ -37,10 +59,7 @@ class Tour(models.Model):
         return self.name
 
     def get_rating(self):
-        reviews = self.tourreview_set.all()
-        if not reviews:
-            return 0
-        return sum(review.rating for review in reviews) / len(reviews)
+        return self.rating_avg
 
     def get_availability_color(self):
         if self.is_active and self.group_size_max > 0:
@@ -54,15 +73,15 @@ class Tour(models.Model):
 
     @property
     def gst_amount(self):
-        return self.price * 0.05  # 5% GST
+        return quote(self).gst_amount
 
     @property
     def sgst_amount(self):
-        return self.price * 0.05  # 5% SGST
+        return quote(self).sgst_amount
 
     @property
     def total_amount(self):
-        return self.price + self.gst_amount + self.sgst_amount
+        return quote(self).total_amount
 
 class TourDate(models.Model):
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE)
@@ -102,6 +121,7 @@ class Booking(models.Model):
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     tour = models.ForeignKey(Tour, on_delete=models.CASCADE)
+    tour_date = models.ForeignKey(TourDate, on_delete=models.SET_NULL, null=True, blank=True, related_name='bookings')
     booking_reference = models.CharField(max_length=20, unique=True)
     full_name = models.CharField(max_length=100, default='')
     email = models.EmailField(default='')
@@ -129,6 +149,7 @@ class Payment(models.Model):
         ('completed', 'Completed'),
         ('failed', 'Failed'),
         ('refunded', 'Refunded'),
+        ('review', 'Needs review'),
     ]
     
     PAYMENT_METHOD_CHOICES = [
@@ -150,4 +171,75 @@ class Payment(models.Model):
         return f"{self.booking.booking_reference} - {self.amount}"
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        # Provider transaction ids are idempotency keys for webhook processing
+        unique_together = ['transaction_id', 'status']
+
+class SeatHold(models.Model):
+    """Seats held for a pending booking until payment or expiry."""
+    booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name='hold')
+    tour_date = models.ForeignKey(TourDate, on_delete=models.CASCADE, related_name='holds')
+    seats = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['expires_at']
+        indexes = [
+            models.Index(fields=['expires_at'], name='seathold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.booking.booking_reference} - {self.seats} seats until {self.expires_at}"
+
+class WebhookEvent(models.Model):
+    """A payment provider webhook, stored as received and processed by the webhook workers."""
+    PROVIDER_CHOICES = [
+        ('stripe', 'Stripe'),
+        ('paypal', 'PayPal'),
+    ]
+
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('processed', 'Processed'),
+        ('ignored', 'Ignored'),
+        ('review', 'Needs review'),
+        ('failed', 'Failed'),
+    ]
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    event_id = models.CharField(max_length=255)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    claim = models.CharField(max_length=32, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['received_at']
+        unique_together = ['provider', 'event_id']
+        indexes = [
+            models.Index(fields=['status', 'received_at'], name='webhookevent_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.event_id}"
+
+class TourRecommendations(models.Model):
+    """A user's precomputed top tours, rebuilt offline by bookings.recommendations."""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='tour_recommendations'
+    )
+    tour_ids = models.JSONField(default=list)  # best first
+    built_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "tour recommendations"
+
+    def __str__(self):
+        return f"{self.user} - {len(self.tour_ids)} tours"
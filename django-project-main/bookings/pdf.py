@@ -0,0 +1,27 @@
+"""PDF rendering that runs in worker processes.
+
+Kept free of Django imports so spawned workers can load it without
+setting Django up.
+"""
+import os
+import tempfile
+
+from xhtml2pdf import pisa
+
+
+def write_pdf(html, path):
+    """Render ``html`` to a PDF at ``path``, atomically; returns ``path``."""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as dest:
+            status = pisa.CreatePDF(html, dest=dest)
+        if status.err:
+            raise RuntimeError(f'xhtml2pdf failed with {status.err} error(s)')
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return path
@@ -0,0 +1,105 @@
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import BigIntegerField, Case, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Cast, Round
+
+GST_RATE = Decimal('0.05')
+SGST_RATE = Decimal('0.05')
+CENT = Decimal('0.01')
+
+Quote = namedtuple('Quote', ['unit_price', 'participants', 'base_price', 'gst_amount', 'sgst_amount', 'total_amount'])
+
+
+def money(value):
+    """Round to cents, halves away from zero, as invoices expect."""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def to_minor_units(amount):
+    """Amount in cents for payment providers."""
+    return int(money(amount) * 100)
+
+
+def unit_price(tour, tour_date=None):
+    """Price per participant: the discount price when it is lower, times the date's modifier."""
+    price = tour.price
+    if tour.discount_price is not None and tour.discount_price < price:
+        price = tour.discount_price
+    if tour_date is not None:
+        price = price * tour_date.price_modifier
+    return money(price)
+
+
+def quote(tour, tour_date=None, participants=1):
+    """Price ``participants`` on ``tour`` (optionally on ``tour_date``) with taxes.
+
+    Taxes are computed on the whole base price and rounded once each, so
+    base + GST + SGST always equals the total.
+    """
+    unit = unit_price(tour, tour_date)
+    base = unit * participants
+    gst = money(base * GST_RATE)
+    sgst = money(base * SGST_RATE)
+    return Quote(unit, participants, base, gst, sgst, base + gst + sgst)
+
+
+def apply_quote(booking, quote):
+    booking.participants = quote.participants
+    booking.base_price = quote.base_price
+    booking.gst_amount = quote.gst_amount
+    booking.sgst_amount = quote.sgst_amount
+    booking.total_amount = quote.total_amount
+
+
+# Batch pricing in SQL. Amounts are carried as integer cents and rates as
+# basis points so every step is exact integer arithmetic on any backend
+# (SQLite would otherwise compute decimals as floats). Integer division
+# rounds half up here because all amounts are positive.
+
+def _bps(rate):
+    return int(rate * 10000)
+
+
+def _integer(expression):
+    return ExpressionWrapper(expression, output_field=BigIntegerField())
+
+
+def _scaled(expression, scale):
+    return Cast(Round(expression * Value(scale)), BigIntegerField())
+
+
+def _div_half_up(numerator, denominator):
+    return _integer((numerator + Value(denominator // 2)) / Value(denominator))
+
+
+def with_quotes(queryset, participants=1, tour_path='tour__'):
+    """Annotate a TourDate (or Tour) queryset with exact prices in cents.
+
+    Adds ``unit_cents``, ``base_cents``, ``gst_cents``, ``sgst_cents`` and
+    ``total_cents``, matching ``quote()`` to the cent. Being annotations,
+    they can be filtered, ordered and aggregated on in the same query.
+    Pass ``tour_path=''`` for a Tour queryset, priced without a date.
+    """
+    price = F(f'{tour_path}price')
+    discount = F(f'{tour_path}discount_price')
+    effective = Case(
+        When(Q(**{f'{tour_path}discount_price__isnull': False, f'{tour_path}discount_price__lt': price}), then=discount),
+        default=price,
+    )
+    price_cents = _scaled(effective, 100)
+    if tour_path:
+        unit = _div_half_up(price_cents * _scaled(F('price_modifier'), 100), 100)
+    else:
+        unit = price_cents
+    queryset = queryset.annotate(unit_cents=unit)
+    queryset = queryset.annotate(base_cents=_integer(F('unit_cents') * Value(participants)))
+    queryset = queryset.annotate(
+        gst_cents=_div_half_up(F('base_cents') * Value(_bps(GST_RATE)), 10000),
+        sgst_cents=_div_half_up(F('base_cents') * Value(_bps(SGST_RATE)), 10000),
+    )
+    return queryset.annotate(total_cents=_integer(F('base_cents') + F('gst_cents') + F('sgst_cents')))
+
+
+def from_cents(cents):
+    return (Decimal(cents) / 100).quantize(CENT)
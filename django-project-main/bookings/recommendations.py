@@ -0,0 +1,263 @@
+import heapq
+import math
+import time
+from collections import namedtuple
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import Wishlist
+from accounts.wishlists import wishlist_ids
+from core.models import Amenity, Category
+
+from .models import Booking, Tour, TourRecommendations
+
+# How strongly each interaction says a user likes a tour; a pair keeps its strongest.
+BOOKING_WEIGHTS = {'completed': 3.0, 'confirmed': 3.0, 'pending': 2.0}
+WISHLIST_WEIGHT = 1.0
+# Users with more interactions than this only count their strongest ones, so
+# one heavy account cannot dominate the co-occurrence counts.
+MAX_TOURS_PER_USER = 200
+WRITE_BATCH = 1000
+
+RebuildStats = namedtuple('RebuildStats', ['users', 'tours', 'interactions', 'timings'])
+
+# The matrices are kept sparse as dicts of dicts, ``{row: {column: weight}}``,
+# and feature rows as sets, so memory and time follow the interactions that
+# exist rather than users x tours. Each user's result is stored as one row of
+# ranked tour ids, so a rebuild writes one row per user, not one per tour.
+
+
+def user_tour_matrix():
+    """Interaction weights per user and tour, from bookings and wishlists."""
+    matrix = {}
+    bookings = Booking.objects.filter(status__in=BOOKING_WEIGHTS).values_list('user_id', 'tour_id', 'status')
+    for user_id, tour_id, status in bookings.iterator(chunk_size=10000):
+        row = matrix.setdefault(user_id, {})
+        row[tour_id] = max(row.get(tour_id, 0), BOOKING_WEIGHTS[status])
+    for user_id, tour_id in Wishlist.objects.values_list('user_id', 'tour_id').iterator(chunk_size=10000):
+        row = matrix.setdefault(user_id, {})
+        row[tour_id] = max(row.get(tour_id, 0), WISHLIST_WEIGHT)
+    return matrix
+
+
+def tour_feature_matrix():
+    """The category and amenity features of every active tour, as sets of ``(kind, id)``."""
+    features = {pk: set() for pk in Tour.objects.filter(is_active=True).values_list('pk', flat=True)}
+    for kind, through, column in (
+        ('category', Tour.categories.through, 'category_id'),
+        ('amenity', Tour.amenities.through, 'amenity_id'),
+    ):
+        for tour_id, feature_id in through.objects.values_list('tour_id', column).iterator(chunk_size=10000):
+            if tour_id in features:
+                features[tour_id].add((kind, feature_id))
+    return features
+
+
+def feature_names():
+    """Lower-cased category names and slugs, and amenity names, mapped to their features."""
+    names = {}
+    for pk, name, slug in Category.objects.filter(is_active=True).values_list('pk', 'name', 'slug'):
+        names[name.lower()] = names[slug.lower()] = ('category', pk)
+    for pk, name in Amenity.objects.values_list('pk', 'name'):
+        names.setdefault(name.lower(), ('amenity', pk))
+    return names
+
+
+def interest_profile(travel_style, interests, names):
+    """Feature weights for a user's travel style and ``interests`` blob.
+
+    ``interests`` may be a list of names or a ``{name: weight}`` mapping;
+    names that match no category or amenity are ignored.
+    """
+    if isinstance(interests, dict):
+        weighted = list(interests.items())
+    elif isinstance(interests, (list, tuple)):
+        weighted = [(name, 1.0) for name in interests]
+    else:
+        weighted = []
+    if travel_style:
+        weighted.append((travel_style, 1.0))
+    profile = {}
+    for name, weight in weighted:
+        feature = names.get(str(name).strip().lower())
+        if feature is None:
+            continue
+        try:
+            weight = float(weight)
+        except (TypeError, ValueError):
+            weight = 1.0
+        profile[feature] = profile.get(feature, 0) + weight
+    return profile
+
+
+def _capped(row):
+    if len(row) <= MAX_TOURS_PER_USER:
+        return row
+    return dict(heapq.nlargest(MAX_TOURS_PER_USER, row.items(), key=itemgetter(1)))
+
+
+def item_similarity(user_tours, tour_features, neighbours=None, content_weight=None):
+    """The ``neighbours`` most similar tours of every tour, as ``{tour: {tour: similarity}}``.
+
+    Similarity blends the cosine of the tours' user columns (computed as
+    the sparse product of the user x tour matrix with its transpose, one
+    user row at a time) with the cosine of their category/amenity rows.
+    Only tours in ``tour_features`` are kept as neighbours, so it should
+    hold every tour that may be recommended.
+    """
+    neighbours = neighbours or settings.RECOMMENDATION_NEIGHBOURS
+    content_weight = settings.RECOMMENDATION_CONTENT_WEIGHT if content_weight is None else content_weight
+
+    # Collaborative part: upper triangle of X^T X, plus the column norms.
+    products = {}
+    squares = {}
+    for row in user_tours.values():
+        items = sorted(_capped(row).items())
+        for index, (a, weight_a) in enumerate(items):
+            squares[a] = squares.get(a, 0.0) + weight_a * weight_a
+            products_a = products.get(a)
+            if products_a is None:
+                products_a = products[a] = {}
+            for b, weight_b in items[index + 1:]:
+                products_a[b] = products_a.get(b, 0.0) + weight_a * weight_b
+
+    similarity = {}
+    scale = 1 - content_weight
+    for a, row in products.items():
+        norm_a = math.sqrt(squares[a])
+        similar_a = similarity.setdefault(a, {})
+        for b, product in row.items():
+            value = scale * product / (norm_a * math.sqrt(squares[b]))
+            similar_a[b] = value
+            similarity.setdefault(b, {})[a] = value
+
+    # Content part: tours sharing a feature, through the feature -> tours index.
+    if content_weight:
+        tours_by_feature = {}
+        for tour_id, features in tour_features.items():
+            for feature in features:
+                tours_by_feature.setdefault(feature, []).append(tour_id)
+        for a, features in tour_features.items():
+            if not features:
+                continue
+            shared = {}
+            for feature in features:
+                for b in tours_by_feature[feature]:
+                    if b != a:
+                        shared[b] = shared.get(b, 0) + 1
+            similar_a = similarity.setdefault(a, {})
+            for b, count in shared.items():
+                value = content_weight * count / math.sqrt(len(features) * len(tour_features[b]))
+                similar_a[b] = similar_a.get(b, 0.0) + value
+
+    return {
+        a: dict(heapq.nlargest(
+            neighbours, ((b, value) for b, value in row.items() if b in tour_features), key=itemgetter(1)
+        ))
+        for a, row in similarity.items()
+    }
+
+
+def feature_index(tour_features):
+    """Invert ``tour_features`` to ``{feature: [(tour_id, 1 / sqrt(feature count))]}``."""
+    index = {}
+    for tour_id, features in tour_features.items():
+        if features:
+            norm = 1 / math.sqrt(len(features))
+            for feature in features:
+                index.setdefault(feature, []).append((tour_id, norm))
+    return index
+
+
+def recommend_for(row, similarity, profile=None, features=None, limit=None):
+    """Top ``limit`` ``(tour_id, score)`` for one user's interaction ``row`` and interest ``profile``.
+
+    This is the user's row times the similarity matrix, plus the interest
+    profile times the (normalised) tour x feature matrix from
+    ``feature_index``. Tours already in ``row`` are left out.
+    """
+    limit = limit or settings.RECOMMENDATION_LIMIT
+    scores = {}
+    get = scores.get
+    for tour_id, weight in row.items():
+        for other, value in similarity.get(tour_id, {}).items():
+            scores[other] = get(other, 0.0) + weight * value
+    if profile and features:
+        pull = settings.RECOMMENDATION_INTEREST_WEIGHT
+        for feature, weight in profile.items():
+            for tour_id, norm in features.get(feature, ()):
+                scores[tour_id] = get(tour_id, 0.0) + pull * weight * norm
+    for tour_id in row:
+        scores.pop(tour_id, None)
+    return heapq.nlargest(limit, scores.items(), key=itemgetter(1))
+
+
+def rebuild(limit=None):
+    """Recompute every user's stored recommendations; returns RebuildStats.
+
+    Users with neither interactions nor interests get no rows and fall
+    back to popular tours in ``recommended_tours``.
+    """
+    timings = {}
+    started = time.perf_counter()
+    user_tours = user_tour_matrix()
+    tour_features = tour_feature_matrix()
+    names = feature_names()
+    profiles = {}
+    has_interests = ~Q(travel_style='') | ~Q(interests={})
+    for pk, travel_style, interests in get_user_model().objects.filter(
+        has_interests, is_active=True
+    ).values_list('pk', 'travel_style', 'interests').iterator(chunk_size=10000):
+        profile = interest_profile(travel_style, interests, names)
+        if profile:
+            profiles[pk] = profile
+    timings['load'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    similarity = item_similarity(user_tours, tour_features)
+    timings['similarity'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    features = feature_index(tour_features)
+    built_at = timezone.now()
+    rows = []
+    for user_id in user_tours.keys() | profiles.keys():
+        top = recommend_for(user_tours.get(user_id, {}), similarity, profiles.get(user_id), features, limit)
+        if top:
+            rows.append(TourRecommendations(
+                user_id=user_id, tour_ids=[tour_id for tour_id, _ in top], built_at=built_at
+            ))
+    timings['scoring'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with transaction.atomic():
+        TourRecommendations.objects.all().delete()
+        TourRecommendations.objects.bulk_create(rows, batch_size=WRITE_BATCH)
+    timings['write'] = time.perf_counter() - started
+
+    interactions = sum(len(row) for row in user_tours.values())
+    return RebuildStats(len(rows), len(similarity), interactions, timings)
+
+
+def recommended_tours(user, limit=10):
+    """Up to ``limit`` active tours for ``user``, in the order stored by the last rebuild.
+
+    Anonymous users and users without stored recommendations get the most
+    wishlisted and best rated tours they have not wishlisted instead.
+    """
+    tours = Tour.objects.filter(is_active=True).select_related('destination')
+    if user.is_authenticated:
+        tour_ids = TourRecommendations.objects.filter(user=user).values_list('tour_ids', flat=True).first()
+        if tour_ids:
+            # Ask for spares in case some tours were deactivated since the rebuild.
+            found = tours.in_bulk(tour_ids[:limit * 2])
+            recommended = [found[tour_id] for tour_id in tour_ids if tour_id in found][:limit]
+            if recommended:
+                return recommended
+    popular = tours.exclude(pk__in=wishlist_ids(user)).order_by('-wishlist_count', '-rating_avg', '-id')
+    return list(popular[:limit])
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import availability, seat_updates, summaries
+from .models import Booking, SeatHold, TourDate
+
+logger = logging.getLogger(__name__)
+
+
+class ReservationResult:
+    """Outcome of a seat reservation attempt."""
+
+    def __init__(self, tour_date_id, seats, reserved):
+        self.tour_date_id = tour_date_id
+        self.seats = seats
+        self.reserved = reserved
+
+    @property
+    def sold_out(self):
+        return not self.reserved
+
+    def __bool__(self):
+        return self.reserved
+
+    def __repr__(self):
+        status = 'reserved' if self.reserved else 'sold out'
+        return f"<ReservationResult tour_date={self.tour_date_id} seats={self.seats} {status}>"
+
+
+def _seats_changed(tour_date_id, delta):
+    """Propagate a committed seat change to the calendar, summaries and websocket clients."""
+    availability.seats_changed(tour_date_id, delta)
+    summaries.seats_changed(tour_date_id)
+    seat_updates.seats_changed(tour_date_id)
+
+
+def reserve_seats(tour_date_id, seats=1):
+    """Take ``seats`` from a departure in a single conditional UPDATE.
+
+    The seat check and the decrement happen inside the database, so
+    concurrent workers never read a stale count and no explicit row lock
+    is taken beyond the statement itself.
+    """
+    if seats < 1:
+        raise ValueError('At least one seat must be reserved.')
+    updated = TourDate.objects.filter(
+        pk=tour_date_id,
+        available_seats__gte=seats,
+    ).update(available_seats=F('available_seats') - seats)
+    if updated:
+        _seats_changed(tour_date_id, -seats)
+    return ReservationResult(tour_date_id, seats, reserved=updated == 1)
+
+
+def release_seats(tour_date_id, seats=1):
+    """Give ``seats`` back to a departure, e.g. after a cancellation."""
+    if seats < 1:
+        return 0
+    released = TourDate.objects.filter(pk=tour_date_id).update(
+        available_seats=F('available_seats') + seats
+    )
+    if released:
+        _seats_changed(tour_date_id, seats)
+    return released
+
+
+def book_seats(booking, tour_date_id):
+    """Reserve seats for ``booking`` and save it in the same transaction.
+
+    Returns the ``ReservationResult``; the booking is only saved when the
+    seats were actually taken. Pending bookings get a ``SeatHold`` that
+    expires after ``BOOKING_HOLD_MINUTES`` unless payment confirms it.
+    """
+    with transaction.atomic():
+        result = reserve_seats(tour_date_id, booking.participants)
+        if result.reserved:
+            booking.tour_date_id = tour_date_id
+            booking.save()
+            if booking.status == 'pending':
+                SeatHold.objects.create(
+                    booking=booking,
+                    tour_date_id=tour_date_id,
+                    seats=booking.participants,
+                    expires_at=timezone.now() + timedelta(minutes=settings.BOOKING_HOLD_MINUTES),
+                )
+    return result
+
+
+def confirm_hold(booking):
+    """Turn the hold on ``booking`` into a permanent reservation and confirm it.
+
+    The booking moves from pending to confirmed in a conditional UPDATE,
+    the mirror of the sweeper's pending to cancelled, so exactly one of
+    the two matches the row. Returns False when the sweeper won: the
+    seats were released and the booking must not be confirmed.
+    """
+    if booking.tour_date_id is None:
+        return True
+    with transaction.atomic():
+        confirmed = Booking.objects.filter(pk=booking.pk, status='pending').update(
+            status='confirmed', updated_at=timezone.now()
+        )
+        if confirmed:
+            SeatHold.objects.filter(booking=booking).delete()
+    if confirmed:
+        booking.status = 'confirmed'
+        return True
+    # Not pending any more: either confirmed before or cancelled by the sweeper.
+    return Booking.objects.filter(pk=booking.pk).exclude(status='cancelled').exists()
+
+
+def cancel_reservation(booking):
+    """Cancel ``booking`` and return its seats to the departure.
+
+    The status flip is conditional, so a double-submitted cancellation
+    releases the seats only once.
+    """
+    with transaction.atomic():
+        cancelled = Booking.objects.filter(pk=booking.pk).exclude(
+            status='cancelled'
+        ).update(status='cancelled', updated_at=timezone.now())
+        if cancelled and booking.tour_date_id is not None:
+            SeatHold.objects.filter(booking=booking).delete()
+            release_seats(booking.tour_date_id, booking.participants)
+    booking.status = 'cancelled'
+    return bool(cancelled)
+
+
+def release_expired_holds(now=None, batch_size=None):
+    """Cancel pending bookings whose hold expired and free their seats.
+
+    Holds are read in ``expires_at`` order from the index, one batch per
+    transaction, so the sweep never scans unexpired rows. Each booking is
+    cancelled with a conditional pending to cancelled UPDATE and its seats
+    are only released when that UPDATE matched, so a booking confirmed
+    in the meantime by ``confirm_hold`` or a webhook keeps its seats.
+    Returns the number of holds released.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.BOOKING_HOLD_SWEEP_BATCH
+    released = 0
+    while True:
+        with transaction.atomic():
+            # SKIP LOCKED keeps concurrent sweepers on disjoint batches where
+            # the backend has row locks; correctness rests on the UPDATE below.
+            holds = list(
+                SeatHold.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('expires_at')
+                .values_list('pk', 'booking_id', 'tour_date_id', 'seats')[:batch_size]
+            )
+            if not holds:
+                break
+            freed = Counter()
+            for _, booking_id, tour_date_id, seats in holds:
+                cancelled = Booking.objects.filter(pk=booking_id, status='pending').update(
+                    status='cancelled', updated_at=now
+                )
+                if cancelled:
+                    freed[tour_date_id] += seats
+                    released += 1
+            for tour_date_id, seats in freed.items():
+                release_seats(tour_date_id, seats)
+            SeatHold.objects.filter(pk__in=[pk for pk, _, _, _ in holds]).delete()
+        if len(holds) < batch_size:
+            break
+    return released
+
+
+async def sweep_expired_holds(interval=30, batch_size=None):
+    """Run ``release_expired_holds`` every ``interval`` seconds.
+
+    Meant to be scheduled as a task on the event loop that serves the
+    Channels application, or run on its own by ``release_expired_holds``.
+    """
+    while True:
+        try:
+            released = await sync_to_async(release_expired_holds)(batch_size=batch_size)
+            if released:
+                logger.info('Released %d expired seat holds', released)
+        except Exception:
+            logger.exception('Seat hold sweep failed')
+        await asyncio.sleep(interval)
@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from core.caching import get_or_build
+
+from .availability import tour_of, version_name
+from .models import TourDate
+
+logger = logging.getLogger(__name__)
+
+
+def group_name(tour_id):
+    return f'tour_{tour_id}'
+
+
+def _seat_rows(tour_id=None, tour_date_ids=None):
+    rows = TourDate.objects.filter(start_date__gte=timezone.localdate())
+    if tour_id is not None:
+        rows = rows.filter(tour_id=tour_id)
+    if tour_date_ids is not None:
+        rows = rows.filter(pk__in=list(tour_date_ids))
+    return [
+        {'tour_date_id': pk, 'start_date': start.isoformat(), 'available_seats': seats}
+        for pk, start, seats in rows.order_by('start_date', 'pk').values_list('pk', 'start_date', 'available_seats')
+    ]
+
+
+def snapshot(tour_id):
+    """Seats of every upcoming departure of ``tour_id``, shared through the cache.
+
+    Rebuilt at most once per seat change (the availability version), however
+    many clients connect or ask.
+    """
+    return get_or_build(
+        f'seats:{tour_id}',
+        lambda: _seat_rows(tour_id=tour_id),
+        version_names=(version_name(tour_id),),
+        timeout=settings.SEAT_SNAPSHOT_TIMEOUT,
+    )
+
+
+def update_message(tour_id, tour_date_ids):
+    dates = _seat_rows(tour_date_ids=tour_date_ids)
+    found = {row['tour_date_id'] for row in dates}
+    return {
+        'type': 'booking_update',
+        'action': 'availability',
+        'tour_id': tour_id,
+        'dates': dates,
+        # Deleted or already departed
+        'removed': sorted(set(tour_date_ids) - found),
+    }
+
+
+class SeatPublisher:
+    """Coalesce seat changes into at most ``rate`` group messages per second per tour.
+
+    The first change of a quiet tour is sent at once. Changes arriving
+    within the interval after a send are merged and go out in one message
+    when it ends, carrying the seat counts read at that moment, so clients
+    always end up with the latest numbers.
+    """
+
+    def __init__(self, rate=None):
+        self.rate = rate
+        self._pending = {}  # tour_id -> set of tour_date_ids
+        self._last_sent = {}  # tour_id -> monotonic time
+        self._scheduled = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+
+    @property
+    def interval(self):
+        return 1.0 / (self.rate or settings.SEAT_UPDATES_PER_SECOND)
+
+    def _add(self, tour_id, tour_date_ids):
+        """Queue changes; returns the delay before the tour may be sent, or None if already scheduled."""
+        with self._lock:
+            self._pending.setdefault(tour_id, set()).update(tour_date_ids)
+            if tour_id in self._scheduled:
+                return None
+            self._scheduled.add(tour_id)
+            last_sent = self._last_sent.get(tour_id)
+            if last_sent is None:
+                return 0.0
+            return max(0.0, last_sent + self.interval - time.monotonic())
+
+    def _take(self, tour_id):
+        with self._lock:
+            self._scheduled.discard(tour_id)
+            self._last_sent[tour_id] = time.monotonic()
+            return self._pending.pop(tour_id, set())
+
+    def publish(self, tour_id, tour_date_ids):
+        """Queue seat changes from synchronous code; they are sent from a timer thread.
+
+        Even the first change of a quiet tour goes through a timer (with no
+        delay), so the request that made it never waits on the seat query
+        or the channel layer.
+        """
+        delay = self._add(tour_id, tour_date_ids)
+        if delay is None:
+            return
+        timer = threading.Timer(delay, self._flush_in_thread, [tour_id])
+        timer.daemon = True
+        timer.start()
+
+    def _flush(self, tour_id):
+        tour_date_ids = self._take(tour_id)
+        channel_layer = get_channel_layer()
+        if not tour_date_ids or channel_layer is None:
+            return
+        try:
+            async_to_sync(channel_layer.group_send)(group_name(tour_id), update_message(tour_id, tour_date_ids))
+        except Exception:
+            logger.exception('Could not publish availability for tour %s', tour_id)
+
+    def _flush_in_thread(self, tour_id):
+        try:
+            self._flush(tour_id)
+        finally:
+            # Timer threads own their connection.
+            connection.close()
+
+    async def apublish(self, tour_id, tour_date_ids):
+        """Queue seat changes from the event loop; the trailing send is a task on it."""
+        delay = self._add(tour_id, tour_date_ids)
+        if delay is None:
+            return
+        if delay:
+            task = asyncio.get_running_loop().create_task(self._aflush(tour_id, delay))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        else:
+            await self._aflush(tour_id)
+
+    async def _aflush(self, tour_id, delay=0.0):
+        if delay:
+            await asyncio.sleep(delay)
+        tour_date_ids = self._take(tour_id)
+        channel_layer = get_channel_layer()
+        if not tour_date_ids or channel_layer is None:
+            return
+        try:
+            message = await database_sync_to_async(update_message)(tour_id, tour_date_ids)
+            await channel_layer.group_send(group_name(tour_id), message)
+        except Exception:
+            logger.exception('Could not publish availability for tour %s', tour_id)
+
+
+publisher = SeatPublisher()
+
+
+def seats_changed(tour_date_id):
+    """Publish a departure's new seat count to its tour group once the transaction commits."""
+    def publish():
+        tour_id = tour_of(tour_date_id)
+        if tour_id is not None:
+            publisher.publish(tour_id, [tour_date_id])
+    transaction.on_commit(publish)
+
+
+def _tour_date_changed(sender, instance, **kwargs):
+    transaction.on_commit(lambda: publisher.publish(instance.tour_id, [instance.pk]))
+
+
+def connect_signals():
+    post_save.connect(_tour_date_changed, sender=TourDate, dispatch_uid='seat_updates_tour_date_save')
+    post_delete.connect(_tour_date_changed, sender=TourDate, dispatch_uid='seat_updates_tour_date_delete')
@@ -0,0 +1,194 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Min, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.utils import timezone
+
+from core.models import Destination
+
+from . import facets
+from .models import Tour, TourDate
+from .pricing import from_cents, with_quotes
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_FIELDS = ['min_price', 'next_departure', 'open_seats']
+
+
+def _departure_stats(tour_ids):
+    """Per-tour cheapest price, first date and seat total over bookable departures."""
+    departures = TourDate.objects.filter(start_date__gte=timezone.localdate(), available_seats__gt=0)
+    if tour_ids is not None:
+        departures = departures.filter(tour_id__in=tour_ids)
+    rows = with_quotes(departures).values('tour_id').annotate(
+        min_cents=Min('unit_cents'), first_date=Min('start_date'), seats=Sum('available_seats'),
+    ).order_by()
+    return {row['tour_id']: row for row in rows}
+
+
+def refresh_tours(tour_ids=None, destination_ids=()):
+    """Recompute the listing summaries of ``tour_ids`` (every tour if None).
+
+    A tour's ``min_price`` is its cheapest bookable departure, or its own
+    price when it has none. Only rows whose values changed are written.
+    The destinations of these tours, plus ``destination_ids``, are then
+    refreshed too. Returns the number of tours updated.
+    """
+    if tour_ids is not None:
+        tour_ids = list(tour_ids)
+    stats = _departure_stats(tour_ids)
+    tours = with_quotes(Tour.objects.all(), tour_path='')
+    if tour_ids is not None:
+        tours = tours.filter(pk__in=tour_ids)
+    changed = []
+    destinations = set(destination_ids)
+    for pk, destination_id, unit_cents, *current in tours.values_list(
+        'pk', 'destination_id', 'unit_cents', *SUMMARY_FIELDS
+    ):
+        destinations.add(destination_id)
+        row = stats.get(pk)
+        if row:
+            summary = [from_cents(row['min_cents']), row['first_date'], row['seats']]
+        else:
+            summary = [from_cents(unit_cents), None, 0]
+        if summary != current:
+            changed.append(Tour(pk=pk, **dict(zip(SUMMARY_FIELDS, summary))))
+    Tour.objects.bulk_update(changed, SUMMARY_FIELDS, batch_size=500)
+    if changed:
+        # The price facets are bucketed on min_price.
+        facets.invalidate()
+    refresh_destinations(None if tour_ids is None else destinations)
+    return len(changed)
+
+
+def refresh_destinations(destination_ids=None):
+    """Recompute destination summaries from their active tours; returns rows updated."""
+    tours = Tour.objects.filter(is_active=True)
+    destinations = Destination.objects.all()
+    if destination_ids is not None:
+        tours = tours.filter(destination_id__in=destination_ids)
+        destinations = destinations.filter(pk__in=destination_ids)
+    stats = {
+        row['destination_id']: [row['price'], row['departure'], row['seats']]
+        for row in tours.values('destination_id').annotate(
+            price=Min('min_price'), departure=Min('next_departure'), seats=Sum('open_seats'),
+        ).order_by()
+    }
+    changed = []
+    for pk, *current in destinations.values_list('pk', *SUMMARY_FIELDS):
+        summary = stats.get(pk, [None, None, 0])
+        if summary != current:
+            changed.append(Destination(pk=pk, **dict(zip(SUMMARY_FIELDS, summary))))
+    Destination.objects.bulk_update(changed, SUMMARY_FIELDS, batch_size=500)
+    return len(changed)
+
+
+def refresh_later(tour_ids, destination_ids=()):
+    """Refresh once the current transaction commits, so readers never see uncommitted seats."""
+    tour_ids = list(tour_ids)
+    destination_ids = list(destination_ids)
+    transaction.on_commit(lambda: refresh_tours(tour_ids, destination_ids))
+
+
+class SeatChangeRefresher:
+    """Refresh the summaries of tours whose seats changed, a few seconds later and together.
+
+    Bookings and cancellations only queue their departure; the first one
+    starts a timer and every change within ``delay`` seconds is refreshed
+    in one pass when it fires. The request path never writes the tour or
+    destination rows, so popular tours do not become hot rows with writers
+    queueing for the database lock behind them.
+    """
+
+    def __init__(self, delay=None):
+        self.delay = delay
+        self._pending = set()  # tour_date_ids
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def add(self, tour_date_ids):
+        with self._lock:
+            self._pending.update(tour_date_ids)
+            if self._timer is not None:
+                return
+            delay = self.delay if self.delay is not None else settings.SUMMARY_REFRESH_DELAY
+            self._timer = threading.Timer(delay, self._flush_in_thread)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """Refresh every queued tour now; returns the number of tours updated.
+
+        The timer is a daemon thread, so anything that exits right after
+        changing seats (management commands, scripts) must flush itself;
+        an atexit hook does it as a last resort.
+        """
+        with self._lock:
+            tour_date_ids, self._pending = self._pending, set()
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if not tour_date_ids:
+            return 0
+        tour_ids = set(TourDate.objects.filter(pk__in=tour_date_ids).values_list('tour_id', flat=True))
+        return refresh_tours(tour_ids) if tour_ids else 0
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        except Exception:
+            # The daily refresh_listing_summaries run catches up.
+            logger.exception('Could not refresh listing summaries after seat changes')
+        finally:
+            # Timer threads own their connection.
+            connection.close()
+
+
+refresher = SeatChangeRefresher()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        refresher.flush()
+    except Exception:
+        logger.exception('Could not refresh listing summaries at exit')
+
+
+def seats_changed(tour_date_id):
+    """Queue a summary refresh of the departure's tour once the transaction commits."""
+    transaction.on_commit(lambda: refresher.add([tour_date_id]))
+
+
+def _tour_date_changed(sender, instance, **kwargs):
+    refresh_later([instance.tour_id])
+
+
+def _remember_destination(sender, instance, **kwargs):
+    # A tour moved to another destination must also leave the old one's summary.
+    instance._previous_destination_id = None
+    if instance.pk:
+        instance._previous_destination_id = (
+            Tour.objects.filter(pk=instance.pk).values_list('destination_id', flat=True).first()
+        )
+
+
+def _tour_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_destination_id', None)
+    refresh_later([instance.pk], [previous] if previous else [])
+
+
+def _tour_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: refresh_destinations([instance.destination_id]))
+
+
+def connect_signals():
+    post_save.connect(_tour_date_changed, sender=TourDate, dispatch_uid='summaries_tour_date_save')
+    post_delete.connect(_tour_date_changed, sender=TourDate, dispatch_uid='summaries_tour_date_delete')
+    pre_save.connect(_remember_destination, sender=Tour, dispatch_uid='summaries_tour_pre_save')
+    post_save.connect(_tour_saved, sender=Tour, dispatch_uid='summaries_tour_save')
+    post_delete.connect(_tour_deleted, sender=Tour, dispatch_uid='summaries_tour_delete')
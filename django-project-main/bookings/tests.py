@@ -1,3 +1,1017 @@
-from django.test import TestCase
+import io
+import math
+import os
+import random
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import Wishlist
+from core.models import Amenity, Category, Destination, OutboundEmail
+from core.ratings import recompute_ratings
+from core.search import search_objects
+from core.testing import QueryBudgetTestMixin
+from vendors.models import Vendor
+
+from . import availability, invoices, pricing, recommendations, seat_updates, summaries, views, webhooks
+from .facets import get_tour_index
+from .fake_provider import FakeProvider
+from .models import Booking, Payment, SeatHold, Tour, TourDate, TourRecommendations, TourReview, WebhookEvent
+from .reservations import book_seats, confirm_hold, release_expired_holds, release_seats, reserve_seats
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def create_user(username, **fields):
+    return get_user_model().objects.create_user(
+        email=f'{username}@example.com', password='secret', username=username, **fields
+    )
+
+
+def create_tour(name='Coastal Walk', price='100.00', seats=20, departures=1, destination=None, **fields):
+    """An active tour with ``departures`` weekly departures of ``seats`` seats each."""
+    if destination is None:
+        destination = Destination.objects.create(
+            name=f'{name} Coast', description='', country='Portugal', city='Lagos',
+            latitude=Decimal('37.1'), longitude=Decimal('-8.6'), image='destinations/coast.jpg',
+        )
+    vendor = Vendor.objects.filter(company_name='Test Tours').first()
+    if vendor is None:
+        vendor = Vendor.objects.create(
+            user=create_user('vendor'), company_name='Test Tours', slug='test-tours', description='',
+            address='', registration_number='1', tax_number='1', phone_number='1', email='vendor@example.com',
+        )
+    fields.setdefault('group_size_max', 10)
+    fields.setdefault('duration_days', 3)
+    tour = Tour.objects.create(
+        name=name, description='', destination=destination, duration_nights=2,
+        group_size_min=1, price=Decimal(price), featured_image='tours/tour.jpg', meeting_point='',
+        vendor=vendor, **fields
+    )
+    start = timezone.localdate() + timedelta(days=14)
+    for week in range(departures):
+        TourDate.objects.create(
+            tour=tour, start_date=start + timedelta(weeks=week),
+            end_date=start + timedelta(weeks=week, days=2), available_seats=seats,
+        )
+    return tour
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class ConcurrentReservationTests(TransactionTestCase):
+    """Reserve and release seats from several threads at once, as concurrent requests do."""
+
+    threads = 8
+    attempts = 10
+
+    def setUp(self):
+        self.tour = create_tour(seats=30)
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+
+    def run_threads(self, work):
+        errors = []
+        start = threading.Barrier(self.threads)
+
+        def worker(number):
+            try:
+                start.wait()
+                work(number)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_reservations_never_oversell(self):
+        reserved = []
+
+        def work(number):
+            for _ in range(self.attempts):
+                if reserve_seats(self.tour_date.pk, 2):
+                    reserved.append(2)
+
+        # 8 threads x 10 attempts x 2 seats asks for far more than the 30 seats there are.
+        self.run_threads(work)
+        self.tour_date.refresh_from_db()
+        self.assertEqual(sum(reserved), 30)
+        self.assertEqual(self.tour_date.available_seats, 0)
+
+    def test_reserve_and_release_add_up(self):
+        taken = []
+
+        def work(number):
+            for attempt in range(self.attempts):
+                seats = 1 + (number + attempt) % 3
+                if reserve_seats(self.tour_date.pk, seats):
+                    taken.append(seats)
+                    if attempt % 2:
+                        release_seats(self.tour_date.pk, seats)
+                        taken.append(-seats)
+                self.assertGreaterEqual(
+                    TourDate.objects.values_list('available_seats', flat=True).get(pk=self.tour_date.pk), 0
+                )
+
+        self.run_threads(work)
+        self.tour_date.refresh_from_db()
+        self.assertGreaterEqual(self.tour_date.available_seats, 0)
+        self.assertEqual(self.tour_date.available_seats + sum(taken), 30)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class BookTourViewTests(TestCase):
+    def setUp(self):
+        self.tour = create_tour(price='100.00', seats=5)
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+        self.user = create_user('traveller')
+        self.client.force_login(self.user)
+        self.url = reverse('bookings:book_tour', args=[self.tour.pk])
+
+    def post(self, **data):
+        fields = {
+            'full_name': 'Ana Silva', 'email': 'ana@example.com', 'phone': '123456',
+            'participants': 2, 'payment_method': 'credit_card', 'tour_date': self.tour_date.pk,
+        }
+        fields.update(data)
+        return self.client.post(self.url, fields)
+
+    def test_get_renders_form(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'name="tour_date"')
+
+    def test_post_reserves_seats_and_holds_them(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post()
+        booking = Booking.objects.get(user=self.user)
+        self.assertRedirects(response, reverse('bookings:payment', args=[booking.pk]), fetch_redirect_response=False)
+        self.assertEqual(booking.tour_date, self.tour_date)
+        self.assertEqual(booking.participants, 2)
+        self.assertEqual(booking.status, 'pending')
+        self.assertGreater(booking.total_amount, Decimal('200.00'))
+        self.tour_date.refresh_from_db()
+        self.assertEqual(self.tour_date.available_seats, 3)
+        self.assertEqual(SeatHold.objects.get(booking=booking).seats, 2)
+
+    def test_sold_out_departure_is_refused(self):
+        tour_url = reverse('bookings:tour_detail', args=[self.tour.pk])
+        self.assertRedirects(self.post(participants=6), tour_url, fetch_redirect_response=False)
+        self.assertFalse(Booking.objects.exists())
+        self.post(participants=5)
+        self.assertRedirects(self.post(participants=1), tour_url, fetch_redirect_response=False)
+        self.assertEqual(Booking.objects.count(), 1)
+        self.assertEqual(TourDate.objects.get(pk=self.tour_date.pk).available_seats, 0)
+
+    def test_invalid_input_is_a_form_error(self):
+        other = create_tour(name='Mountain Trek', destination=self.tour.destination)
+        for data in (
+            {'tour_date': 'abc'},
+            {'tour_date': TourDate.objects.get(tour=other).pk},
+            {'tour_date': ''},
+            {'participants': 0},
+            {'participants': -1},
+            {'participants': 11},
+        ):
+            with self.subTest(data=data):
+                response = self.post(**data)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.context['form'].errors)
+        self.assertFalse(Booking.objects.exists())
+        self.assertEqual(TourDate.objects.get(pk=self.tour_date.pk).available_seats, 5)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class SeatHoldTests(TestCase):
+    def setUp(self):
+        self.tour = create_tour(seats=10)
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+        self.booking = Booking(
+            user=create_user('traveller'), tour=self.tour, booking_reference='HOLD1', participants=3
+        )
+        book_seats(self.booking, self.tour_date.pk)
+        self.expired = timezone.now() + timedelta(days=1)
+
+    def seats_left(self):
+        return TourDate.objects.get(pk=self.tour_date.pk).available_seats
+
+    def test_sweeper_releases_expired_pending_booking(self):
+        self.assertEqual(release_expired_holds(now=self.expired), 1)
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).status, 'cancelled')
+        self.assertEqual(self.seats_left(), 10)
+        self.assertFalse(confirm_hold(self.booking))
+
+    def test_sweeper_keeps_seats_of_booking_confirmed_elsewhere(self):
+        # Confirmed without going through confirm_hold, so the hold row is left behind.
+        Booking.objects.filter(pk=self.booking.pk).update(status='confirmed')
+        self.assertEqual(release_expired_holds(now=self.expired), 0)
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).status, 'confirmed')
+        self.assertEqual(self.seats_left(), 7)
+        self.assertFalse(SeatHold.objects.exists())
+
+    def test_confirmed_hold_is_not_swept(self):
+        self.assertTrue(confirm_hold(self.booking))
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).status, 'confirmed')
+        self.assertEqual(release_expired_holds(now=self.expired), 0)
+        self.assertEqual(self.seats_left(), 7)
+        self.assertTrue(confirm_hold(self.booking))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, AVAILABILITY_CALENDAR_TTL=5)
+class AvailabilityCalendarTests(TestCase):
+    def setUp(self):
+        # Calendars and their versions are process-wide and outlive each test.
+        availability._calendars.clear()
+        cache.clear()
+        self.tour = create_tour(seats=20)
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+        self.day = self.tour_date.start_date
+
+    def test_bookings_and_edits_show_up_immediately(self):
+        self.assertEqual(availability.get_calendar(self.tour.pk).seats_on(self.day), 20)
+        booking = Booking(user=create_user('traveller'), tour=self.tour, booking_reference='CAL1', participants=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            book_seats(booking, self.tour_date.pk)
+        self.assertEqual(availability.get_calendar(self.tour.pk).seats_on(self.day), 17)
+        with self.captureOnCommitCallbacks(execute=True):
+            release_seats(self.tour_date.pk, 3)
+        self.assertEqual(availability.get_calendar(self.tour.pk).seats_on(self.day), 20)
+
+        self.tour_date.available_seats = 12
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tour_date.save()
+        self.assertEqual(availability.get_calendar(self.tour.pk).seats_on(self.day), 12)
+
+    def test_changes_from_other_processes_are_picked_up_within_the_ttl(self):
+        loaded = availability.get_calendar(self.tour.pk)
+        # Another process books seats; its version bump never reaches this
+        # process's memory cache.
+        TourDate.objects.filter(pk=self.tour_date.pk).update(available_seats=4)
+        with mock.patch.object(availability.time, 'monotonic', return_value=loaded.loaded_at + 4):
+            self.assertEqual(availability.get_calendar(self.tour.pk).seats_on(self.day), 20)
+        with mock.patch.object(availability.time, 'monotonic', return_value=loaded.loaded_at + 5):
+            self.assertEqual(availability.get_calendar(self.tour.pk).seats_on(self.day), 4)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class PricingTests(TestCase):
+    def test_money_rounds_halves_up_to_the_cent(self):
+        self.assertEqual(pricing.money('2.675'), Decimal('2.68'))
+        self.assertEqual(pricing.money('0.125'), Decimal('0.13'))
+        self.assertEqual(pricing.money('0.124'), Decimal('0.12'))
+
+    def test_minor_units_are_exact(self):
+        # int(0.29 * 100) is 28 in floating point.
+        self.assertEqual(pricing.to_minor_units(Decimal('0.29')), 29)
+        self.assertEqual(pricing.to_minor_units(Decimal('1234.565')), 123457)
+        self.assertEqual(pricing.from_cents(123457), Decimal('1234.57'))
+
+    def test_unit_price_takes_the_lower_discount_and_the_date_modifier(self):
+        tour = create_tour(price='100.00', discount_price=Decimal('80.00'))
+        tour_date = TourDate.objects.get(tour=tour)
+        tour_date.price_modifier = Decimal('1.15')
+        self.assertEqual(pricing.unit_price(tour), Decimal('80.00'))
+        self.assertEqual(pricing.unit_price(tour, tour_date), Decimal('92.00'))
+        tour.discount_price = Decimal('120.00')
+        self.assertEqual(pricing.unit_price(tour), Decimal('100.00'))
+
+    def test_quote_parts_add_up_to_the_total(self):
+        tour = create_tour(price='33.33')
+        quote = pricing.quote(tour, participants=3)
+        self.assertEqual(quote.base_price, Decimal('99.99'))
+        # Taxed once on the whole base: 5% of 99.99 is 5.00, not 3 x 1.67.
+        self.assertEqual((quote.gst_amount, quote.sgst_amount), (Decimal('5.00'), Decimal('5.00')))
+        self.assertEqual(quote.total_amount, Decimal('109.99'))
+        self.assertEqual(quote.base_price + quote.gst_amount + quote.sgst_amount, quote.total_amount)
+
+    def test_sql_quotes_match_python_quotes_to_the_cent(self):
+        rng = random.Random(17)
+        for number in range(12):
+            discount = Decimal(rng.randint(100, 99999)) / 100 if number % 3 else None
+            tour = create_tour(
+                name=f'Tour {number}', price=str(Decimal(rng.randint(100, 99999)) / 100),
+                departures=2, discount_price=discount,
+            )
+            for tour_date in TourDate.objects.filter(tour=tour):
+                tour_date.price_modifier = Decimal(rng.randint(50, 200)) / 100
+                tour_date.save()
+        for participants in (1, 3, 7):
+            dates = pricing.with_quotes(TourDate.objects.select_related('tour'), participants)
+            for tour_date in dates:
+                quote = pricing.quote(tour_date.tour, tour_date, participants)
+                self.assertEqual(
+                    [pricing.from_cents(tour_date.unit_cents), pricing.from_cents(tour_date.base_cents),
+                     pricing.from_cents(tour_date.gst_cents), pricing.from_cents(tour_date.sgst_cents),
+                     pricing.from_cents(tour_date.total_cents)],
+                    [quote.unit_price, quote.base_price, quote.gst_amount, quote.sgst_amount, quote.total_amount],
+                )
+            for tour in pricing.with_quotes(Tour.objects.all(), participants, tour_path=''):
+                self.assertEqual(pricing.from_cents(tour.total_cents), pricing.quote(tour, participants=participants).total_amount)
+
+
+class RatingAggregateTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tours = [create_tour(), create_tour(name='Mountain Trek')]
+        User = get_user_model()
+        # No passwords: hashing thirty of them would be most of the test.
+        cls.users = User.objects.bulk_create([
+            User(email=f'reviewer{number}@example.com', username=f'reviewer{number}') for number in range(30)
+        ])
+
+    def assertAggregates(self, tour):
+        reviews = list(TourReview.objects.filter(tour=tour).values_list('rating', flat=True))
+        tour = Tour.objects.get(pk=tour.pk)
+        self.assertEqual((tour.rating_count, tour.rating_sum), (len(reviews), sum(reviews)))
+        self.assertEqual(tour.rating_avg, sum(reviews) / len(reviews) if reviews else 0)
+
+    def review(self, user, tour, rating):
+        return TourReview.objects.create(user=user, tour=tour, rating=rating, comment='')
+
+    def test_reviews_added_changed_moved_and_deleted(self):
+        first = self.review(self.users[0], self.tours[0], 5)
+        self.review(self.users[1], self.tours[0], 2)
+        self.assertAggregates(self.tours[0])
+        first.rating = 4
+        first.save()
+        self.assertAggregates(self.tours[0])
+        first.tour = self.tours[1]
+        first.save()
+        for tour in self.tours:
+            self.assertAggregates(tour)
+        TourReview.objects.get(user=self.users[1]).delete()
+        self.assertAggregates(self.tours[0])
+        self.assertEqual(Tour.objects.get(pk=self.tours[0].pk).rating_avg, 0)
+
+    def test_averages_do_not_drift_over_many_changes(self):
+        rng = random.Random(3)
+        reviews = {}
+        for _ in range(600):
+            user = rng.choice(self.users)
+            review = reviews.get(user.pk)
+            if review is None:
+                reviews[user.pk] = self.review(user, rng.choice(self.tours), rng.randint(1, 5))
+            elif rng.random() < 0.3:
+                review.delete()
+                del reviews[user.pk]
+            else:
+                review.rating = rng.randint(1, 5)
+                review.save()
+        for tour in self.tours:
+            self.assertAggregates(tour)
+
+        # Back to one 3-star review: exactly 3, not 2.9999999999999996.
+        TourReview.objects.all().delete()
+        self.review(self.users[0], self.tours[0], 3)
+        self.assertEqual(Tour.objects.get(pk=self.tours[0].pk).rating_avg, 3.0)
+
+    def test_recompute_matches_the_incremental_aggregates(self):
+        for number, user in enumerate(self.users[:7]):
+            self.review(user, self.tours[number % 2], 1 + number % 5)
+        before = list(Tour.objects.order_by('pk').values_list('rating_avg', 'rating_count', 'rating_sum'))
+        Tour.objects.update(rating_avg=0, rating_count=0, rating_sum=0)
+        self.assertEqual(recompute_ratings(Tour, TourReview, 'tour'), 2)
+        self.assertEqual(list(Tour.objects.order_by('pk').values_list('rating_avg', 'rating_count', 'rating_sum')), before)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class ListingSummaryTests(TestCase):
+    def setUp(self):
+        self.tour = create_tour(price='1200.00', seats=10, discount_price=Decimal('900.00'))
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+        summaries.refresh_tours()
+        self.refresher = summaries.SeatChangeRefresher(delay=3600)
+        patcher = mock.patch.object(summaries, 'refresher', self.refresher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_seat_changes_are_refreshed_together_later(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seats(self.tour_date.pk, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            reserve_seats(self.tour_date.pk, 3)
+        # Nothing written to the tour on the booking path.
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).open_seats, 10)
+        # One pass for both bookings: the tour and its destination read and written once.
+        with self.assertNumQueries(7):
+            self.assertEqual(self.refresher.flush(), 1)
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).open_seats, 5)
+        self.assertEqual(self.refresher.flush(), 0)
+
+    def test_price_filter_and_facets_use_the_listed_price(self):
+        create_tour(name='Mountain Trek', price='800.00', destination=self.tour.destination)
+        summaries.refresh_tours()
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).min_price, Decimal('900.00'))
+        # 1200 list price, but bookable from 900: it is in the 500-1000 bucket and under 1000.
+        response = self.client.get(reverse('bookings:tour_list'), {'max_price': '1000'})
+        self.assertEqual({tour.name for tour in response.context['tours']}, {'Coastal Walk', 'Mountain Trek'})
+        response = self.client.get(reverse('bookings:tour_list'), {'min_price': '850'})
+        self.assertEqual([tour.name for tour in response.context['tours']], ['Coastal Walk'])
+        counts = get_tour_index().counts()
+        self.assertEqual(counts['price']['500-1000'], 2)
+        self.assertNotIn('1000-2500', {value for value, count in counts['price'].items() if count})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class SummaryFlushTests(TransactionTestCase):
+    def setUp(self):
+        self.tour = create_tour(seats=10)
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+        summaries.refresh_tours()
+        self.refresher = summaries.SeatChangeRefresher(delay=3600)
+        patcher = mock.patch.object(summaries, 'refresher', self.refresher)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        booking = Booking(user=create_user('traveller'), tour=self.tour, booking_reference='EXP1', participants=4)
+        book_seats(booking, self.tour_date.pk)
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).open_seats, 10)
+
+    def test_one_shot_commands_refresh_before_returning(self):
+        SeatHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        call_command('release_expired_holds', stdout=io.StringIO())
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).open_seats, 10)
+        self.assertFalse(self.refresher._pending)
+
+        reserve_seats(self.tour_date.pk, 3)
+        call_command('process_webhooks', workers=1, stdout=io.StringIO())
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).open_seats, 7)
+
+    def test_pending_refreshes_are_flushed_at_exit(self):
+        summaries._flush_at_exit()
+        self.assertEqual(Tour.objects.get(pk=self.tour.pk).open_seats, 6)
+        self.assertIsNone(self.refresher._timer)
+
+
+class TourListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tours = [create_tour(name=f'Tour {number:02d}') for number in range(14)]
+
+    def test_first_page_renders_cards_and_loads_the_next(self):
+        response = self.client.get(reverse('bookings:tour_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Tour 13')
+        self.assertNotContains(response, 'Tour 01<')
+        self.assertNotContains(response, 'tours-data')
+        cursor = response.context['next_cursor']
+        self.assertTrue(cursor)
+        self.assertContains(response, f'cursor={cursor}')
+
+        response = self.client.get(reverse('bookings:tour_list'), {'cursor': cursor}, headers={'HX-Request': 'true'})
+        self.assertTemplateUsed(response, 'bookings/partials/tour_cards.html')
+        self.assertTemplateNotUsed(response, 'bookings/tour_list.html')
+        self.assertEqual([tour.name for tour in response.context['tours']], ['Tour 01', 'Tour 00'])
+        self.assertIsNone(response.context['next_cursor'])
+
+    def test_bad_cursor_is_a_bad_request(self):
+        for cursor in ('garbage', 'WyIyMDI0LTAxLTAxVDAwOjAwOjAwKzAwOjAwIiwgImFiYyJd', 'WzEsIDJd'):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('bookings:tour_list'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+def _cosine(a, b):
+    dot = sum(weight * b.get(key, 0) for key, weight in a.items())
+    norms = math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values()))
+    return dot / norms if norms else 0.0
+
+
+class SimilarityTests(TestCase):
+    def test_sparse_similarity_matches_dense_cosines(self):
+        rng = random.Random(5)
+        tours = range(1, 16)
+        user_tours = {
+            user: {tour: rng.choice([1.0, 2.0, 3.0]) for tour in rng.sample(tours, rng.randint(1, 6))}
+            for user in range(40)
+        }
+        tour_features = {tour: {('category', rng.randint(1, 4)), ('amenity', rng.randint(1, 4))} for tour in tours}
+        columns = {tour: {user: row[tour] for user, row in user_tours.items() if tour in row} for tour in tours}
+        similarity = recommendations.item_similarity(user_tours, tour_features, neighbours=100, content_weight=0.3)
+        for a in tours:
+            for b in tours:
+                if a == b:
+                    continue
+                shared = len(tour_features[a] & tour_features[b])
+                expected = 0.7 * _cosine(columns[a], columns[b]) + 0.3 * shared / 2
+                with self.subTest(a=a, b=b):
+                    self.assertAlmostEqual(similarity.get(a, {}).get(b, 0.0), expected)
+
+    def test_neighbours_are_the_most_similar_recommendable_tours(self):
+        user_tours = {1: {1: 1.0, 2: 1.0, 3: 1.0}, 2: {1: 1.0, 2: 1.0}, 3: {1: 1.0, 4: 1.0}}
+        tour_features = {1: set(), 2: set(), 3: set()}
+        similarity = recommendations.item_similarity(user_tours, tour_features, neighbours=1, content_weight=0)
+        self.assertEqual(list(similarity[1]), [2])
+        self.assertNotIn(4, similarity[1])
+        self.assertEqual(similarity[4], {1: 1 / math.sqrt(3)})
+
+    def test_interest_profiles_match_names_and_slugs(self):
+        names = {'hiking': ('category', 1), 'mountains': ('category', 1), 'wi-fi': ('amenity', 2)}
+        self.assertEqual(
+            recommendations.interest_profile('Hiking', {' Wi-Fi ': '2', 'opera': 5, 'mountains': 'lots'}, names),
+            {('category', 1): 2.0, ('amenity', 2): 2.0},
+        )
+        self.assertEqual(recommendations.interest_profile('', ['WI-FI', 'opera'], names), {('amenity', 2): 1.0})
+        self.assertEqual(recommendations.interest_profile('', 'hiking', names), {})
+
+    @override_settings(RECOMMENDATION_INTEREST_WEIGHT=1.0)
+    def test_scores_leave_out_tours_already_seen(self):
+        similarity = {1: {2: 0.5, 3: 0.4}, 2: {1: 0.5, 3: 0.9}}
+        features = recommendations.feature_index({4: {('category', 1)}, 3: {('category', 1), ('amenity', 1)}})
+        top = recommendations.recommend_for({1: 3.0, 2: 1.0}, similarity, {('category', 1): 1.0}, features, limit=5)
+        self.assertEqual([tour for tour, _ in top], [3, 4])
+        self.assertAlmostEqual(top[0][1], 3.0 * 0.4 + 0.9 + 1 / math.sqrt(2))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class RecommendationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.hiking = Category.objects.create(name='Hiking', slug='hiking', description='', icon='')
+        cls.tours = [create_tour(name=name, departures=0) for name in ('Coast', 'Cliffs', 'Caves', 'Summit')]
+        cls.tours[3].categories.add(cls.hiking)
+        cls.users = [create_user(name) for name in ('ana', 'ben', 'cai', 'dee')]
+        User = get_user_model()
+        User.objects.filter(pk=cls.users[3].pk).update(interests=['hiking'])
+        for user, tours in ((0, (0, 1)), (1, (0, 1, 2)), (2, (0,))):
+            for tour in tours:
+                Booking.objects.create(
+                    user=cls.users[user], tour=cls.tours[tour], booking_reference=f'R{user}{tour}',
+                    full_name='Traveller', email='traveller@example.com', total_amount=Decimal('100.00'),
+                    status='confirmed',
+                )
+        Tour.objects.filter(pk=cls.tours[2].pk).update(wishlist_count=4)
+
+    def recommended(self, user):
+        return [tour.name for tour in recommendations.recommended_tours(user)]
+
+    def test_rebuild_stores_ranked_tours_per_user(self):
+        out = io.StringIO()
+        call_command('rebuild_recommendations', stdout=out)
+        self.assertIn('Stored recommendations for 3 users over 4 tours from 6 interactions', out.getvalue())
+        # Travellers who booked the Coast also booked the Cliffs, more often than the Caves.
+        self.assertEqual(self.recommended(self.users[2])[:2], ['Cliffs', 'Caves'])
+        self.assertEqual(self.recommended(self.users[0])[0], 'Caves')
+        self.assertEqual(self.recommended(self.users[3]), ['Summit'])
+        # Nothing relates to everything Ben booked, so Ben is left to the popular fallback.
+        self.assertFalse(TourRecommendations.objects.filter(user=self.users[1]).exists())
+
+        Tour.objects.filter(pk=self.tours[1].pk).update(is_active=False)
+        self.assertEqual(self.recommended(self.users[2])[0], 'Caves')
+        call_command('rebuild_recommendations', limit=1, stdout=io.StringIO())
+        self.assertEqual(
+            TourRecommendations.objects.get(user=self.users[2]).tour_ids, [self.tours[2].pk]
+        )
+
+    def test_users_without_recommendations_get_popular_tours(self):
+        self.assertEqual(self.recommended(AnonymousUser())[0], 'Caves')
+        Wishlist.objects.create(user=self.users[0], tour=self.tours[2])
+        self.assertNotIn('Caves', self.recommended(self.users[0]))
+
+    def test_view_renders_the_stored_order(self):
+        recommendations.rebuild()
+        self.client.force_login(self.users[2])
+        response = self.client.get(reverse('bookings:recommended_tours'))
+        self.assertEqual([tour.name for tour in response.context['tours']][:2], ['Cliffs', 'Caves'])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        self.hiking = Category.objects.create(name='Hiking', description='', icon='fas fa-hiking')
+        self.wifi = Amenity.objects.create(name='Wi-Fi', icon='fas fa-wifi')
+        self.walk = create_tour(name='Coastal Walk')
+        self.walk.categories.add(self.hiking)
+        self.walk.amenities.add(self.wifi)
+        create_tour(name='City Break', destination=self.walk.destination, duration_days=2)
+        summaries.refresh_tours()
+
+    def sidebar(self, **params):
+        response = self.client.get(reverse('bookings:tour_list'), params)
+        return response, {
+            section['name']: {entry['label']: entry for entry in section['entries']}
+            for section in response.context['facets']
+        }
+
+    def test_sidebar_is_rendered_with_counts(self):
+        response, sidebar = self.sidebar()
+        self.assertEqual(response.context['facet_total'], 2)
+        self.assertEqual(sidebar['category']['Hiking']['count'], 1)
+        self.assertEqual(sidebar['amenity']['Wi-Fi']['count'], 1)
+        self.assertEqual(sidebar['country']['Portugal']['count'], 2)
+        self.assertContains(response, 'data-facet="category"')
+        self.assertContains(response, f'href="?{sidebar["category"]["Hiking"]["query"]}"')
+
+        response, sidebar = self.sidebar(category='hiking')
+        self.assertEqual([tour.name for tour in response.context['tours']], ['Coastal Walk'])
+        hiking = sidebar['category']['Hiking']
+        self.assertTrue(hiking['active'])
+        self.assertEqual(hiking['query'], '')
+        self.assertEqual(sidebar['country']['Portugal']['count'], 1)
+
+    def test_infinite_scroll_pages_skip_the_facets(self):
+        response = self.client.get(reverse('bookings:tour_list'), headers={'HX-Request': 'true'})
+        self.assertIsNone(response.context['facets'])
+
+    def test_category_and_amenity_changes_invalidate_the_index(self):
+        self.assertEqual(get_tour_index().labels['category'], {'hiking': 'Hiking'})
+        self.hiking.name = 'Trekking'
+        self.hiking.save()
+        self.assertEqual(get_tour_index().labels['category'], {'hiking': 'Trekking'})
+        self.hiking.delete()
+        self.assertEqual(get_tour_index().counts()['category'], {})
+        self.wifi.delete()
+        self.assertEqual(get_tour_index().counts()['amenity'], {})
+
+
+@override_settings(
+    CHANNEL_LAYERS=IN_MEMORY_LAYER, STRIPE_WEBHOOK_SECRET='whsec_test', PAYPAL_WEBHOOK_ID='WH-test',
+    INVOICE_RENDER_ON_CONFIRM=False,
+)
+class WebhookTests(TestCase):
+    def setUp(self):
+        self.tour = create_tour(seats=50)
+        self.tour_date = TourDate.objects.get(tour=self.tour)
+        self.user = create_user('traveller')
+        self.booking = self.book('PAY1')
+        self.provider = FakeProvider(seed=7, stripe_secret='whsec_test')
+        patcher = mock.patch('paypalrestsdk.WebhookEvent.verify', return_value=True)
+        self.paypal_verify = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def book(self, reference):
+        booking = Booking(
+            user=self.user, tour=self.tour, booking_reference=reference, participants=1,
+            full_name='Traveller', email='traveller@example.com', total_amount=self.tour.price,
+        )
+        book_seats(booking, self.tour_date.pk)
+        return booking
+
+    def process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return webhooks.drain()
+
+    def test_unverified_events_are_refused(self):
+        payload = self.provider.stripe_payment(self.booking)
+        with override_settings(STRIPE_WEBHOOK_SECRET=''), self.assertLogs('bookings.webhooks', 'ERROR'):
+            self.assertEqual(self.provider.deliver('stripe', payload), 400)
+        self.assertEqual(FakeProvider().deliver('stripe', payload), 400)
+        self.assertEqual(self.provider.deliver('stripe', payload, HTTP_STRIPE_SIGNATURE='t=1,v1=00'), 400)
+
+        payload = self.provider.paypal_sale(self.booking)
+        self.paypal_verify.return_value = False
+        self.assertEqual(self.provider.deliver('paypal', payload), 400)
+        self.paypal_verify.return_value = True
+        self.assertEqual(
+            self.provider.deliver('paypal', payload, HTTP_PAYPAL_CERT_URL='https://attacker.example/cert.pem'), 400
+        )
+        with override_settings(PAYPAL_WEBHOOK_ID=''), self.assertLogs('bookings.webhooks', 'ERROR'):
+            self.assertEqual(self.provider.deliver('paypal', payload), 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_mismatched_amount_or_currency_is_held_for_review(self):
+        other = self.book('PAY2')
+        self.assertEqual(self.provider.deliver('stripe', self.provider.stripe_payment(self.booking, amount='0.01')), 200)
+        self.assertEqual(self.provider.deliver('stripe', self.provider.stripe_payment(other, currency='eur')), 200)
+        self.process()
+        for booking in (self.booking, other):
+            self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'pending')
+            self.assertEqual(Payment.objects.get(booking=booking).status, 'review')
+        events = WebhookEvent.objects.all()
+        self.assertEqual({event.status for event in events}, {'review'})
+        self.assertTrue(all(event.last_error for event in events))
+
+    def test_payment_for_cancelled_booking_is_held_for_review(self):
+        release_expired_holds(now=timezone.now() + timedelta(days=1))
+        self.provider.deliver('paypal', self.provider.paypal_sale(self.booking))
+        self.process()
+        self.assertEqual(Booking.objects.get(pk=self.booking.pk).status, 'cancelled')
+        self.assertEqual(Payment.objects.get(booking=self.booking).status, 'review')
+        self.assertIn('cancelled', WebhookEvent.objects.get().last_error)
+
+    def test_payments_started_by_our_views_confirm_the_booking(self):
+        def succeeded(intent_id, amount, currency, metadata):
+            # Stripe returns metadata values as strings.
+            return {
+                'id': f'evt_{intent_id}',
+                'type': 'payment_intent.succeeded',
+                'data': {'object': {
+                    'id': intent_id, 'object': 'payment_intent', 'amount': amount, 'currency': currency,
+                    'metadata': {key: str(value) for key, value in metadata.items()},
+                }},
+            }
+
+        request = RequestFactory().post('/')
+        request.user = self.user
+        with mock.patch('stripe.PaymentIntent.create', return_value=mock.Mock(client_secret='pi_1_secret')) as create:
+            self.assertEqual(views.create_payment_intent(request, self.booking.pk).status_code, 200)
+        intent = create.call_args.kwargs
+        self.provider.deliver('stripe', succeeded('pi_1', intent['amount'], intent['currency'], intent['metadata']))
+
+        other = self.book('PAY2')
+        with mock.patch('stripe.checkout.Session.create', return_value=mock.Mock(id='cs_1')) as create:
+            self.assertEqual(views.checkout(request, other.booking_reference).status_code, 200)
+        session = create.call_args.kwargs
+        price = session['line_items'][0]['price_data']
+        self.provider.deliver(
+            'stripe',
+            succeeded('pi_2', price['unit_amount'], price['currency'], session['payment_intent_data']['metadata']),
+        )
+
+        self.process()
+        for booking in (self.booking, other):
+            self.assertEqual(Booking.objects.get(pk=booking.pk).status, 'confirmed')
+            self.assertEqual(Payment.objects.get(booking=booking).status, 'completed')
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', flat=True)), {'processed'})
+
+    def test_replaying_events_is_idempotent(self):
+        bookings = [self.booking] + [self.book(f'PAY{index}') for index in range(2, 31)]
+        events = []
+        for booking in bookings:
+            events.extend(self.provider.payment_events(booking, failure_rate=0.3))
+        events = self.provider.with_redeliveries(events, duplicate_rate=0.5)
+
+        def replay():
+            statuses = {self.provider.deliver(name, payload) for name, payload in events}
+            self.assertEqual(statuses, {200})
+            self.process()
+            return (
+                sorted(Payment.objects.values_list('booking_id', 'transaction_id', 'status')),
+                sorted(Booking.objects.values_list('pk', 'status', 'transaction_id')),
+                sorted(WebhookEvent.objects.values_list('event_id', 'status')),
+            )
+
+        first = replay()
+        self.assertEqual(replay(), first)
+        payments, booking_states, event_states = first
+        self.assertEqual({status for _, status, _ in booking_states}, {'confirmed'})
+        completed = [booking_id for booking_id, _, status in payments if status == 'completed']
+        self.assertEqual(sorted(completed), sorted(booking.pk for booking in bookings))
+        self.assertEqual(len(event_states), len({payload['id'] for _, payload in events}))
+        self.assertEqual({status for _, status in event_states}, {'processed'})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class WebhookReplayTests(TransactionTestCase):
+    def test_replaying_ten_thousand_events_applies_each_payment_once(self):
+        create_tour()
+        out = io.StringIO()
+        # Duplicates and retries under new ids arrive shuffled, so later
+        # events often land before the ones they repeat.
+        call_command('replay_webhooks', events=10000, seed=11, workers=4, keep=True, stdout=out)
+
+        bookings = Booking.objects.filter(user__username='webhook-replay')
+        self.assertGreater(bookings.count(), 8000)
+        self.assertFalse(bookings.exclude(status='confirmed').exists())
+        completed = Payment.objects.filter(status='completed')
+        self.assertEqual(completed.count(), bookings.count())
+        self.assertEqual(completed.values('booking').distinct().count(), bookings.count())
+        self.assertTrue(WebhookEvent.objects.filter(event_id__endswith='-retry').exists())
+        self.assertFalse(WebhookEvent.objects.exclude(status__in=['processed', 'ignored']).exists())
+        self.assertIn('0 bookings unconfirmed', out.getvalue())
+
+
+class StubPool:
+    """Stands in for the render pool; ``dies`` makes its next render kill a worker and break it.
+
+    Renders write an empty PDF, except to ``fails``, whose renders raise.
+    """
+
+    def __init__(self, broken=False, dies=False, fails=()):
+        self.broken = broken
+        self.dies = dies
+        self.fails = set(fails)
+        self.submitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def submit(self, fn, html, path):
+        if self.broken:
+            raise BrokenProcessPool('A child process terminated abruptly')
+        future = Future()
+        if self.dies:
+            self.broken = True
+            future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+            return future
+        self.submitted += 1
+        if path in self.fails:
+            future.set_exception(RuntimeError('could not lay out the invoice'))
+            return future
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'wb').close()
+        future.set_result(path)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, INVOICE_RENDER_ON_CONFIRM=False)
+class InvoiceTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        override = override_settings(INVOICE_ROOT=root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        tour = create_tour()
+        self.booking = Booking.objects.create(
+            user=create_user('traveller'), tour=tour, tour_date=TourDate.objects.get(tour=tour),
+            booking_reference='INV1', full_name='Traveller', email='traveller@example.com',
+            total_amount=tour.price, status='confirmed',
+        )
+
+    def test_broken_pool_is_replaced(self):
+        fresh = StubPool()
+        with mock.patch.object(invoices, '_executor', StubPool(broken=True)), \
+                mock.patch.object(invoices, '_new_executor', return_value=fresh):
+            digest, path = invoices.get_invoice(self.booking)
+            self.assertIs(invoices._executor, fresh)
+        self.assertEqual(fresh.submitted, 1)
+        self.assertEqual(path, invoices.invoice_path(digest))
+
+    def test_render_that_broke_the_pool_is_retried(self):
+        fresh = StubPool()
+        with mock.patch.object(invoices, '_executor', StubPool(dies=True)), \
+                mock.patch.object(invoices, '_new_executor', return_value=fresh):
+            invoices.get_invoice(self.booking)
+            self.assertIs(invoices._executor, fresh)
+        self.assertEqual(fresh.submitted, 1)
+
+    def test_export_leaves_out_invoices_that_fail_to_render(self):
+        broken = Booking.objects.create(
+            user=self.booking.user, tour=self.booking.tour, tour_date=self.booking.tour_date,
+            booking_reference='INV2', full_name='Traveller', email='traveller@example.com',
+            total_amount=self.booking.total_amount, status='confirmed',
+        )
+        # Digested as the export reads it back from the database.
+        broken = Booking.objects.select_related('tour', 'tour_date').get(pk=broken.pk)
+        pool = StubPool(fails=[invoices.invoice_path(invoices.invoice_digest(broken))])
+        output = os.path.join(settings.INVOICE_ROOT, 'export.zip')
+        out = io.StringIO()
+        today = str(timezone.localdate())
+        with mock.patch.object(invoices, '_new_executor', return_value=pool), \
+                self.assertLogs('bookings.invoices', 'ERROR') as logs:
+            call_command('export_invoices', today, today, output=output, stdout=out)
+        self.assertIn(f'booking {broken.pk}', logs.output[0])
+        self.assertEqual(zipfile.ZipFile(output).namelist(), ['invoice_INV1.pdf'])
+        self.assertIn('Exported 1 invoices (1 rendered)', out.getvalue())
+        self.assertIn(f'booking ids: {broken.pk}', out.getvalue())
+
+    def test_prune_removes_unused_and_abandoned_files(self):
+        digest = invoices.invoice_digest(self.booking)
+        used = invoices.invoice_path(digest)
+        stale = invoices.invoice_path('ab' + digest[2:])
+        abandoned = os.path.join(os.path.dirname(stale), 'tmpx1.tmp')
+        os.makedirs(os.path.dirname(used), exist_ok=True)
+        os.makedirs(os.path.dirname(stale), exist_ok=True)
+        month_ago = time.time() - 31 * 24 * 60 * 60
+        for path in (used, stale, abandoned):
+            open(path, 'wb').close()
+            os.utime(path, (month_ago, month_ago))
+        # Serving a cached invoice counts as a use.
+        invoices.get_invoice(self.booking)
+        self.assertEqual(invoices.prune_invoices(days=30), invoices.PruneStats(removed=2, kept=1))
+        self.assertTrue(os.path.exists(used))
+        self.assertFalse(os.path.exists(stale))
+        self.assertFalse(os.path.exists(abandoned))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER, INVOICE_RENDER_ON_CONFIRM=False)
+class InvoiceExportTests(TransactionTestCase):
+    """The admin action exports on a background thread, so its data must be committed."""
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        override = override_settings(INVOICE_ROOT=root.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.admin = get_user_model().objects.create_superuser('admin@example.com', 'secret', username='admin')
+        self.client.force_login(self.admin)
+        tour = create_tour()
+        tour_date = TourDate.objects.get(tour=tour)
+        for reference, status in (('JAN1', 'confirmed'), ('JAN2', 'completed'), ('JAN3', 'pending'), ('OLD1', 'confirmed')):
+            booking = Booking.objects.create(
+                user=self.admin, tour=tour, tour_date=tour_date, booking_reference=reference,
+                full_name='Traveller', email='traveller@example.com', total_amount=tour.price, status=status,
+            )
+            # Cached already, so the export copies instead of rendering.
+            booking = Booking.objects.select_related('tour', 'tour_date').get(pk=booking.pk)
+            pdf = invoices.invoice_path(invoices.invoice_digest(booking))
+            os.makedirs(os.path.dirname(pdf), exist_ok=True)
+            open(pdf, 'wb').close()
+        self.now = timezone.now()
+        Booking.objects.filter(booking_reference='OLD1').update(created_at=self.now - timedelta(days=400))
+
+    def export(self, **filters):
+        filters.update(created_at__year=self.now.year)
+        query = '&'.join(f'{name}={value}' for name, value in filters.items())
+        response = self.client.post(f"{reverse('admin:bookings_booking_changelist')}?{query}", {
+            'action': 'export_invoices_zip', 'select_across': '1', 'index': '0',
+            '_selected_action': [Booking.objects.first().pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        for thread in threading.enumerate():
+            if thread.name.startswith('invoice-export-'):
+                thread.join(30)
+        email = OutboundEmail.objects.latest('pk')
+        self.assertEqual(email.to, ['admin@example.com'])
+        link = email.body.split('Download them from ')[1].strip()
+        response = self.client.get(link)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        return sorted(archive.namelist())
+
+    def test_action_exports_filtered_invoices_in_the_background(self):
+        self.assertEqual(self.export(), ['invoice_JAN1.pdf', 'invoice_JAN2.pdf'])
+        self.assertEqual(self.export(status__exact='pending'), ['invoice_JAN3.pdf'])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class TourQueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    """Enough tours, departures and related rows that an N+1 shows up as repeated queries."""
+
+    @classmethod
+    def setUpTestData(cls):
+        hiking = Category.objects.create(name='Hiking', slug='hiking', description='', icon='')
+        wifi = Amenity.objects.create(name='Wi-Fi', icon='')
+        cls.tours = []
+        for number in range(8):
+            tour = create_tour(name=f'Tour {number}', departures=3)
+            tour.categories.add(hiking)
+            tour.amenities.add(wifi)
+            cls.tours.append(tour)
+        summaries.refresh_tours()
+        cls.user = create_user('traveller')
+
+    def test_tour_list(self):
+        self.assertWithinQueryBudget(reverse('bookings:tour_list'))
+        self.assertWithinQueryBudget(reverse('bookings:tour_list'), {'category': 'hiking', 'sort': 'departure'})
+        self.client.force_login(self.user)
+        self.assertWithinQueryBudget(reverse('bookings:tour_list'))
+
+    def test_tour_detail(self):
+        tour = self.tours[0]
+        self.assertWithinQueryBudget(reverse('bookings:tour_detail', args=[tour.pk]))
+        self.client.force_login(self.user)
+        self.assertWithinQueryBudget(reverse('bookings:tour_detail', args=[tour.pk]))
+
+
+class TourSearchTests(TestCase):
+    def test_destination_changes_reindex_its_tours(self):
+        tour = create_tour()
+        other = create_tour(name='Mountain Trek')
+        self.assertCountEqual(search_objects(Tour.objects.all(), 'lagos'), [tour, other])
+        destination = tour.destination
+        destination.city = 'Faro'
+        destination.country = 'Algarve Portugal'
+        destination.save()
+        self.assertEqual(search_objects(Tour.objects.all(), 'faro'), [tour])
+        self.assertEqual(search_objects(Tour.objects.all(), 'algarve'), [tour])
+        self.assertEqual(search_objects(Tour.objects.all(), 'lagos'), [other])
+
+
+class SeatPublisherTests(TestCase):
+    def test_first_change_is_sent_off_the_calling_thread(self):
+        publisher = seat_updates.SeatPublisher(rate=1000)
+        release = threading.Event()
+        sent = []
+
+        def flush(tour_id):
+            release.wait(5)
+            sent.append((tour_id, threading.current_thread()))
+
+        with mock.patch.object(publisher, '_flush', side_effect=flush):
+            before = set(threading.enumerate())
+            # Returns while the send is still blocked.
+            publisher.publish(7, [1])
+            self.assertEqual(sent, [])
+            release.set()
+            for thread in set(threading.enumerate()) - before:
+                thread.join(5)
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(sent[0][0], 7)
+        self.assertIsNot(sent[0][1], threading.current_thread())
@@ -6,7 +6,9 @@ app_name = 'bookings'
 
 urlpatterns = [
     path('tours/', views.tour_list, name='tour_list'),
+    path('tours/recommended/', views.recommended_tours, name='recommended_tours'),
     path('tour/<int:tour_id>/', views.tour_detail, name='tour_detail'),
+    path('tour/<int:tour_id>/availability/', views.tour_availability, name='tour_availability'),
     path('', views.my_bookings, name='my_bookings'),
     path('book/<int:tour_id>/', views.book_tour, name='book_tour'),
     path('payment/<int:booking_id>/', views.payment, name='payment'),
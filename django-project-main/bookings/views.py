@@ -1,20 +1,29 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, JsonResponse, HttpResponse
 from django.conf import settings
-from django.db.models import Q
 from .models import Tour, TourDate, Booking, Payment
+from .facets import DURATION_BUCKETS, PRICE_BUCKETS, bitmap_from_ids, bucket_bounds, get_tour_index
 from .forms import BookingForm, PaymentForm
+from core.pagination import InvalidCursor, KeysetPaginator
+from core.querylog import query_budget
+from core.search import search_queryset
+from . import invoices, pricing, recommendations, webhooks
+from .availability import get_calendar
+from .reservations import book_seats, cancel_reservation, confirm_hold
 import stripe
-from accounts.models import Wishlist
+from accounts.wishlists import is_wishlisted, wishlist_ids
 import paypalrestsdk
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 import re
 from django.utils import timezone
-from django.template.loader import get_template
-from xhtml2pdf import pisa
+from django.utils.cache import get_conditional_response
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 import uuid
+from datetime import date
+from decimal import Decimal, InvalidOperation
 from django.views.generic import View
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
@@ -26,77 +35,244 @@ paypalrestsdk.configure({
     "client_secret": settings.PAYPAL_SECRET
 })
 
+def _decimal_or_none(value):
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
+FACET_TITLES = [
+    ('category', 'Category'),
+    ('country', 'Country'),
+    ('duration', 'Duration'),
+    ('price', 'Price from'),
+    ('amenity', 'Amenities'),
+]
+
+def _facet_links(request, index, counts, selected):
+    """Sidebar sections in display order, each entry with the query string that toggles it."""
+    sections = []
+    for facet, title in FACET_TITLES:
+        chosen = selected[facet]
+        entries = []
+        for value, label, count in index.options(counts, facet, chosen):
+            params = request.GET.copy()
+            params.pop('cursor', None)
+            active = value in chosen
+            if active:
+                params.pop(facet, None)
+            else:
+                params[facet] = str(value)
+            entries.append({'label': label, 'count': count, 'active': active, 'query': params.urlencode()})
+        if entries:
+            sections.append({'name': facet, 'title': title, 'entries': entries})
+    return sections
+
+@query_budget(6)
 def tour_list(request):
-    """Display a list of all available tours."""
-    tours = Tour.objects.filter(is_active=True)
+    """Display available tours, newest first or by next departure, one keyset page at a time."""
+    tours = Tour.objects.filter(is_active=True).select_related(
+        'destination', 'vendor'
+    ).prefetch_related('categories', 'amenities')
     
     # Filter by search query if provided
     query = request.GET.get('q')
     if query:
-        tours = tours.filter(
-            Q(name__icontains=query) |
-            Q(description__icontains=query) |
-            Q(destination__name__icontains=query)
-        )
+        tours = search_queryset(tours, query)
     
     # Filter by category if provided
     category = request.GET.get('category')
     if category:
         tours = tours.filter(categories__slug=category)
     
-    # Filter by price range if provided
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        tours = tours.filter(price__gte=min_price)
-    if max_price:
-        tours = tours.filter(price__lte=max_price)
+    # Filter by country, duration bucket and amenity if provided
+    country = request.GET.get('country')
+    if country:
+        tours = tours.filter(destination__country=country)
+    duration = request.GET.get('duration')
+    duration_bounds = bucket_bounds(DURATION_BUCKETS, duration)
+    if duration_bounds:
+        low, high = duration_bounds
+        tours = tours.filter(duration_days__gte=low)
+        if high is not None:
+            tours = tours.filter(duration_days__lt=high)
+    amenity = request.GET.get('amenity')
+    if amenity and amenity.isdigit():
+        tours = tours.filter(amenities__id=amenity)
+    else:
+        amenity = None
+    
+    # Filter by price bucket and range if provided, on the "from" price the cards show
+    price = request.GET.get('price')
+    price_bounds = bucket_bounds(PRICE_BUCKETS, price)
+    if price_bounds:
+        low, high = price_bounds
+        tours = tours.filter(min_price__gte=low)
+        if high is not None:
+            tours = tours.filter(min_price__lt=high)
+    min_price = _decimal_or_none(request.GET.get('min_price'))
+    max_price = _decimal_or_none(request.GET.get('max_price'))
+    if min_price is not None:
+        tours = tours.filter(min_price__gte=min_price)
+    if max_price is not None:
+        tours = tours.filter(min_price__lte=max_price)
+    
+    # Live facet counts for the sidebar, answered from the bitmap index;
+    # pages fetched by infinite scroll only need the cards
+    facets = facet_total = None
+    if not request.htmx:
+        index = get_tour_index()
+        restrict = None
+        if min_price is not None or max_price is not None:
+            restrict = index.price_range(min_price, max_price)
+        if query:
+            matches = bitmap_from_ids(
+                search_queryset(Tour.objects.all(), query).values_list('id', flat=True)
+            )
+            restrict = matches if restrict is None else restrict & matches
+        selected = {
+            'category': [category] if category else [],
+            'country': [country] if country else [],
+            'duration': [duration] if duration_bounds else [],
+            'price': [price] if price_bounds else [],
+            'amenity': [int(amenity)] if amenity else [],
+        }
+        facet_counts = index.counts(selected, restrict=restrict)
+        facets = _facet_links(request, index, facet_counts, selected)
+        facet_total = facet_counts['total']
+    
+    # Keyset pagination on (created_at, id), or on the maintained
+    # (next_departure, id) when sorting by soonest departure
+    sort = request.GET.get('sort')
+    if sort == 'departure':
+        paginator = KeysetPaginator(
+            tours.filter(next_departure__isnull=False),
+            fields=('next_departure', 'id'), per_page=12, descending=False,
+        )
+    else:
+        sort = None
+        paginator = KeysetPaginator(tours, fields=('created_at', 'id'), per_page=12)
+    try:
+        page = paginator.get_page(request.GET.get('cursor'))
+    except InvalidCursor:
+        return HttpResponse('Invalid cursor', status=400)
+    
+    next_params = request.GET.copy()
+    next_params['cursor'] = page.next_cursor or ''
     
     context = {
-        'tours': tours,
+        'tours': page,
+        'wishlisted': wishlist_ids(request.user),
+        'next_cursor': page.next_cursor,
+        'next_query': next_params.urlencode(),
+        'facets': facets,
+        'facet_total': facet_total,
         'query': query,
         'category': category,
+        'country': country,
+        'duration': duration,
+        'price': price,
+        'amenity': amenity,
         'min_price': min_price,
         'max_price': max_price,
+        'sort': sort,
     }
+    if request.htmx:
+        return render(request, 'bookings/partials/tour_cards.html', context)
     return render(request, 'bookings/tour_list.html', context)
 
+@query_budget(4)
+def recommended_tours(request):
+    """Cards of the tours recommended to the user, from the nightly precomputed table."""
+    return render(request, 'bookings/partials/tour_cards.html', {
+        'tours': recommendations.recommended_tours(request.user, limit=12),
+        'wishlisted': wishlist_ids(request.user),
+    })
+
 def tour_search(request):
     # Handle tour search logic here
     return render(request, 'bookings/tour_search.html')
 
-def tour_detail(request, slug):
+@query_budget(4)
+def tour_detail(request, tour_id):
     """Display details of a specific tour."""
-    tour = get_object_or_404(Tour, slug=slug, is_active=True)
-    is_in_wishlist = False
+    tour = get_object_or_404(Tour, pk=tour_id, is_active=True)
+    is_in_wishlist = is_wishlisted(request.user, [tour.id])[tour.id]
     
-    if request.user.is_authenticated:
-        is_in_wishlist = Wishlist.objects.filter(user=request.user, tour=tour).exists()
-    
-    available_dates = TourDate.objects.filter(tour=tour, available_seats__gt=0)
+    # Departures come from the in-memory availability calendar
+    tour_calendar = get_calendar(tour.id)
+    first_available = tour_calendar.first_available()
+    month = first_available or timezone.localdate()
     context = {
         'tour': tour,
         'is_in_wishlist': is_in_wishlist,
-        'available_dates': available_dates
+        'first_available': first_available,
+        'available_dates': [
+            {'date': day, 'seats': seats, 'tour_date_ids': ids}
+            for day, seats, ids in tour_calendar.month(month.year, month.month)
+            if seats > 0
+        ],
     }
     return render(request, 'bookings/tour_detail.html', context)
 
+def tour_availability(request, tour_id):
+    """Month view of a tour's departures as JSON: ``?month=YYYY-MM&seats=N``."""
+    tour_calendar = get_calendar(tour_id)
+    try:
+        seats = max(int(request.GET.get('seats', 1)), 1)
+    except ValueError:
+        return JsonResponse({'error': 'seats must be a number'}, status=400)
+    first_available = tour_calendar.first_available(seats)
+    month = first_available or timezone.localdate()
+    if request.GET.get('month'):
+        match = re.fullmatch(r'(\d{4})-(\d{2})', request.GET['month'])
+        if not match or not 1 <= int(match.group(2)) <= 12:
+            return JsonResponse({'error': 'month must be YYYY-MM'}, status=400)
+        month = date(int(match.group(1)), int(match.group(2)), 1)
+    return JsonResponse({
+        'tour_id': tour_id,
+        'month': f'{month.year:04d}-{month.month:02d}',
+        'first_available': first_available.isoformat() if first_available else None,
+        'days': [
+            {'date': day.isoformat(), 'seats': open_seats, 'available': open_seats >= seats, 'tour_date_ids': ids}
+            for day, open_seats, ids in tour_calendar.month(month.year, month.month)
+        ],
+    })
+
+def _place_booking(request, form, tour):
+    """Price the booking in a valid ``form`` and take its seats; None if the departure sold out.
+
+    ``form.cleaned_data['tour_date']`` has already been checked to be one of
+    the tour's upcoming departures by ``BookingForm``.
+    """
+    booking = form.save(commit=False)
+    booking.tour = tour
+    booking.user = request.user
+    booking.booking_reference = str(uuid.uuid4().hex[:8].upper())
+    tour_date = form.cleaned_data['tour_date']
+    pricing.apply_quote(booking, pricing.quote(tour, tour_date, booking.participants))
+    if tour_date is None:
+        booking.save()
+    elif book_seats(booking, tour_date.pk).sold_out:
+        messages.error(request, 'Sorry, there are not enough seats left on this departure.')
+        return None
+    return booking
+
 @login_required
 def create_booking(request, slug):
     """Create a new booking for a tour."""
     tour = get_object_or_404(Tour, slug=slug, is_active=True)
     
     if request.method == 'POST':
-        form = BookingForm(request.POST)
+        form = BookingForm(request.POST, tour=tour)
         if form.is_valid():
-            booking = form.save(commit=False)
-            booking.tour = tour
-            booking.user = request.user
-            booking.save()
+            booking = _place_booking(request, form, tour)
+            if booking is None:
+                return redirect('bookings:tour_detail', tour_id=tour.id)
             messages.success(request, 'Booking created successfully!')
             return redirect('bookings:booking_detail', booking_id=booking.id)
     else:
-        form = BookingForm()
+        form = BookingForm(tour=tour)
     
     context = {
         'tour': tour,
@@ -125,8 +301,7 @@ def cancel_booking(request, booking_id):
     booking = get_object_or_404(Booking, id=booking_id, user=request.user)
     
     if booking.can_be_cancelled():
-        booking.status = 'cancelled'
-        booking.save()
+        cancel_reservation(booking)
         messages.success(request, 'Booking cancelled successfully!')
     else:
         messages.error(request, 'This booking cannot be cancelled.')
@@ -174,8 +349,8 @@ def checkout(request, reference):
                 payment_method_types=['card'],
                 line_items=[{
                     'price_data': {
-                        'currency': 'usd',
-                        'unit_amount': int(booking.total_price * 100),
+                        'currency': settings.PAYMENT_CURRENCY.lower(),
+                        'unit_amount': pricing.to_minor_units(booking.total_amount),
                         'product_data': {
                             'name': booking.tour_date.tour.name,
                         },
@@ -183,6 +358,10 @@ def checkout(request, reference):
                     'quantity': 1,
                 }],
                 mode='payment',
+                # The webhook matches payment_intent events to the booking by
+                # this metadata; set it on the intent as well as the session.
+                metadata={'booking_id': booking.id},
+                payment_intent_data={'metadata': {'booking_id': booking.id}},
                 success_url=request.build_absolute_uri(f'/booking/{booking.booking_reference}/'),
                 cancel_url=request.build_absolute_uri(f'/booking/{booking.booking_reference}/'),
             )
@@ -192,8 +371,15 @@ def checkout(request, reference):
     
     return render(request, 'bookings/checkout.html', {'booking': booking})
 
+@csrf_exempt
+@require_POST
 def stripe_webhook(request):
-    # Handle Stripe webhook events here
+    """Verify a Stripe event, store it for the webhook workers and acknowledge it."""
+    try:
+        webhooks.verify_stripe(request)
+        webhooks.ingest('stripe', webhooks.parse_body(request))
+    except webhooks.InvalidWebhook:
+        return HttpResponse(status=400)
     return JsonResponse({'status': 'success'})
 
 @login_required
@@ -201,28 +387,22 @@ def book_tour(request, tour_id):
     tour = get_object_or_404(Tour, id=tour_id)
     
     if request.method == 'POST':
-        form = BookingForm(request.POST)
+        form = BookingForm(request.POST, tour=tour)
         if form.is_valid():
-            booking = form.save(commit=False)
-            booking.user = request.user
-            booking.tour = tour
-            booking.booking_reference = str(uuid.uuid4().hex[:8].upper())
-            booking.base_price = tour.price * booking.participants
-            booking.gst_amount = booking.base_price * 0.05  # 5% GST
-            booking.sgst_amount = booking.base_price * 0.05  # 5% SGST
-            booking.total_amount = booking.base_price + booking.gst_amount + booking.sgst_amount
-            booking.save()
+            booking = _place_booking(request, form, tour)
+            if booking is None:
+                return redirect('bookings:tour_detail', tour_id=tour.id)
             
             messages.success(request, 'Booking created successfully!')
             return redirect('bookings:payment', booking_id=booking.id)
     else:
-        form = BookingForm()
+        form = BookingForm(tour=tour, initial={'tour_date': request.GET.get('tour_date')})
     
     context = {
         'form': form,
         'tour': tour,
     }
-    return render(request, 'bookings/booking_form.html', context)
+    return render(request, 'bookings/book_tour.html', context)
 
 @login_required
 def payment(request, booking_id):
@@ -231,6 +411,11 @@ def payment(request, booking_id):
     if request.method == 'POST':
         payment_method = request.POST.get('payment_method')
         
+        # Seats are only held for a limited time
+        if not confirm_hold(booking):
+            messages.error(request, 'Your seat hold has expired. Please book again.')
+            return redirect('bookings:tour_detail', tour_id=booking.tour_id)
+        
         # Create payment record
         payment = Payment.objects.create(
             booking=booking,
@@ -260,50 +445,44 @@ def booking_confirmation(request, booking_id):
 
 @login_required
 def download_invoice(request, booking_id):
-    booking = get_object_or_404(Booking, id=booking_id, user=request.user)
-    template = get_template('bookings/invoice_pdf.html')
-    context = {'booking': booking}
-    html = template.render(context)
-    
-    # Create PDF
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="invoice_{booking.booking_reference}.pdf"'
+    booking = get_object_or_404(
+        Booking.objects.select_related('tour', 'tour_date'), id=booking_id, user=request.user
+    )
+    # The PDF is cached by content, so its digest doubles as the ETag
+    etag = f'"{invoices.invoice_digest(booking)}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        return not_modified
     
-    # Generate PDF
-    pisa_status = pisa.CreatePDF(html, dest=response)
-    if pisa_status.err:
+    try:
+        digest, path = invoices.get_invoice(booking)
+    except FuturesTimeoutError:
+        response = HttpResponse('Invoice is still being prepared, please retry shortly', status=503)
+        response['Retry-After'] = '5'
+        return response
+    except Exception:
         return HttpResponse('Error generating PDF', status=500)
     
+    response = FileResponse(
+        open(path, 'rb'),
+        as_attachment=True,
+        filename=f'invoice_{booking.booking_reference}.pdf',
+        content_type='application/pdf',
+    )
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
     return response
 
 @csrf_exempt
+@require_POST
 def paypal_webhook(request):
-    if request.method == 'POST':
-        try:
-            # Verify webhook signature
-            # Note: In production, you should verify the webhook signature
-            # using PayPal's webhook verification
-            
-            payload = request.POST
-            event_type = payload.get('event_type')
-            
-            if event_type == 'PAYMENT.SALE.COMPLETED':
-                payment_id = payload.get('resource', {}).get('parent_payment')
-                
-                # Update booking status
-                try:
-                    booking = Booking.objects.get(payment_id=payment_id)
-                    booking.status = 'confirmed'
-                    booking.save()
-                except Booking.DoesNotExist:
-                    return HttpResponse(status=404)
-                    
-            return HttpResponse(status=200)
-            
-        except Exception as e:
-            return HttpResponse(status=400)
-    
-    return HttpResponse(status=400)
+    """Verify a PayPal event, store it for the webhook workers and acknowledge it."""
+    try:
+        webhooks.verify_paypal(request)
+        webhooks.ingest('paypal', webhooks.parse_body(request))
+    except webhooks.InvalidWebhook:
+        return HttpResponse(status=400)
+    return HttpResponse(status=200)
 
 @login_required
 def payment_cancel(request, booking_id):
@@ -320,8 +499,8 @@ def create_payment_intent(request, booking_id):
     try:
         # Create a PaymentIntent with the order amount and currency
         intent = stripe.PaymentIntent.create(
-            amount=int(booking.total_price * 100),  # Convert to cents
-            currency='inr',
+            amount=pricing.to_minor_units(booking.total_amount),
+            currency=settings.PAYMENT_CURRENCY.lower(),
             payment_method_types=['card'],
             metadata={
                 'booking_id': booking.id,
@@ -0,0 +1,424 @@
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+from urllib.parse import urlsplit
+
+import paypalrestsdk
+import stripe
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, CharField, Q, Value, When
+from django.utils import timezone
+
+from .models import Booking, Payment, SeatHold, WebhookEvent
+from .reservations import cancel_reservation
+
+logger = logging.getLogger(__name__)
+
+# What a provider event means for us, independent of the provider's format.
+# ``key`` is the provider's id for the money movement and is used as the
+# idempotency key: it becomes Payment.transaction_id.
+Effect = namedtuple(
+    'Effect', ['action', 'booking_id', 'booking_reference', 'key', 'amount', 'currency', 'payment_method']
+)
+
+
+class InvalidWebhook(ValueError):
+    pass
+
+
+def verify_stripe(request):
+    """Check the Stripe-Signature header; raises InvalidWebhook unless it is valid.
+
+    Without STRIPE_WEBHOOK_SECRET nothing can be verified, so every event is
+    refused rather than trusted.
+    """
+    if not settings.STRIPE_WEBHOOK_SECRET:
+        logger.error('Refusing Stripe webhook: STRIPE_WEBHOOK_SECRET is not set')
+        raise InvalidWebhook('no webhook secret configured')
+    try:
+        stripe.WebhookSignature.verify_header(
+            request.body, request.headers.get('Stripe-Signature'), settings.STRIPE_WEBHOOK_SECRET
+        )
+    except (stripe.error.SignatureVerificationError, UnicodeDecodeError) as exc:
+        raise InvalidWebhook('bad signature') from exc
+
+
+def verify_paypal(request):
+    """Check the PayPal transmission signature; raises InvalidWebhook unless it is valid.
+
+    The signing certificate must come from paypal.com over HTTPS; the SDK
+    then checks its chain and the signature over the body and PAYPAL_WEBHOOK_ID.
+    """
+    if not settings.PAYPAL_WEBHOOK_ID:
+        logger.error('Refusing PayPal webhook: PAYPAL_WEBHOOK_ID is not set')
+        raise InvalidWebhook('no webhook id configured')
+    headers = request.headers
+    cert_url = headers.get('Paypal-Cert-Url', '')
+    parts = urlsplit(cert_url)
+    if parts.scheme != 'https' or not (parts.hostname or '').endswith('.paypal.com'):
+        raise InvalidWebhook('certificate not from paypal.com')
+    try:
+        valid = paypalrestsdk.WebhookEvent.verify(
+            headers.get('Paypal-Transmission-Id', ''),
+            headers.get('Paypal-Transmission-Time', ''),
+            settings.PAYPAL_WEBHOOK_ID,
+            request.body.decode('utf-8'),
+            cert_url,
+            headers.get('Paypal-Transmission-Sig', ''),
+            headers.get('Paypal-Auth-Algo', 'sha256'),
+        )
+    except Exception as exc:
+        # Unreachable certificate, malformed signature or body.
+        raise InvalidWebhook('signature could not be verified') from exc
+    if not valid:
+        raise InvalidWebhook('bad signature')
+
+
+def ingest(provider, payload):
+    """Store a raw webhook; returns False if the event had been received before."""
+    if not isinstance(payload, dict) or not payload.get('id'):
+        raise InvalidWebhook('event id missing')
+    event_type = payload.get('type') or payload.get('event_type') or ''
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(
+                provider=provider,
+                event_id=str(payload['id'])[:255],
+                event_type=event_type[:100],
+                payload=payload,
+            )
+    except IntegrityError:
+        # Provider retry of an event we already have.
+        return False
+    return True
+
+
+def _decimal(value, cents=False):
+    try:
+        amount = Decimal(str(value))
+    except (InvalidOperation, TypeError):
+        return None
+    return amount / 100 if cents else amount
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _stripe_effect(payload):
+    obj = payload.get('data', {}).get('object', {})
+    metadata = obj.get('metadata') or {}
+    actions = {
+        'payment_intent.succeeded': 'paid',
+        'payment_intent.payment_failed': 'failed',
+        'charge.refunded': 'refunded',
+    }
+    action = actions.get(payload.get('type'))
+    if action is None:
+        return None
+    key = obj.get('payment_intent') if action == 'refunded' else obj.get('id')
+    return Effect(
+        action, _int_or_none(metadata.get('booking_id')), metadata.get('booking_reference'),
+        key, _decimal(obj.get('amount'), cents=True), obj.get('currency'), 'credit_card',
+    )
+
+
+def _paypal_effect(payload):
+    resource = payload.get('resource', {})
+    actions = {
+        'PAYMENT.SALE.COMPLETED': 'paid',
+        'PAYMENT.SALE.DENIED': 'failed',
+        'PAYMENT.SALE.REFUNDED': 'refunded',
+    }
+    action = actions.get(payload.get('event_type'))
+    if action is None:
+        return None
+    key = resource.get('sale_id') if action == 'refunded' else resource.get('id')
+    amount = resource.get('amount') or {}
+    return Effect(
+        action, _int_or_none(resource.get('custom')), resource.get('invoice_number'),
+        key, _decimal(amount.get('total')), amount.get('currency'), 'paypal',
+    )
+
+
+PARSERS = {
+    'stripe': _stripe_effect,
+    'paypal': _paypal_effect,
+}
+
+
+def claim_batch(batch_size=None, lease=None):
+    """Lease a batch of pending events to this worker; returns the claimed events.
+
+    Rows are locked with SKIP LOCKED so concurrent workers take disjoint
+    batches; on backends without row locks the conditional UPDATE and the
+    claim token keep batches disjoint. Events whose lease ran out (a worker
+    died mid-batch) are claimed again.
+    """
+    batch_size = batch_size or settings.WEBHOOK_BATCH_SIZE
+    now = timezone.now()
+    lease = lease or timedelta(seconds=settings.WEBHOOK_LEASE_SECONDS)
+    claimable = Q(status='pending') | Q(status='processing', locked_until__lt=now)
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            WebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(claimable)
+            .order_by('received_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return []
+        WebhookEvent.objects.filter(claimable, pk__in=ids).update(
+            status='processing', claim=token, locked_until=now + lease
+        )
+    return list(WebhookEvent.objects.filter(claim=token, status='processing').order_by('received_at'))
+
+
+def _resolve_bookings(effects):
+    ids = {effect.booking_id for effect in effects if effect.booking_id}
+    references = {effect.booking_reference for effect in effects if effect.booking_reference and not effect.booking_id}
+    bookings = Booking.objects.filter(Q(pk__in=ids) | Q(booking_reference__in=references)).only(
+        'pk', 'booking_reference', 'status', 'total_amount'
+    )
+    by_id = {}
+    by_reference = {}
+    for booking in bookings:
+        by_id[booking.pk] = booking
+        by_reference[booking.booking_reference] = booking
+    return by_id, by_reference
+
+
+def _payment_problem(effect, booking):
+    """Why a successful payment must not confirm ``booking``, or None when it matches it."""
+    if booking.status == 'cancelled':
+        return f'Booking {booking.booking_reference} was cancelled before the payment arrived; refund it.'
+    if effect.amount is None or effect.amount != booking.total_amount:
+        return f'Paid {effect.amount} but booking {booking.booking_reference} costs {booking.total_amount}.'
+    if (effect.currency or '').upper() != settings.PAYMENT_CURRENCY:
+        return f'Paid in {effect.currency!r}, not {settings.PAYMENT_CURRENCY}.'
+    return None
+
+
+def apply_events(events):
+    """Apply a batch of events in one transaction with a fixed number of queries.
+
+    Every effect is keyed by the provider's transaction id: a payment that
+    is already recorded is not recorded again, whether it arrives twice in
+    one batch, in two batches or as a provider retry with a new event id.
+    A successful payment only confirms its booking when the amount and
+    currency match and the booking is still open; otherwise the payment
+    and its event are set to ``review`` with the reason in ``last_error``,
+    for staff to refund or reconcile.
+    Returns the events with ``status`` set to their outcome (unsaved) and
+    the ids of the bookings that were confirmed.
+    """
+    effects = {}
+    for event in events:
+        parser = PARSERS.get(event.provider)
+        effect = parser(event.payload) if parser else None
+        event.last_error = ''
+        if effect is None or not effect.key:
+            event.status = 'ignored'
+        else:
+            effects[event.pk] = effect
+            event.status = 'processed'
+
+    with transaction.atomic():
+        by_id, by_reference = _resolve_bookings(effects.values())
+        keys = {effect.key for effect in effects.values()}
+        recorded = {}
+        for transaction_id, status in Payment.objects.filter(transaction_id__in=keys).values_list('transaction_id', 'status'):
+            recorded.setdefault(transaction_id, set()).add(status)
+
+        new_payments = []
+        paid = {}
+        paid_events = {}
+        refunded_keys = set()
+        refunded_bookings = set()
+        for event in events:
+            effect = effects.get(event.pk)
+            if effect is None:
+                continue
+            booking = by_id.get(effect.booking_id) or by_reference.get(effect.booking_reference)
+            if booking is None:
+                event.status = 'ignored'
+                continue
+            seen = recorded.setdefault(effect.key, set())
+            if effect.action == 'refunded':
+                if 'refunded' not in seen:
+                    seen.add('refunded')
+                    refunded_keys.add(effect.key)
+                    refunded_bookings.add(booking.pk)
+                continue
+            status = 'completed' if effect.action == 'paid' else 'failed'
+            # A settled payment (including a refunded one) is done with; a
+            # late retry must not record or revive it.
+            if status in seen or (status == 'completed' and seen & {'completed', 'review', 'refunded'}):
+                continue
+            problem = _payment_problem(effect, booking) if status == 'completed' else None
+            if problem:
+                status = 'review'
+                event.status = 'review'
+                event.last_error = problem
+            seen.add(status)
+            new_payments.append(Payment(
+                booking_id=booking.pk,
+                amount=effect.amount if effect.amount is not None else booking.total_amount,
+                payment_method=effect.payment_method,
+                transaction_id=effect.key,
+                status=status,
+            ))
+            if status == 'completed':
+                paid[booking.pk] = (effect.key, effect.payment_method)
+                paid_events[booking.pk] = event
+
+        # A concurrent worker may have recorded the same key since we looked.
+        Payment.objects.bulk_create(new_payments, ignore_conflicts=True)
+        if refunded_keys:
+            Payment.objects.filter(transaction_id__in=refunded_keys, status='completed').update(status='refunded')
+            # Refunds are rare; cancel one by one so their seats are released.
+            for booking in Booking.objects.filter(pk__in=refunded_bookings).exclude(status='cancelled'):
+                cancel_reservation(booking)
+        confirmed = _confirm_bookings(paid)
+
+        # Cancelled (e.g. by the hold sweeper) after we read it: the money
+        # arrived for seats that are gone.
+        late = set(paid) - set(confirmed)
+        if late:
+            for pk, reference in Booking.objects.filter(pk__in=late, status='cancelled').values_list('pk', 'booking_reference'):
+                Payment.objects.filter(transaction_id=paid[pk][0], status='completed').update(status='review')
+                event = paid_events[pk]
+                event.status = 'review'
+                event.last_error = f'Booking {reference} was cancelled before the payment arrived; refund it.'
+
+    return events, confirmed
+
+
+def _confirm_bookings(paid):
+    """Confirm pending bookings in ``paid`` and drop their seat holds; returns their ids."""
+    if not paid:
+        return []
+    # Lock the pending bookings so the expired-hold sweeper's conditional
+    # pending to cancelled UPDATE waits for us and then matches nothing.
+    # SQLite has no row locks, but its IMMEDIATE transactions already hold
+    # the write lock from here to the UPDATE below.
+    confirmable = list(
+        Booking.objects.select_for_update().filter(pk__in=paid, status='pending').values_list('pk', flat=True)
+    )
+    if not confirmable:
+        return []
+    Booking.objects.filter(pk__in=confirmable, status='pending').update(
+        status='confirmed',
+        transaction_id=Case(
+            *[When(pk=pk, then=Value(paid[pk][0])) for pk in confirmable],
+            output_field=CharField(),
+        ),
+        payment_method=Case(
+            *[When(pk=pk, then=Value(paid[pk][1])) for pk in confirmable],
+            output_field=CharField(),
+        ),
+        updated_at=timezone.now(),
+    )
+    SeatHold.objects.filter(booking_id__in=confirmable).delete()
+    return confirmable
+
+
+def _finish(events):
+    now = timezone.now()
+    for status in ('processed', 'ignored'):
+        ids = [event.pk for event in events if event.status == status]
+        if ids:
+            WebhookEvent.objects.filter(pk__in=ids).update(
+                status=status, claim='', locked_until=None, processed_at=now, last_error=''
+            )
+    # Rare, and each carries its own reason.
+    for event in events:
+        if event.status == 'review':
+            WebhookEvent.objects.filter(pk=event.pk).update(
+                status='review', claim='', locked_until=None, processed_at=now, last_error=event.last_error
+            )
+
+
+def _fail(event, exc):
+    attempts = event.attempts + 1
+    WebhookEvent.objects.filter(pk=event.pk).update(
+        status='failed' if attempts >= settings.WEBHOOK_MAX_ATTEMPTS else 'pending',
+        attempts=attempts,
+        last_error=f'{type(exc).__name__}: {exc}',
+        claim='',
+        locked_until=None,
+    )
+
+
+def process_batch(batch_size=None):
+    """Claim and apply one batch; returns the number of events handled."""
+    events = claim_batch(batch_size)
+    if not events:
+        return 0
+    try:
+        events, confirmed = apply_events(events)
+        _finish(events)
+    except Exception:
+        # Isolate the bad event: apply the rest one by one.
+        confirmed = []
+        for event in events:
+            try:
+                done, confirmed_one = apply_events([event])
+                _finish(done)
+                confirmed.extend(confirmed_one)
+            except Exception as exc:
+                _fail(event, exc)
+    if confirmed:
+        from .invoices import render_for
+        render_for(confirmed)
+    return len(events)
+
+
+def drain(batch_size=None):
+    """Process batches until the queue is empty; returns the number of events handled."""
+    handled = 0
+    try:
+        while True:
+            count = process_batch(batch_size)
+            if not count:
+                return handled
+            handled += count
+    finally:
+        # Worker threads own their connection.
+        if threading.current_thread() is not threading.main_thread():
+            connection.close()
+
+
+def run_workers(workers=None, batch_size=None, loop=False, interval=2.0, stop=None):
+    """Drain the queue with a pool of worker threads; returns events handled.
+
+    With ``loop`` the pool keeps polling every ``interval`` seconds until
+    ``stop`` (a ``threading.Event``) is set.
+    """
+    workers = workers or settings.WEBHOOK_WORKERS
+    handled = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            futures = [executor.submit(drain, batch_size) for _ in range(workers)]
+            handled += sum(future.result() for future in futures)
+            if not loop or (stop is not None and stop.is_set()):
+                return handled
+            time.sleep(interval)
+
+
+def parse_body(request):
+    try:
+        return json.loads(request.body)
+    except ValueError as exc:
+        raise InvalidWebhook('body is not JSON') from exc
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Destination, Category, Amenity
+from .models import Destination, Category, Amenity, ChatMessage, Notification, OutboundEmail
 
 @admin.register(Destination)
 class DestinationAdmin(admin.ModelAdmin):
@@ -20,3 +20,24 @@ class CategoryAdmin(admin.ModelAdmin):
 class AmenityAdmin(admin.ModelAdmin):
     list_display = ('name',)
     search_fields = ('name',)
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'to')
+    readonly_fields = ('created_at', 'sent_at')
+
+@admin.register(ChatMessage)
+class ChatMessageAdmin(admin.ModelAdmin):
+    list_display = ('room', 'author', 'sent_at')
+    list_filter = ('room',)
+    search_fields = ('room', 'author', 'body')
+    raw_id_fields = ('user',)
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('title', 'user', 'kind', 'created_at', 'read_at')
+    list_filter = ('kind',)
+    search_fields = ('title', 'user__username', 'user__email')
+    raw_id_fields = ('user',)
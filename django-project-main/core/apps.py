@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from . import chat, geo, home, search
+        from .models import Destination
+
+        chat.connect_signals()
+        geo.connect_signals()
+        home.connect_signals()
+        search.register(
+            Destination, 'destination',
+            title=lambda d: d.name,
+            body=lambda d: f'{d.city} {d.country} {d.description}',
+            visible=lambda d: d.is_active,
+        )
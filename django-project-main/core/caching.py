@@ -0,0 +1,49 @@
+import time
+
+from django.core.cache import cache
+
+from .versions import get_version
+
+_LOCK_PREFIX = 'lock:'
+
+
+def _lock_key(key):
+    return _LOCK_PREFIX + key
+
+
+def get_or_build(key, build, version_names=(), timeout=3600, lock_timeout=30, wait=5.0):
+    """Return the cached value of ``key``, rebuilding it with ``build()`` when stale.
+
+    The entry is stale once ``timeout`` seconds have passed or any of the
+    versions named in ``version_names`` has been bumped. Only the caller
+    that wins the rebuild lock runs ``build``; everyone else keeps serving
+    the stale value meanwhile, or on a cold cache waits up to ``wait``
+    seconds for the winner before building for itself.
+    """
+    version = tuple(get_version(name) for name in version_names)
+    entry = cache.get(key)
+    if entry is not None:
+        entry_version, fresh_until, value = entry
+        if entry_version == version and fresh_until > time.time():
+            return value
+
+    lock = _lock_key(key)
+    if cache.add(lock, 1, lock_timeout):
+        try:
+            value = build()
+            # Keep the entry past its freshness window so it can be served stale.
+            cache.set(key, (version, time.time() + timeout, value), timeout * 2)
+            return value
+        finally:
+            cache.delete(lock)
+
+    if entry is not None:
+        return entry[2]
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[2]
+    return build()
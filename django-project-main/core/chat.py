@@ -0,0 +1,181 @@
+import asyncio
+import bisect
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+
+from .models import ChatMessage
+from .versions import bump_version, get_version
+
+BUFFER_TIMEOUT = 24 * 60 * 60
+MAX_PAGE = 200
+
+
+def _buffer_key(room):
+    return f'chat:{room}'
+
+
+def _version_name(room):
+    return f'chat:{room}'
+
+
+def serialize(message):
+    return {
+        'id': message.pk,
+        'room': message.room,
+        'user': message.author,
+        'message': message.body,
+        'timestamp': message.sent_at.isoformat(),
+    }
+
+
+# Each room's latest CHAT_BUFFER_SIZE messages are cached as
+# (version, messages, complete), where ``complete`` means the buffer holds
+# the whole room. Every insert bumps the room's version; the writer that
+# holds the room lock carries the buffer over to the new version, anyone
+# else just leaves it stale. A buffer is only trusted at the current
+# version, so it can be missing messages but never silently.
+
+def _append_to_buffers(payloads):
+    by_room = {}
+    for payload in payloads:
+        by_room.setdefault(payload['room'], []).append(payload)
+    for room, new in by_room.items():
+        name = _version_name(room)
+        lock = f'lock:{_buffer_key(room)}'
+        if not cache.add(lock, 1, 5):
+            bump_version(name)
+            continue
+        try:
+            previous = get_version(name)
+            entry = cache.get(_buffer_key(room))
+            version = bump_version(name)
+            if entry is not None and entry[0] == previous:
+                combined = entry[1] + new
+                buffered = combined[-settings.CHAT_BUFFER_SIZE:]
+                complete = entry[2] and len(buffered) == len(combined)
+                cache.set(_buffer_key(room), (version, buffered, complete), BUFFER_TIMEOUT)
+        finally:
+            cache.delete(lock)
+
+
+def _fill_buffer(room):
+    version = get_version(_version_name(room))
+    rows = list(ChatMessage.objects.filter(room=room).order_by('-id')[:settings.CHAT_BUFFER_SIZE])
+    buffered = [serialize(message) for message in reversed(rows)]
+    complete = len(rows) < settings.CHAT_BUFFER_SIZE
+    cache.set(_buffer_key(room), (version, buffered, complete), BUFFER_TIMEOUT)
+    return buffered, complete
+
+
+def history(room, before=None, limit=None):
+    """The ``limit`` messages of ``room`` before message id ``before``, oldest first.
+
+    Without ``before`` this is the latest page. Pages inside the cached
+    ring buffer are served from it; older ones use the (room, -id) index.
+    """
+    limit = max(1, min(limit or settings.CHAT_HISTORY_LIMIT, MAX_PAGE))
+    entry = cache.get(_buffer_key(room))
+    if entry is not None and entry[0] == get_version(_version_name(room)):
+        _, buffered, complete = entry
+    elif before is None:
+        buffered, complete = _fill_buffer(room)
+    else:
+        buffered, complete = [], False
+
+    end = len(buffered) if before is None else bisect.bisect_left([m['id'] for m in buffered], before)
+    if end >= limit or complete:
+        return buffered[max(0, end - limit):end]
+
+    rows = ChatMessage.objects.filter(room=room)
+    if before is not None:
+        rows = rows.filter(id__lt=before)
+    return [serialize(message) for message in reversed(rows.order_by('-id')[:limit])]
+
+
+def _insert(messages):
+    ChatMessage.objects.bulk_create(messages)
+    payloads = [serialize(message) for message in messages]
+    _append_to_buffers(payloads)
+    return payloads
+
+
+class ChatWriter:
+    """Store chat messages from every consumer on an event loop in batched INSERTs.
+
+    A message waits at most ``interval`` seconds (or until ``batch_size``
+    messages are queued) to share an INSERT with others. ``write`` returns
+    its stored form, id included, so messages are only relayed once they
+    are persisted.
+    """
+
+    def __init__(self, interval=None, batch_size=None):
+        self.interval = interval if interval is not None else settings.CHAT_FLUSH_INTERVAL
+        self.batch_size = batch_size or settings.CHAT_BATCH_SIZE
+        self.batches = 0
+        self.written = 0
+        self._pending = []
+        self._full = None
+        self._task = None
+
+    async def write(self, room, author, body, user_id=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        message = ChatMessage(room=room, author=author, body=body, user_id=user_id, sent_at=timezone.now())
+        self._pending.append((message, future))
+        if self._task is None:
+            self._full = asyncio.Event()
+            self._task = loop.create_task(self._flush())
+        if len(self._pending) >= self.batch_size:
+            self._full.set()
+        return await future
+
+    async def _flush(self):
+        try:
+            await asyncio.wait_for(self._full.wait(), self.interval)
+        except asyncio.TimeoutError:
+            pass
+        batch, self._pending = self._pending, []
+        # The next message opens a new window while this batch is written;
+        # inserts still run one at a time on the database thread, in order.
+        self._task = None
+        try:
+            payloads = await database_sync_to_async(_insert)([message for message, _ in batch])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        self.batches += 1
+        self.written += len(batch)
+        for (_, future), payload in zip(batch, payloads):
+            if not future.done():
+                future.set_result(payload)
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_writer():
+    """The chat writer of the running event loop."""
+    loop = asyncio.get_running_loop()
+    writer = _writers.get(loop)
+    if writer is None:
+        writer = _writers[loop] = ChatWriter()
+    return writer
+
+
+def _message_changed(sender, instance, **kwargs):
+    # Saves and deletions outside the writer (e.g. moderation in the admin);
+    # the writer uses bulk_create, which sends no signals, and maintains the
+    # buffer itself.
+    bump_version(_version_name(instance.room))
+
+
+def connect_signals():
+    post_save.connect(_message_changed, sender=ChatMessage, dispatch_uid='chat_message_save')
+    post_delete.connect(_message_changed, sender=ChatMessage, dispatch_uid='chat_message_delete')
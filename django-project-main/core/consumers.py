@@ -1,9 +1,37 @@
 import json
+from channels.consumer import get_handler_name
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.utils import timezone
+from django.conf import settings
+
+from . import notifications
+from .chat import get_writer, history
+
+class RelayMixin:
+    """Run handlers of ``relay_types`` group messages without closing stale connections first.
+
+    ``AsyncConsumer.dispatch`` hops to a sync thread to close stale database
+    connections before every handler, which for a group message relayed to
+    thousands of sockets is most of the fan-out cost. Relay handlers only
+    send a payload stored by the sender, so they skip it. Connect, receive
+    and every other message still go through the normal dispatch, and
+    database work here runs in ``database_sync_to_async``, which closes
+    stale connections on its own.
+    """
+
+    relay_types = ()
+
+    async def dispatch(self, message):
+        if message['type'] in self.relay_types:
+            await getattr(self, get_handler_name(message))(message)
+        else:
+            await super().dispatch(message)
+
+class NotificationConsumer(RelayMixin, AsyncWebsocketConsumer):
+    """A user's live notifications; the unread inbox is sent on connect."""
+
+    relay_types = ('notification',)
 
-class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         if self.scope["user"].is_anonymous:
             await self.close()
@@ -13,6 +41,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
                 self.channel_name
             )
             await self.accept()
+            await self.send_inbox()
 
     async def disconnect(self, close_code):
         if not self.scope["user"].is_anonymous:
@@ -27,7 +56,28 @@ class NotificationConsumer(AsyncWebsocketConsumer):
     async def notification(self, event):
         await self.send(text_data=json.dumps(event['data']))
 
-class ChatConsumer(AsyncWebsocketConsumer):
+    async def send_inbox(self):
+        unread, count = await self.get_inbox()
+        await self.send(text_data=json.dumps({
+            'type': 'inbox',
+            'unread': count,
+            'notifications': unread,
+        }))
+
+    @database_sync_to_async
+    def get_inbox(self):
+        user = self.scope['user']
+        return notifications.unread(user), notifications.unread_count(user)
+
+class ChatConsumer(RelayMixin, AsyncWebsocketConsumer):
+    """A chat room whose messages are stored before they are relayed.
+
+    Clients get the latest page of history on connect and can page back
+    with ``{"action": "load_history", "before": <message id>}``.
+    """
+
+    relay_types = ('chat_message',)
+
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f'chat_{self.room_name}'
@@ -37,6 +87,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
+        await self.send_history()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
@@ -46,25 +97,51 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
-        message = text_data_json['message']
+        if text_data_json.get('action') == 'load_history':
+            before = text_data_json.get('before')
+            await self.send_history(before if isinstance(before, int) else None, text_data_json.get('limit'))
+            return
+
         user = self.scope["user"]
+        message = str(text_data_json.get('message', '')).strip()[:settings.CHAT_MAX_LENGTH]
+        if user.is_anonymous or not message:
+            return
 
+        stored = await get_writer().write(
+            self.room_name, user.get_full_name() or user.get_username(), message, user.id
+        )
         await self.channel_layer.group_send(
             self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': message,
-                'user': user.get_full_name(),
-                'timestamp': timezone.now().isoformat()
-            }
+            {'type': 'chat_message', **stored}
         )
 
     async def chat_message(self, event):
         await self.send(text_data=json.dumps(event))
 
-class BookingConsumer(AsyncWebsocketConsumer):
+    async def send_history(self, before=None, limit=None):
+        messages = await database_sync_to_async(history)(
+            self.room_name, before, limit if isinstance(limit, int) else None
+        )
+        await self.send(text_data=json.dumps({
+            'type': 'chat_history',
+            'messages': messages,
+            'before': messages[0]['id'] if messages else None,
+        }))
+
+class BookingConsumer(RelayMixin, AsyncWebsocketConsumer):
+    """Seat availability of one tour.
+
+    Clients get a snapshot on connect and then the changes pushed to the
+    tour group by ``bookings.seat_updates``; nothing here polls the database.
+    """
+
+    relay_types = ('booking_update',)
+
     async def connect(self):
         self.tour_id = self.scope['url_route']['kwargs']['tour_id']
+        if not self.tour_id.isdigit():
+            await self.close()
+            return
         self.tour_group_name = f'tour_{self.tour_id}'
 
         await self.channel_layer.group_add(
@@ -72,37 +149,39 @@ class BookingConsumer(AsyncWebsocketConsumer):
             self.channel_name
         )
         await self.accept()
+        await self.send_snapshot()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.tour_group_name,
-            self.channel_name
-        )
+        if hasattr(self, 'tour_group_name'):
+            await self.channel_layer.group_discard(
+                self.tour_group_name,
+                self.channel_name
+            )
 
     async def receive(self, text_data):
-        # Handle seat availability updates
+        # Answered from the cached snapshot, not a query per client
         text_data_json = json.loads(text_data)
         action = text_data_json.get('action')
         
         if action == 'check_availability':
-            availability = await self.get_tour_availability()
-            await self.send(text_data=json.dumps({
-                'type': 'availability_update',
-                'available_seats': availability
-            }))
+            await self.send_snapshot()
+
+    async def send_snapshot(self):
+        dates = await self.get_snapshot()
+        next_open = next((row for row in dates if row['available_seats'] > 0), None)
+        await self.send(text_data=json.dumps({
+            'type': 'availability_update',
+            'tour_id': int(self.tour_id),
+            'dates': dates,
+            'available_seats': next_open['available_seats'] if next_open else 0,
+            'date': next_open['start_date'] if next_open else None,
+        }))
 
     async def booking_update(self, event):
         # Send booking updates to connected clients
         await self.send(text_data=json.dumps(event))
 
     @database_sync_to_async
-    def get_tour_availability(self):
-        from bookings.models import TourDate
-        try:
-            tour_date = TourDate.objects.get(
-                tour_id=self.tour_id,
-                start_date__gte=timezone.now()
-            )
-            return tour_date.available_seats
-        except TourDate.DoesNotExist:
-            return 0 
\ No newline at end of file
+    def get_snapshot(self):
+        from bookings.seat_updates import snapshot
+        return snapshot(int(self.tour_id))
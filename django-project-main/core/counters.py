@@ -0,0 +1,107 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+
+logger = logging.getLogger(__name__)
+
+_counters = []
+
+
+class BufferedCounter:
+    """Accumulate increments of an integer column in memory and write them in batches.
+
+    ``incr`` only touches a dict, so hot rows are no longer rewritten on
+    every hit. The first pending increment starts a timer, and when it
+    fires ``flush_interval`` seconds later everything pending is written
+    with one ``F()`` UPDATE per batch of rows; the rest is written at exit.
+    Reads should go through ``value`` so they include what has not been
+    flushed.
+    """
+
+    def __init__(self, model, field, flush_interval=None, batch_size=500):
+        self.model = model
+        self.field = field
+        self.flush_interval = flush_interval if flush_interval is not None else settings.COUNTER_FLUSH_INTERVAL
+        self.batch_size = batch_size
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+        _counters.append(self)
+
+    def incr(self, pk, amount=1):
+        with self._lock:
+            self._pending[pk] = self._pending.get(pk, 0) + amount
+            self._schedule()
+
+    def _schedule(self):
+        # With the lock held.
+        if self._timer is None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_in_thread)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def pending(self, pk):
+        return self._pending.get(pk, 0)
+
+    def value(self, instance):
+        """Return the stored value of ``instance`` plus its unflushed increments."""
+        return getattr(instance, self.field) + self.pending(instance.pk)
+
+    def flush(self):
+        """Write all pending increments; returns the number of rows updated.
+
+        A database error is logged, not raised: what was not written stays
+        pending and the next timer retries it.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        items = [(pk, delta) for pk, delta in pending.items() if delta]
+        updated = 0
+        try:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                delta = Case(
+                    *[When(pk=pk, then=Value(amount)) for pk, amount in batch],
+                    default=Value(0),
+                    output_field=IntegerField(),
+                )
+                updated += self.model.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+                    **{self.field: F(self.field) + delta}
+                )
+                items[start:start + self.batch_size] = [(pk, 0) for pk, _ in batch]
+        except Exception:
+            logger.exception('Could not flush %s.%s counters', self.model._meta.label, self.field)
+            with self._lock:
+                for pk, amount in items:
+                    if amount:
+                        self._pending[pk] = self._pending.get(pk, 0) + amount
+                if self._pending:
+                    self._schedule()
+        return updated
+
+    def _flush_in_thread(self):
+        try:
+            self.flush()
+        finally:
+            # Timer threads own their connection.
+            connection.close()
+
+
+def flush_all():
+    for counter in _counters:
+        counter.flush()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush_all()
+    except Exception:
+        pass
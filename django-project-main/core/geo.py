@@ -0,0 +1,153 @@
+import heapq
+import math
+import threading
+
+from django.db.models.signals import post_delete, post_save
+
+from .models import Destination
+from .versions import bumps, get_version
+
+EARTH_RADIUS_KM = 6371.0088
+VERSION_NAME = 'geo:destinations'
+
+
+def _to_xyz(lat, lon):
+    lat, lon = math.radians(lat), math.radians(lon)
+    cos_lat = math.cos(lat)
+    return (cos_lat * math.cos(lon), cos_lat * math.sin(lon), math.sin(lat))
+
+
+def _chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+
+def _km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two points in kilometres."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class KDTree:
+    """k-d tree of points on the unit sphere.
+
+    Points are stored as 3D unit vectors so straight-line (chord) distance
+    orders them exactly like great-circle distance, with no special cases
+    at the poles or the antimeridian. Nodes live in flat lists indexed by
+    position to keep the tree compact.
+    """
+
+    def __init__(self, points):
+        """``points`` is an iterable of ``(key, latitude, longitude)``."""
+        items = [(key, _to_xyz(float(lat), float(lon))) for key, lat, lon in points]
+        self.keys = []
+        self.coords = []
+        self.axes = []
+        self.left = []
+        self.right = []
+        self.root = self._build(items, 0)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build(self, items, depth):
+        if not items:
+            return -1
+        axis = depth % 3
+        items.sort(key=lambda item: item[1][axis])
+        middle = len(items) // 2
+        node = len(self.keys)
+        key, coord = items[middle]
+        self.keys.append(key)
+        self.coords.append(coord)
+        self.axes.append(axis)
+        self.left.append(-1)
+        self.right.append(-1)
+        self.left[node] = self._build(items[:middle], depth + 1)
+        self.right[node] = self._build(items[middle + 1:], depth + 1)
+        return node
+
+    def within(self, lat, lon, radius_km):
+        """Return ``(distance_km, key)`` for every point within ``radius_km``, nearest first."""
+        if not radius_km >= 0:
+            # The chord of a negative radius squares to a positive limit; NaN never matches.
+            return []
+        target = _to_xyz(lat, lon)
+        limit = _km_to_chord(radius_km)
+        limit_sq = limit * limit
+        found = []
+        stack = [self.root]
+        keys, coords, axes, left, right = self.keys, self.coords, self.axes, self.left, self.right
+        while stack:
+            node = stack.pop()
+            if node < 0:
+                continue
+            x, y, z = coords[node]
+            dist_sq = (x - target[0]) ** 2 + (y - target[1]) ** 2 + (z - target[2]) ** 2
+            if dist_sq <= limit_sq:
+                found.append((math.sqrt(dist_sq), keys[node]))
+            diff = target[axes[node]] - coords[node][axes[node]]
+            near, far = (left[node], right[node]) if diff < 0 else (right[node], left[node])
+            stack.append(near)
+            if diff * diff <= limit_sq:
+                stack.append(far)
+        found.sort()
+        return [(_chord_to_km(chord), key) for chord, key in found]
+
+    def nearest(self, lat, lon, k=5, exclude=()):
+        """Return the ``k`` nearest ``(distance_km, key)`` pairs, nearest first."""
+        if k <= 0:
+            return []
+        target = _to_xyz(lat, lon)
+        exclude = set(exclude)
+        best = []  # max-heap of (-dist_sq, key)
+        # Each entry carries the squared distance to the plane bounding its subtree.
+        stack = [(self.root, 0.0)]
+        keys, coords, axes, left, right = self.keys, self.coords, self.axes, self.left, self.right
+        while stack:
+            node, bound = stack.pop()
+            if node < 0 or (len(best) == k and bound > -best[0][0]):
+                continue
+            x, y, z = coords[node]
+            dist_sq = (x - target[0]) ** 2 + (y - target[1]) ** 2 + (z - target[2]) ** 2
+            if keys[node] not in exclude:
+                if len(best) < k:
+                    heapq.heappush(best, (-dist_sq, keys[node]))
+                elif dist_sq < -best[0][0]:
+                    heapq.heapreplace(best, (-dist_sq, keys[node]))
+            axis = axes[node]
+            diff = target[axis] - coords[node][axis]
+            near, far = (left[node], right[node]) if diff < 0 else (right[node], left[node])
+            stack.append((far, max(bound, diff * diff)))
+            stack.append((near, bound))
+        return [(_chord_to_km(math.sqrt(-neg)), key) for neg, key in sorted(best, reverse=True)]
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def get_destination_index():
+    """Return a k-d tree of active destinations, rebuilt after any destination change."""
+    global _index
+    version = get_version(VERSION_NAME)
+    index = _index
+    if index is None or index.version != version:
+        with _lock:
+            if _index is None or _index.version != version:
+                rows = Destination.objects.filter(is_active=True).values_list('id', 'latitude', 'longitude')
+                tree = KDTree(rows.iterator())
+                tree.version = version
+                _index = tree
+            index = _index
+    return index
+
+
+def connect_signals():
+    invalidate = bumps(VERSION_NAME)
+    post_save.connect(invalidate, sender=Destination, weak=False, dispatch_uid='geo_destination')
+    post_delete.connect(invalidate, sender=Destination, weak=False, dispatch_uid='geo_destination')
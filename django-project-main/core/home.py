@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+
+from blog.models import Post
+from bookings.models import Tour
+
+from .caching import get_or_build
+from .models import Category, Destination
+from .versions import bumps, get_version
+
+VERSION_NAME = 'home'
+CONTEXT_KEY = 'home:context'
+
+
+def build_home_context():
+    return {
+        'featured_destinations': list(Destination.objects.filter(is_active=True)[:6]),
+        'featured_tours': list(Tour.objects.filter(is_active=True).select_related('destination')[:6]),
+        'categories': list(Category.objects.filter(is_active=True)),
+        'latest_posts': list(Post.objects.filter(status='published').order_by('-published_at')[:3]),
+    }
+
+
+def get_home_context():
+    """Return the home page context, cached until the catalog or blog changes."""
+    context = dict(get_or_build(
+        CONTEXT_KEY, build_home_context, version_names=[VERSION_NAME], timeout=settings.HOME_CACHE_TIMEOUT
+    ))
+    # Template fragments are keyed on the same version.
+    context['home_version'] = get_version(VERSION_NAME)
+    context['home_cache_timeout'] = settings.HOME_CACHE_TIMEOUT
+    return context
+
+
+def connect_signals():
+    invalidate = bumps(VERSION_NAME)
+    for model in (Destination, Category, Tour, Post):
+        uid = f'home_{model._meta.label_lower}'
+        post_save.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
+        post_delete.connect(invalidate, sender=model, weak=False, dispatch_uid=uid)
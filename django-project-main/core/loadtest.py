@@ -0,0 +1,171 @@
+import asyncio
+import base64
+import os
+import struct
+import time
+from urllib.parse import urlsplit
+
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import InMemoryChannelLayer
+
+
+class SimulatedClient(ApplicationCommunicator):
+    """A websocket browser tab talking ASGI to the application directly.
+
+    Pass ``user`` to skip authentication when talking to a bare router, or
+    a session cookie in ``headers`` to go through the full application.
+    """
+
+    def __init__(self, application, path, user=None, headers=()):
+        scope = {
+            'type': 'websocket',
+            'path': path,
+            'headers': list(headers),
+            'subprotocols': [],
+        }
+        if user is not None:
+            scope['user'] = user
+        super().__init__(application, scope)
+
+    async def connect(self, timeout=30):
+        await self.send_input({'type': 'websocket.connect'})
+        message = await self.receive_output(timeout)
+        return message['type'] == 'websocket.accept'
+
+    async def send_message(self, text):
+        await self.send_input({'type': 'websocket.receive', 'text': text})
+
+    async def receive_message(self, timeout=30):
+        message = await self.receive_output(timeout)
+        return message.get('text')
+
+    async def disconnect(self):
+        await self.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.wait(1)
+
+
+class SocketClient:
+    """A websocket browser tab talking to a server over TCP.
+
+    Just enough of RFC 6455 for load tests: unfragmented text frames out,
+    text frames (fragmented or not) in, pings answered. Same interface as
+    SimulatedClient.
+    """
+
+    def __init__(self, url, path, headers=()):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.path = path
+        self.headers = list(headers)
+        self.reader = self.writer = None
+
+    async def connect(self, timeout=30):
+        self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), timeout)
+        request = [
+            f'GET {self.path} HTTP/1.1',
+            f'Host: {self.host}:{self.port}',
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            f'Sec-WebSocket-Key: {base64.b64encode(os.urandom(16)).decode()}',
+            'Sec-WebSocket-Version: 13',
+        ]
+        request += [f'{name}: {value}' for name, value in self.headers]
+        self.writer.write(('\r\n'.join(request) + '\r\n\r\n').encode())
+        response = await asyncio.wait_for(self.reader.readuntil(b'\r\n\r\n'), timeout)
+        return response.split(b' ', 2)[1] == b'101'
+
+    def _send_frame(self, opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('!BB', 0x80 | opcode, 0x80 | length)
+        elif length < 1 << 16:
+            header = struct.pack('!BBH', 0x80 | opcode, 0x80 | 126, length)
+        else:
+            header = struct.pack('!BBQ', 0x80 | opcode, 0x80 | 127, length)
+        mask = os.urandom(4)
+        key = (mask * (length // 4 + 1))[:length]
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes(key, 'big')).to_bytes(length, 'big')
+        self.writer.write(header + mask + masked)
+
+    async def send_message(self, text):
+        self._send_frame(0x1, text.encode())
+        await self.writer.drain()
+
+    async def receive_message(self, timeout=30):
+        return await asyncio.wait_for(self._receive(), timeout)
+
+    async def _receive(self):
+        fragments = []
+        while True:
+            first, second = await self.reader.readexactly(2)
+            opcode, length = first & 0x0F, second & 0x7F
+            if length == 126:
+                length, = struct.unpack('!H', await self.reader.readexactly(2))
+            elif length == 127:
+                length, = struct.unpack('!Q', await self.reader.readexactly(8))
+            payload = await self.reader.readexactly(length)  # servers never mask
+            if opcode == 0x8:
+                return None
+            if opcode == 0x9:
+                self._send_frame(0xA, payload)
+                continue
+            if opcode == 0xA:
+                continue
+            fragments.append(payload)
+            if first & 0x80:
+                return b''.join(fragments).decode()
+
+    async def disconnect(self):
+        if self.writer is None:
+            return
+        try:
+            self._send_frame(0x8, struct.pack('!H', 1000))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+
+
+def percentiles(samples, points=(50, 90, 99)):
+    """Nearest-rank percentiles of ``samples`` as {point: value}."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+    return {point: ordered[min(len(ordered) - 1, len(ordered) * point // 100)] for point in points}
+
+
+def rss_bytes(pid='self'):
+    """Resident memory of a process, or None where /proc is unavailable."""
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class BenchmarkChannelLayer(InMemoryChannelLayer):
+    """The in-memory layer with its expiry sweep run once a second.
+
+    The stock layer sweeps every channel on each send and receive, which is
+    quadratic in the number of clients and would be all a benchmark measured.
+    """
+
+    _swept = 0.0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self._swept >= 1:
+            self._swept = now
+            super()._clean_expired()
+
+
+IN_MEMORY_LAYER = {
+    'default': {
+        'BACKEND': 'core.loadtest.BenchmarkChannelLayer',
+        'CONFIG': {'capacity': 1000},
+    },
+}
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from bookings.models import Tour, TourReview
+from core.ratings import recompute_ratings
+from vendors.models import Vendor, VendorReview
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the stored rating averages and counts for tours and vendors'
+
+    def handle(self, *args, **kwargs):
+        tours = recompute_ratings(Tour, TourReview, 'tour')
+        self.stdout.write(self.style.SUCCESS(f'Updated ratings for {tours} tours'))
+        vendors = recompute_ratings(Vendor, VendorReview, 'vendor')
+        self.stdout.write(self.style.SUCCESS(f'Updated ratings for {vendors} vendors'))
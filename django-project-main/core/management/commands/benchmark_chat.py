@@ -0,0 +1,80 @@
+import asyncio
+import json
+import time
+
+from channels.routing import URLRouter
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from accounts.models import User
+from core.chat import get_writer
+from core.loadtest import IN_MEMORY_LAYER, SimulatedClient
+from core.models import ChatMessage
+from core.routing import websocket_urlpatterns
+
+
+class Command(BaseCommand):
+    help = (
+        'Runs chat rooms of simulated websocket clients on the in-memory channel layer and '
+        'reports stored and delivered messages per second per room'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10)
+        parser.add_argument('--clients', type=int, default=20, help='Clients per room')
+        parser.add_argument('--messages', type=int, default=500, help='Messages sent per room')
+        parser.add_argument('--keep', action='store_true', help='Keep the messages written')
+
+    def handle(self, *args, **options):
+        rooms = [f'loadtest{index}' for index in range(options['rooms'])]
+        ChatMessage.objects.filter(room__in=rooms).delete()
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                asyncio.run(self.run(rooms, options))
+        finally:
+            if not options['keep']:
+                ChatMessage.objects.filter(room__in=rooms).delete()
+
+    async def run(self, rooms, options):
+        application = URLRouter(websocket_urlpatterns)
+        user = User(username='loadtest', first_name='Load', last_name='Test')
+        clients = {
+            room: [SimulatedClient(application, f'ws/chat/{room}/', user) for _ in range(options['clients'])]
+            for room in rooms
+        }
+        everyone = [client for room_clients in clients.values() for client in room_clients]
+        await asyncio.gather(*(client.connect() for client in everyone))
+        await asyncio.gather(*(client.receive_message() for client in everyone))  # history page
+
+        writer = get_writer()
+        started = time.perf_counter()
+        results = await asyncio.gather(*(self.run_room(room_clients, options['messages']) for room_clients in clients.values()))
+        elapsed = time.perf_counter() - started
+
+        for room, seconds in zip(rooms, results):
+            self.stdout.write(f"{room}: {options['messages'] / seconds:,.0f} messages/s delivered to {options['clients']} clients")
+        total = options['messages'] * len(rooms)
+        self.stdout.write(
+            f'{total} messages stored in {writer.batches} INSERTs '
+            f'({writer.written / max(writer.batches, 1):.1f} per batch), {total / elapsed:,.0f} messages/s overall'
+        )
+
+        # A client joining late gets the tail of the room from the ring buffer.
+        late = SimulatedClient(application, f'ws/chat/{rooms[0]}/', user)
+        await late.connect()
+        started = time.perf_counter()
+        page = json.loads(await late.receive_message())
+        self.stdout.write(self.style.SUCCESS(
+            f"Late joiner got {len(page['messages'])} messages of history in {(time.perf_counter() - started) * 1000:.1f}ms"
+        ))
+        await asyncio.gather(*(client.disconnect() for client in everyone + [late]), return_exceptions=True)
+
+    async def run_room(self, clients, messages):
+        """Send ``messages`` round-robin from the room's clients; seconds until all are delivered everywhere."""
+        started = time.perf_counter()
+        for index in range(messages):
+            await clients[index % len(clients)].send_message(json.dumps({'message': f'message {index}'}))
+        for client in clients:
+            for _ in range(messages):
+                await client.receive_message()
+        return time.perf_counter() - started
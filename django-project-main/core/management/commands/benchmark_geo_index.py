@@ -0,0 +1,40 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.geo import KDTree
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks radius and nearest-neighbour lookups on a synthetic destination index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--points', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--radius', type=float, default=200.0, help='Radius in km')
+        parser.add_argument('--k', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        points = [(i, rng.uniform(-90, 90), rng.uniform(-180, 180)) for i in range(options['points'])]
+        queries = [(rng.uniform(-90, 90), rng.uniform(-180, 180)) for _ in range(options['queries'])]
+
+        started = time.perf_counter()
+        tree = KDTree(points)
+        self.stdout.write(f'Built index of {len(tree)} points in {time.perf_counter() - started:.2f}s')
+
+        for label, lookup in (
+            (f"within {options['radius']:g} km", lambda lat, lon: tree.within(lat, lon, options['radius'])),
+            (f"{options['k']} nearest", lambda lat, lon: tree.nearest(lat, lon, options['k'])),
+        ):
+            timings = []
+            for lat, lon in queries:
+                started = time.perf_counter()
+                lookup(lat, lon)
+                timings.append(time.perf_counter() - started)
+            timings.sort()
+            mean = sum(timings) / len(timings)
+            p99 = timings[int(len(timings) * 0.99) - 1]
+            self.stdout.write(f'{label}: mean {mean * 1000:.3f}ms, p99 {p99 * 1000:.3f}ms')
@@ -0,0 +1,286 @@
+import asyncio
+import importlib.util
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+from urllib.parse import urlsplit
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import get_default_application
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore as DatabaseSessionStore
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.utils import timezone
+
+from bookings.models import TourDate
+from core import notifications
+from core.loadtest import IN_MEMORY_LAYER, SimulatedClient, SocketClient, percentiles, rss_bytes
+from core.models import ChatMessage, Notification
+
+KINDS = ('notification', 'chat', 'booking')
+USERNAME_PREFIX = 'loadtest-'
+
+
+class Command(BaseCommand):
+    help = (
+        'Ramps up authenticated notification, chat and booking websocket clients against the ASGI '
+        'application, in-process or over TCP, and reports connect latency, round-trip percentiles '
+        'and memory per connection'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=3000)
+        parser.add_argument('--mix', default='1:1:1', help='Ratio of notification:chat:booking clients')
+        parser.add_argument('--ramp', type=float, default=500, help='New connections per second')
+        parser.add_argument('--rooms', type=int, default=20, help='Spread chat clients over this many rooms')
+        parser.add_argument('--tours', type=int, default=5, help='Spread booking clients over this many tours')
+        parser.add_argument('--users', type=int, default=200, help='Distinct users the clients log in as')
+        parser.add_argument('--round-trips', type=int, default=200, help='Round trips measured per client kind')
+        parser.add_argument('--concurrency', type=int, default=10, help='Round trips in flight at once')
+        parser.add_argument(
+            '--url', default=None,
+            help='Connect over TCP to the server at this ws:// URL instead of running the application in-process',
+        )
+        parser.add_argument('--serve', action='store_true', help='Start daphne on the --url port for the run')
+        parser.add_argument('--server-pid', type=int, default=None, help='Measure the memory of this server process')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='Keep the users, sessions and messages created')
+
+    def handle(self, *args, **options):
+        counts = self.split(options['clients'], options['mix'])
+        if options['serve'] and not options['url']:
+            raise CommandError('--serve needs --url, e.g. --url ws://127.0.0.1:8001')
+        tours = list(
+            TourDate.objects.filter(start_date__gte=timezone.localdate())
+            .order_by('tour_id').values_list('tour_id', flat=True).distinct()[:options['tours']]
+        )
+        if counts['booking'] and not tours:
+            raise CommandError('No tours with upcoming departures for booking clients.')
+        options['tour_ids'] = tours
+        options['room_names'] = [f'loadtest{index}' for index in range(options['rooms'])]
+
+        users, cookies = self.log_in(options['users'])
+        server = None
+        try:
+            if options['url']:
+                self.raise_open_file_limit()
+                if options['serve']:
+                    server = self.start_server(options['url'])
+                    options['server_pid'] = server.pid
+                asyncio.run(self.run(counts, users, cookies, options))
+            else:
+                layer = settings.CHANNEL_LAYERS['default']['BACKEND']
+                if layer == 'channels.layers.InMemoryChannelLayer':
+                    with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                        asyncio.run(self.run(counts, users, cookies, options))
+                else:
+                    asyncio.run(self.run(counts, users, cookies, options))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(10)
+            if not options['keep']:
+                self.clean_up(users, cookies, options['room_names'])
+
+    def split(self, clients, mix):
+        try:
+            weights = [int(part) for part in mix.split(':')]
+        except ValueError:
+            weights = []
+        if len(weights) != len(KINDS) or min(weights) < 0 or not sum(weights):
+            raise CommandError('--mix takes three non-negative weights, e.g. 2:1:1')
+        counts = {kind: clients * weight // sum(weights) for kind, weight in zip(KINDS, weights)}
+        counts[KINDS[weights.index(max(weights))]] += clients - sum(counts.values())
+        return counts
+
+    def log_in(self, count):
+        """Create the load-test users and a session for each; returns them with their session keys."""
+        User = get_user_model()
+        User.objects.bulk_create(
+            [User(username=f'{USERNAME_PREFIX}{index}', email=f'{USERNAME_PREFIX}{index}@example.com')
+             for index in range(count)],
+            ignore_conflicts=True,
+        )
+        users = list(User.objects.filter(
+            username__in=[f'{USERNAME_PREFIX}{index}' for index in range(count)]
+        ).order_by('pk'))
+        SessionStore = importlib.import_module(settings.SESSION_ENGINE).SessionStore
+        cookies = []
+        for user in users:
+            session = SessionStore()
+            session['_auth_user_id'] = str(user.pk)
+            session['_auth_user_backend'] = settings.AUTHENTICATION_BACKENDS[0]
+            session['_auth_user_hash'] = user.get_session_auth_hash()
+            session.create()
+            cookies.append(session.session_key)
+        return users, cookies
+
+    def clean_up(self, users, cookies, rooms):
+        SessionStore = importlib.import_module(settings.SESSION_ENGINE).SessionStore
+        if issubclass(SessionStore, DatabaseSessionStore):
+            SessionStore.get_model_class().objects.filter(session_key__in=cookies).delete()
+        else:
+            for key in cookies:
+                SessionStore(key).delete()
+        ChatMessage.objects.filter(room__in=rooms).delete()
+        Notification.objects.filter(user__in=users).delete()
+        get_user_model().objects.filter(pk__in=[user.pk for user in users]).delete()
+
+    def raise_open_file_limit(self):
+        # Every TCP client is a file descriptor; the default soft limit is often 1024.
+        try:
+            import resource
+        except ImportError:
+            return
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft != hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    def start_server(self, url):
+        if importlib.util.find_spec('daphne') is None:
+            raise CommandError('daphne is not installed; start an ASGI server yourself and pass its --url.')
+        parts = urlsplit(url)
+        server = subprocess.Popen([
+            sys.executable, '-m', 'daphne', '-b', parts.hostname, '-p', str(parts.port or 80),
+            settings.ASGI_APPLICATION.replace('.application', ':application'),
+        ])
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError(f'daphne exited with status {server.returncode}.')
+            try:
+                socket.create_connection((parts.hostname, parts.port or 80), 1).close()
+                self.stdout.write(f'Started daphne (pid {server.pid}) on {url}')
+                return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError('daphne did not start listening within 30s.')
+
+    def client(self, application, options, path, session_key):
+        cookie = f'{settings.SESSION_COOKIE_NAME}={session_key}'
+        if options['url']:
+            return SocketClient(options['url'], path, [('Cookie', cookie)])
+        return SimulatedClient(application, path, headers=[(b'cookie', cookie.encode())])
+
+    async def run(self, counts, users, cookies, options):
+        rng = random.Random(options['seed'])
+        application = None if options['url'] else get_default_application()
+        paths = {
+            'notification': lambda index: '/ws/notifications/',
+            'chat': lambda index: f"/ws/chat/{options['room_names'][index % len(options['room_names'])]}/",
+            'booking': lambda index: f"/ws/booking/{options['tour_ids'][index % len(options['tour_ids'])]}/",
+        }
+        plan = [(kind, index) for kind in KINDS for index in range(counts[kind])]
+        rng.shuffle(plan)
+
+        server_pid = options['server_pid'] or (None if options['url'] else 'self')
+        memory_before = rss_bytes(server_pid) if server_pid else None
+
+        clients = {kind: [] for kind in KINDS}
+        latencies = {kind: [] for kind in KINDS}
+        failed = {kind: 0 for kind in KINDS}
+
+        async def open_client(kind, index):
+            user_index = index % len(users)
+            client = self.client(application, options, paths[kind](index), cookies[user_index])
+            started = time.perf_counter()
+            try:
+                accepted = await client.connect()
+                if accepted:
+                    await client.receive_message()  # inbox, history page or seat snapshot
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                accepted = False
+            if not accepted:
+                failed[kind] += 1
+                return
+            latencies[kind].append(time.perf_counter() - started)
+            clients[kind].append((users[user_index], client))
+
+        started = time.perf_counter()
+        tasks = []
+        for position, (kind, index) in enumerate(plan):
+            await asyncio.sleep(max(0, started + position / options['ramp'] - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(open_client(kind, index)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        connected = sum(len(kind_clients) for kind_clients in clients.values())
+        self.stdout.write(f'Ramped up {connected} of {len(plan)} connections in {elapsed:.2f}s')
+
+        memory_after = rss_bytes(server_pid) if server_pid else None
+        try:
+            # Pushes from this process only reach another one through a shared channel layer.
+            pushable = not options['url'] or not isinstance(get_channel_layer(), InMemoryChannelLayer)
+            round_trips = {
+                'notification': (
+                    await self.measure(clients['notification'], self.notification_round_trip, options)
+                    if pushable else None
+                ),
+                'chat': await self.measure(clients['chat'], self.chat_round_trip, options),
+                'booking': await self.measure(clients['booking'], self.booking_round_trip, options),
+            }
+            for kind in KINDS:
+                if not counts[kind]:
+                    continue
+                line = f'{kind}: {len(clients[kind])} connected, {failed[kind]} failed; connect {self.format(latencies[kind])}'
+                if round_trips[kind] is None:
+                    line += '; round trip not measured (in-memory channel layer in another process)'
+                elif round_trips[kind]:
+                    line += f'; round trip {self.format(round_trips[kind])}'
+                self.stdout.write(line)
+            if memory_before is not None and memory_after is not None and connected:
+                where = 'server' if options['url'] else 'process, clients included'
+                self.stdout.write(self.style.SUCCESS(
+                    f'{(memory_after - memory_before) / connected / 1024:.1f} KiB per connection '
+                    f'({where}: {memory_before / 2 ** 20:.0f} MiB -> {memory_after / 2 ** 20:.0f} MiB)'
+                ))
+        finally:
+            everyone = [client for kind_clients in clients.values() for _, client in kind_clients]
+            await asyncio.gather(*(client.disconnect() for client in everyone), return_exceptions=True)
+
+    def format(self, samples):
+        points = percentiles(samples)
+        if not points:
+            return 'no samples'
+        return ' '.join(f'p{point} {value * 1000:.1f}ms' for point, value in points.items())
+
+    async def measure(self, clients, round_trip, options):
+        """Seconds per round trip, ``concurrency`` at a time over distinct clients."""
+        if not clients:
+            return []
+        samples = []
+        pending = list(range(options['round_trips']))
+        concurrency = min(options['concurrency'], len(clients))
+
+        async def worker(offset):
+            while pending:
+                number = pending.pop()
+                user, client = clients[(number * concurrency + offset) % len(clients)]
+                started = time.perf_counter()
+                await round_trip(user, client, f'rt-{number}-{time.perf_counter_ns()}')
+                samples.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker(offset) for offset in range(concurrency)))
+        return samples
+
+    async def chat_round_trip(self, user, client, token):
+        # Our message comes back once it is stored and relayed to the room.
+        await client.send_message(json.dumps({'message': token}))
+        while json.loads(await client.receive_message()).get('message') != token:
+            pass
+
+    async def booking_round_trip(self, user, client, token):
+        await client.send_message(json.dumps({'action': 'check_availability'}))
+        while json.loads(await client.receive_message()).get('type') != 'availability_update':
+            pass
+
+    async def notification_round_trip(self, user, client, token):
+        # Stored and pushed through the channel layer like any notification.
+        await notifications.adispatch(get_user_model().objects.filter(pk=user.pk), 'loadtest', token)
+        while json.loads(await client.receive_message()).get('title') != token:
+            pass
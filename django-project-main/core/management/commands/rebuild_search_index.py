@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text search index for tours, destinations and blog posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--kind', choices=['tour', 'destination', 'post'], help='Only rebuild one kind')
+
+    def handle(self, *args, **options):
+        written = search.rebuild(options['kind'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {written} documents'))
@@ -0,0 +1,26 @@
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from core.outbox import run
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outbox emails in batches over a reused SMTP connection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new emails')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop')
+        parser.add_argument('--smtp-host', default=None, help='Send through this SMTP server instead of EMAIL_BACKEND')
+        parser.add_argument('--smtp-port', type=int, default=25)
+
+    def handle(self, *args, **options):
+        connection = None
+        if options['smtp_host']:
+            connection = get_connection(
+                'django.core.mail.backends.smtp.EmailBackend',
+                host=options['smtp_host'], port=options['smtp_port'],
+                username='', password='', use_tls=False, use_ssl=False,
+            )
+        sent, failed = run(options['batch_size'], connection, options['loop'], options['interval'])
+        self.stdout.write(self.style.SUCCESS(f'Sent {sent} emails, {failed} failed attempts rescheduled'))
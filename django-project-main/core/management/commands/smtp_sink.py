@@ -0,0 +1,33 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from core.smtp_sink import SMTPSink
+
+
+class Command(BaseCommand):
+    help = 'Runs a local SMTP stand-in that accepts and counts messages, for testing the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=1025)
+        parser.add_argument('--delay', type=float, default=0.0, help='Seconds of latency per message')
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Share of messages rejected with 451')
+        parser.add_argument('--refuse', nargs='*', default=[], help='Recipients rejected with 550')
+        parser.add_argument(
+            '--disconnect-after', type=int, default=0, help='Drop each connection after this many messages'
+        )
+
+    def handle(self, *args, **options):
+        sink = SMTPSink(
+            options['host'], options['port'], options['delay'], options['fail_rate'],
+            refuse=options['refuse'], disconnect_after=options['disconnect_after'],
+        )
+        self.stdout.write(f"SMTP sink listening on {options['host']}:{options['port']}")
+        try:
+            asyncio.run(sink.serve())
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(
+            f'{sink.received} messages accepted, {sink.rejected} rejected over {sink.connections} connections'
+        )
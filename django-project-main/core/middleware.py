@@ -0,0 +1,51 @@
+import logging
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .querylog import QueryRecorder, get_query_budget
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudgetMiddleware:
+    """Record the SQL of each request and report N+1 patterns and budget overruns.
+
+    Enabled with ``QUERY_BUDGET_ENABLED``. Views declare their budget with
+    ``core.querylog.query_budget``; with ``QUERY_BUDGET_RAISE`` an overrun
+    raises instead of only being logged.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_BUDGET_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'QUERY_BUDGET_N_PLUS_ONE_THRESHOLD', 5)
+        self.raise_on_overrun = getattr(settings, 'QUERY_BUDGET_RAISE', False)
+
+    def __call__(self, request):
+        request.query_budget = None
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+            # Template responses render lazily; force it while still recording.
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+
+        response['X-Query-Count'] = str(len(recorder))
+        for group in recorder.repeated(self.threshold):
+            logger.warning('Possible N+1 on %s: %s', request.path, group)
+
+        budget = request.query_budget
+        if budget is not None and len(recorder) > budget:
+            message = f'{request.path} ran {len(recorder)} queries, budget is {budget}\n{recorder.report()}'
+            if self.raise_on_overrun:
+                raise QueryBudgetExceeded(message)
+            logger.error(message)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.query_budget = get_query_budget(view_func)
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_outboundemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='destination',
+            name='min_price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='next_departure',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='destination',
+            name='open_seats',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(fields=['is_active', 'min_price'], name='destination_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='destination',
+            index=models.Index(fields=['is_active', 'next_departure'], name='destination_departure_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.text import slugify
 from django.utils.translation import gettext_lazy as _
 
@@ -15,6 +16,17 @@ class Destination(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Listing summaries over active tours, maintained by bookings.summaries
+    min_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    next_departure = models.DateField(null=True, blank=True)
+    open_seats = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['is_active', 'min_price'], name='destination_price_idx'),
+            models.Index(fields=['is_active', 'next_departure'], name='destination_departure_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
@@ -65,3 +77,89 @@ class Review(models.Model):
 
     def __str__(self):
         return f"{self.user.get_full_name()} - {self.rating} stars"
+
+class SearchDocument(models.Model):
+    """Searchable text of a tour, destination or post, indexed by core.search."""
+    kind = models.CharField(max_length=20)
+    object_id = models.PositiveBigIntegerField()
+    title = models.CharField(max_length=255)
+    body = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['kind', 'object_id']
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} {self.title}"
+
+class OutboundEmail(models.Model):
+    """An email waiting in the outbox, sent by the send_outbox worker."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    from_email = models.CharField(max_length=255)
+    to = models.JSONField()
+    reply_to = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    claim = models.CharField(max_length=32, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outboundemail_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {', '.join(self.to)}"
+
+class ChatMessage(models.Model):
+    """A message posted to a chat room, written in batches by core.chat."""
+    room = models.CharField(max_length=100)
+    user = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, blank=True)
+    author = models.CharField(max_length=150)
+    body = models.TextField()
+    sent_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # History pages: newest first within a room, before a cursor id
+            models.Index(fields=['room', '-id'], name='chatmessage_room_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.room}: {self.author}"
+
+class Notification(models.Model):
+    """An entry in a user's inbox, pushed live by core.notifications when they are online."""
+    user = models.ForeignKey('accounts.User', on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=50)
+    title = models.CharField(max_length=200)
+    body = models.TextField(blank=True)
+    url = models.CharField(max_length=500, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Unread inbox, newest first
+            models.Index(
+                fields=['user', '-id'], name='notification_unread_idx', condition=models.Q(read_at__isnull=True)
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.title}"
@@ -0,0 +1,100 @@
+import asyncio
+import time
+from collections import namedtuple
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Notification
+
+DispatchStats = namedtuple('DispatchStats', ['recipients', 'chunks', 'seconds'])
+
+
+def group_name(user_id):
+    return f'user_{user_id}'
+
+
+def serialize(notification):
+    return {
+        'id': notification.pk,
+        'kind': notification.kind,
+        'title': notification.title,
+        'body': notification.body,
+        'url': notification.url,
+        'data': notification.data,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+def _store_chunk(audience, after, chunk_size, fields):
+    """Read the next chunk of recipients after user id ``after`` and store their notifications."""
+    user_ids = list(
+        audience.filter(pk__gt=after, is_active=True).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+    )
+    created_at = timezone.now()
+    notifications = Notification.objects.bulk_create(
+        [Notification(user_id=user_id, created_at=created_at, **fields) for user_id in user_ids]
+    )
+    return [(notification.user_id, serialize(notification)) for notification in notifications]
+
+
+async def adispatch(audience, kind, title, body='', url='', data=None, chunk_size=None, concurrency=None):
+    """Store a notification for every user in ``audience`` and push it to those online.
+
+    ``audience`` is a User queryset. Recipients are read in keyset chunks
+    of ``chunk_size``, each stored with one INSERT, so the inbox holds the
+    notification for users who are offline. Each chunk is pushed to the
+    ``user_<id>`` groups with at most ``concurrency`` sends in flight,
+    while the next chunk is read and stored.
+    """
+    chunk_size = chunk_size or settings.NOTIFICATION_CHUNK_SIZE
+    semaphore = asyncio.Semaphore(concurrency or settings.NOTIFICATION_CONCURRENCY)
+    channel_layer = get_channel_layer()
+    fields = {'kind': kind, 'title': title, 'body': body, 'url': url, 'data': data or {}}
+
+    async def send(user_id, payload):
+        async with semaphore:
+            await channel_layer.group_send(group_name(user_id), {'type': 'notification', 'data': payload})
+
+    started = time.perf_counter()
+    recipients = chunks = 0
+    after = 0
+    sending = None
+    while True:
+        chunk = await database_sync_to_async(_store_chunk)(audience, after, chunk_size, fields)
+        if sending is not None:
+            await sending
+            sending = None
+        if not chunk:
+            break
+        recipients += len(chunk)
+        chunks += 1
+        after = chunk[-1][0]
+        if channel_layer is not None:
+            sending = asyncio.ensure_future(asyncio.gather(*(send(user_id, payload) for user_id, payload in chunk)))
+    return DispatchStats(recipients, chunks, time.perf_counter() - started)
+
+
+def dispatch(audience, kind, title, **kwargs):
+    """Synchronous ``adispatch``, for management commands and workers."""
+    return async_to_sync(adispatch)(audience, kind, title, **kwargs)
+
+
+def unread(user, limit=20):
+    """The user's unread notifications, newest first."""
+    return [serialize(n) for n in Notification.objects.filter(user=user, read_at__isnull=True).order_by('-id')[:limit]]
+
+
+def unread_count(user):
+    return Notification.objects.filter(user=user, read_at__isnull=True).count()
+
+
+def mark_read(user, ids=None):
+    """Mark the user's notifications ``ids`` (all if None) read; returns how many changed."""
+    notifications = Notification.objects.filter(user=user, read_at__isnull=True)
+    if ids is not None:
+        notifications = notifications.filter(pk__in=ids)
+    return notifications.update(read_at=timezone.now())
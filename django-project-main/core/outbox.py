@@ -0,0 +1,160 @@
+import smtplib
+import socket
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+# Errors that mean the connection itself is gone, not just this message.
+# Not OSError: every SMTPException is one, including a server's refusal
+# of a single message.
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, socket.timeout)
+
+
+def enqueue(subject, body, to, from_email=None, html_body='', reply_to=None):
+    """Put an email in the outbox and return it.
+
+    The row is written in the caller's transaction, so an email about a
+    change is only sent if that change commits.
+    """
+    return OutboundEmail.objects.create(
+        subject=subject[:255],
+        body=body,
+        html_body=html_body,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        to=list(to),
+        reply_to=list(reply_to or []),
+    )
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``: exponential, capped."""
+    return timedelta(seconds=min(settings.OUTBOX_RETRY_BASE * 2 ** (attempts - 1), settings.OUTBOX_RETRY_MAX))
+
+
+def claim_batch(batch_size=None):
+    """Lease a batch of due emails to this worker; returns the claimed emails."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    claimable = Q(status='pending', next_attempt_at__lte=now) | Q(status='sending', locked_until__lt=now)
+    token = uuid.uuid4().hex
+    ids = list(
+        OutboundEmail.objects.filter(claimable).order_by('next_attempt_at').values_list('pk', flat=True)[:batch_size]
+    )
+    if not ids:
+        return []
+    # Conditional, so two workers that read the same ids cannot both claim them.
+    OutboundEmail.objects.filter(claimable, pk__in=ids).update(
+        status='sending', claim=token, locked_until=now + timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+    )
+    return list(OutboundEmail.objects.filter(claim=token, status='sending').order_by('next_attempt_at'))
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email,
+        to=email.to,
+        reply_to=email.reply_to or None,
+        connection=connection,
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def send_batch(batch_size=None, connection=None):
+    """Send one batch over a single SMTP connection; returns ``(sent, failed)``.
+
+    Each email is marked sent as soon as the server accepts it. An email
+    the server refuses is failed on its own row: for good on a permanent
+    (5xx) refusal, otherwise rescheduled with exponential backoff and
+    failed after OUTBOX_MAX_ATTEMPTS. If the server drops the connection
+    mid-batch it is reopened once; if that fails too, the emails not yet
+    sent are rescheduled.
+    """
+    emails = claim_batch(batch_size)
+    if not emails:
+        return 0, 0
+    connection = connection or get_connection()
+    sent = failed = 0
+    position = 0
+    reconnected = False
+    try:
+        connection.open()
+        while position < len(emails):
+            email = emails[position]
+            try:
+                _message(email, connection).send()
+            except _CONNECTION_ERRORS:
+                if reconnected:
+                    raise
+                reconnected = True
+                connection.close()
+                connection.open()
+                continue  # the same email, on the new connection
+            except Exception as exc:
+                _retry(email, exc, permanent=_permanent(exc))
+                failed += 1
+            else:
+                _mark_sent(email)
+                sent += 1
+            position += 1
+    except Exception as exc:
+        # No connection: reschedule everything not sent yet.
+        for email in emails[position:]:
+            _retry(email, exc)
+            failed += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _permanent(exc):
+    """Whether the server refused the message for good, with a 5xx reply."""
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, _ in exc.recipients.values()]
+    else:
+        codes = [getattr(exc, 'smtp_code', 0)]
+    return bool(codes) and all(500 <= code < 600 for code in codes)
+
+
+def _mark_sent(email):
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        status='sent', sent_at=timezone.now(), claim='', locked_until=None, last_error=''
+    )
+    email.status = 'sent'
+
+
+def _retry(email, exc, permanent=False):
+    attempts = email.attempts + 1
+    give_up = permanent or attempts >= settings.OUTBOX_MAX_ATTEMPTS
+    OutboundEmail.objects.filter(pk=email.pk).update(
+        status='failed' if give_up else 'pending',
+        attempts=attempts,
+        next_attempt_at=timezone.now() + backoff(attempts),
+        last_error=f'{type(exc).__name__}: {exc}',
+        claim='',
+        locked_until=None,
+    )
+    email.status = 'failed' if give_up else 'pending'
+
+
+def run(batch_size=None, connection=None, loop=False, interval=5.0):
+    """Send until the outbox has nothing due; with ``loop``, keep polling."""
+    sent = failed = 0
+    while True:
+        batch_sent, batch_failed = send_batch(batch_size, connection)
+        sent += batch_sent
+        failed += batch_failed
+        if not batch_sent and not batch_failed:
+            if not loop:
+                return sent, failed
+            time.sleep(interval)
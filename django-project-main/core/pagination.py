@@ -0,0 +1,110 @@
+import base64
+import json
+from datetime import date
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    """Encode the sort key of the last row on a page as an opaque token."""
+    raw = json.dumps([v.isoformat() if isinstance(v, date) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(token) from exc
+    if not isinstance(values, list):
+        raise InvalidCursor(token)
+    return values
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """Cursor pagination over a fixed sort key, descending unless ``descending=False``.
+
+    ``fields`` must end with a unique column (normally ``id``) so the order
+    is total, and must not be nullable. Each page is a range scan starting
+    after the previous page's last row, so deep pages cost the same as the
+    first one, unlike OFFSET.
+    """
+
+    def __init__(self, queryset, fields=('created_at', 'id'), per_page=12, descending=True):
+        self.queryset = queryset
+        self.fields = tuple(fields)
+        self.per_page = per_page
+        self.descending = descending
+
+    def _after(self, values):
+        # (a, b) < (x, y)  <=>  a < x OR (a = x AND b < y), expanded for any length.
+        lookup = 'lt' if self.descending else 'gt'
+        condition = Q()
+        for i, field in enumerate(self.fields):
+            step = Q(**{f'{field}__{lookup}': values[i]})
+            for prev_field, prev_value in zip(self.fields[:i], values[:i]):
+                step &= Q(**{prev_field: prev_value})
+            condition |= step
+        return condition
+
+    def _parse(self, values):
+        """Convert decoded cursor values to the fields' types; InvalidCursor if any does not fit."""
+        parsed = []
+        for field, value in zip(self.fields, values):
+            model_field = self.queryset.model._meta.get_field(field)
+            internal_type = model_field.get_internal_type()
+            # Dates travel as ISO strings, everything else as a JSON string or number.
+            expected = str if internal_type in ('DateTimeField', 'DateField') else (str, int, float)
+            if isinstance(value, bool) or not isinstance(value, expected):
+                raise InvalidCursor(field)
+            raw = value
+            try:
+                value = model_field.to_python(value)
+                # Range checks, so an out-of-range id cannot overflow the database integer.
+                model_field.run_validators(value)
+            except (ValidationError, TypeError, ValueError, OverflowError) as exc:
+                raise InvalidCursor(field) from exc
+            # Integer fields truncate 1.5 to 1, which would resume from the wrong row.
+            if value is None or (isinstance(raw, float) and isinstance(value, int) and value != raw):
+                raise InvalidCursor(field)
+            parsed.append(value)
+        return parsed
+
+    def get_page(self, cursor=None):
+        prefix = '-' if self.descending else ''
+        queryset = self.queryset.order_by(*[f'{prefix}{field}' for field in self.fields])
+        if cursor:
+            values = decode_cursor(cursor)
+            if len(values) != len(self.fields):
+                raise InvalidCursor(cursor)
+            queryset = queryset.filter(self._after(self._parse(values)))
+
+        rows = list(queryset[:self.per_page + 1])
+        next_cursor = None
+        if len(rows) > self.per_page:
+            rows = rows[:self.per_page]
+            last = rows[-1]
+            next_cursor = encode_cursor([getattr(last, field) for field in self.fields])
+        return KeysetPage(rows, next_cursor)
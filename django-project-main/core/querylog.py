@@ -0,0 +1,135 @@
+import re
+import sys
+import time
+from collections import OrderedDict
+from contextlib import ExitStack
+
+from django.db import connections
+from django.template.base import Node
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN \(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_PLACEHOLDER_RE = re.compile(r'%s|\?')
+
+
+def query_budget(max_queries):
+    """Declare the maximum number of SQL queries a view may run per request."""
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+def get_query_budget(view_func):
+    """Return the budget declared with ``query_budget`` for ``view_func``, if any."""
+    budget = getattr(view_func, 'query_budget', None)
+    if budget is None and hasattr(view_func, 'view_class'):
+        budget = getattr(view_func.view_class, 'query_budget', None)
+    return budget
+
+
+def query_shape(sql):
+    """Reduce ``sql`` to its shape by stripping literals and parameter lists."""
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _PLACEHOLDER_RE.sub('?', shape)
+    shape = _IN_LIST_RE.sub('IN (...)', shape)
+    return ' '.join(shape.split())
+
+
+def template_location(frame=None):
+    """Return ``"template.html:line"`` for the innermost template node on the stack."""
+    frame = frame or sys._getframe(1)
+    while frame is not None:
+        node = frame.f_locals.get('self')
+        # type() rather than isinstance() so lazy objects are not evaluated.
+        if issubclass(type(node), Node):
+            token = getattr(node, 'token', None)
+            origin = getattr(node, 'origin', None)
+            if token is not None and origin is not None:
+                return f'{origin.template_name or origin.name}:{token.lineno}'
+        frame = frame.f_back
+    return None
+
+
+class QueryRecord:
+    __slots__ = ('sql', 'shape', 'duration', 'location')
+
+    def __init__(self, sql, duration, location):
+        self.sql = sql
+        self.shape = query_shape(sql)
+        self.duration = duration
+        self.location = location
+
+
+class QueryGroup:
+    """Queries of one shape, as reported by ``QueryRecorder.repeated``."""
+
+    def __init__(self, shape):
+        self.shape = shape
+        self.records = []
+
+    @property
+    def count(self):
+        return len(self.records)
+
+    @property
+    def locations(self):
+        return sorted({record.location for record in self.records if record.location})
+
+    def __str__(self):
+        where = ', '.join(self.locations) or 'outside templates'
+        return f'{self.count}x {self.shape[:200]} (from {where})'
+
+
+class QueryRecorder:
+    """Record every SQL statement run on all database connections.
+
+    Use as a context manager; statements are grouped by shape so repeated
+    per-row lookups (N+1 patterns) stand out.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.records = []
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        aliases = [self.using] if self.using else list(connections)
+        for alias in aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.records.append(QueryRecord(sql, duration, template_location(sys._getframe(1))))
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def total_time(self):
+        return sum(record.duration for record in self.records)
+
+    def groups(self):
+        grouped = OrderedDict()
+        for record in self.records:
+            grouped.setdefault(record.shape, QueryGroup(record.shape)).records.append(record)
+        return list(grouped.values())
+
+    def repeated(self, threshold=2):
+        """Return the query groups that ran at least ``threshold`` times."""
+        return [group for group in self.groups() if group.count >= threshold]
+
+    def report(self, threshold=2):
+        lines = [f'{len(self)} queries in {self.total_time * 1000:.1f}ms']
+        lines.extend(f'  {group}' for group in self.repeated(threshold))
+        return '\n'.join(lines)
@@ -0,0 +1,83 @@
+from django.db.models import Case, Count, F, FloatField, Sum, Value, When
+from django.db.models.functions import Cast
+from django.db.models.signals import post_delete, post_save, pre_save
+
+
+def apply_rating_change(model, pk, count_delta, sum_delta):
+    """Fold a change in review count and rating sum into the stored aggregates.
+
+    Runs as one UPDATE using the row's current values, so concurrent
+    reviews on the same object do not overwrite each other. The count and
+    the integer sum are exact; ``rating_avg`` is derived from them each
+    time, so it never drifts however many reviews come and go.
+    """
+    new_count = F('rating_count') + count_delta
+    new_sum = F('rating_sum') + sum_delta
+    model.objects.filter(pk=pk).update(
+        rating_avg=Case(
+            When(rating_count=-count_delta, then=Value(0.0)),
+            default=Cast(new_sum, FloatField()) / Cast(new_count, FloatField()),
+            output_field=FloatField(),
+        ),
+        rating_count=new_count,
+        rating_sum=new_sum,
+    )
+
+
+def recompute_ratings(model, review_model, fk_name):
+    """Rebuild ``rating_avg``/``rating_count``/``rating_sum`` for every row of ``model``.
+
+    Uses a single GROUP BY over ``review_model`` and returns the number of
+    rows updated.
+    """
+    stats = review_model.objects.values(fk_name).annotate(
+        total=Sum('rating'), count=Count('id')
+    ).order_by()
+    objects = []
+    rated = set()
+    for row in stats:
+        rated.add(row[fk_name])
+        objects.append(model(
+            pk=row[fk_name], rating_avg=row['total'] / row['count'], rating_count=row['count'],
+            rating_sum=row['total'],
+        ))
+    model.objects.bulk_update(objects, ['rating_avg', 'rating_count', 'rating_sum'], batch_size=500)
+    model.objects.exclude(pk__in=rated).exclude(rating_count=0, rating_sum=0).update(
+        rating_avg=0, rating_count=0, rating_sum=0
+    )
+    return len(objects)
+
+
+def track_ratings(review_model, fk_name):
+    """Keep the rating aggregates of ``review_model.<fk_name>`` in sync."""
+    field = review_model._meta.get_field(fk_name)
+    target = field.related_model
+    attname = field.attname
+
+    def remember_previous(sender, instance, raw=False, **kwargs):
+        instance._previous_rating = None
+        if instance.pk and not raw:
+            instance._previous_rating = sender.objects.filter(pk=instance.pk).values_list(
+                attname, 'rating'
+            ).first()
+
+    def on_save(sender, instance, created, raw=False, **kwargs):
+        if raw:
+            return
+        previous = getattr(instance, '_previous_rating', None)
+        target_id = getattr(instance, attname)
+        if created or previous is None:
+            apply_rating_change(target, target_id, 1, instance.rating)
+        elif previous[0] != target_id:
+            apply_rating_change(target, previous[0], -1, -previous[1])
+            apply_rating_change(target, target_id, 1, instance.rating)
+        elif previous[1] != instance.rating:
+            apply_rating_change(target, target_id, 0, instance.rating - previous[1])
+
+    def on_delete(sender, instance, **kwargs):
+        apply_rating_change(target, getattr(instance, attname), -1, -instance.rating)
+
+    uid = f'ratings_{review_model._meta.label_lower}'
+    pre_save.connect(remember_previous, sender=review_model, weak=False, dispatch_uid=uid)
+    post_save.connect(on_save, sender=review_model, weak=False, dispatch_uid=uid)
+    post_delete.connect(on_delete, sender=review_model, weak=False, dispatch_uid=uid)
@@ -0,0 +1,233 @@
+import re
+from collections import namedtuple
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.db.models.signals import post_delete, post_save
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import SearchDocument
+
+SearchHit = namedtuple('SearchHit', ['kind', 'object_id', 'title', 'snippet', 'rank'])
+
+# Highlight markers survive HTML escaping and are swapped for <mark> afterwards.
+_START, _STOP = '\x02', '\x03'
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+_registry = {}
+
+
+class SearchSource:
+    def __init__(self, model, kind, title, body, visible, queryset):
+        self.model = model
+        self.kind = kind
+        self.title = title
+        self.body = body
+        self.visible = visible
+        self.queryset = queryset or model._default_manager.all
+
+    def document(self, instance):
+        return {
+            'title': self.title(instance)[:255],
+            'body': self.body(instance),
+        }
+
+
+def register(model, kind, title, body, visible=None, queryset=None, follows=None):
+    """Index ``model`` under ``kind`` and keep it updated from model signals.
+
+    ``title`` and ``body`` are callables returning the text to index for an
+    instance; instances for which ``visible`` returns False are kept out.
+    ``queryset`` optionally returns the queryset used by ``rebuild``.
+    ``follows`` maps other models whose text goes into the document to the
+    lookup from ``model`` to them, e.g. ``{Destination: 'destination'}``;
+    saving one of those reindexes the objects that point at it.
+    """
+    source = SearchSource(model, kind, title, body, visible or (lambda instance: True), queryset)
+    _registry[kind] = source
+
+    def on_save(sender, instance, raw=False, **kwargs):
+        if not raw:
+            index_object(source, instance)
+
+    def on_delete(sender, instance, **kwargs):
+        SearchDocument.objects.filter(kind=kind, object_id=instance.pk).delete()
+
+    uid = f'search_{kind}'
+    post_save.connect(on_save, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(on_delete, sender=model, weak=False, dispatch_uid=uid)
+
+    for related_model, lookup in (follows or {}).items():
+        def on_related_save(sender, instance, raw=False, lookup=lookup, **kwargs):
+            if not raw:
+                for obj in source.queryset().filter(**{lookup: instance}).iterator(chunk_size=500):
+                    index_object(source, obj)
+
+        post_save.connect(
+            on_related_save, sender=related_model, weak=False,
+            dispatch_uid=f'{uid}_{related_model._meta.label_lower}',
+        )
+    return source
+
+
+def index_object(source, instance):
+    if source.visible(instance):
+        SearchDocument.objects.update_or_create(
+            kind=source.kind, object_id=instance.pk, defaults=source.document(instance)
+        )
+    else:
+        SearchDocument.objects.filter(kind=source.kind, object_id=instance.pk).delete()
+
+
+def rebuild(kind=None, batch_size=500):
+    """Reindex every registered source (or just ``kind``); returns documents written."""
+    written = 0
+    for source in ([_registry[kind]] if kind else _registry.values()):
+        SearchDocument.objects.filter(kind=source.kind).delete()
+        documents = []
+        for instance in source.queryset().iterator(chunk_size=batch_size):
+            if source.visible(instance):
+                documents.append(SearchDocument(kind=source.kind, object_id=instance.pk, **source.document(instance)))
+            if len(documents) >= batch_size:
+                written += len(SearchDocument.objects.bulk_create(documents))
+                documents = []
+        written += len(SearchDocument.objects.bulk_create(documents))
+    return written
+
+
+def _kind_for(model):
+    for kind, source in _registry.items():
+        if source.model is model:
+            return kind
+    raise LookupError(f'{model.__name__} is not registered for search')
+
+
+def _terms(query):
+    return [term.lower() for term in _TERM_RE.findall(query or '')][:10]
+
+
+def _highlight(snippet):
+    return mark_safe(escape(snippet or '').replace(_START, '<mark>').replace(_STOP, '</mark>'))
+
+
+def _sqlite_match(terms):
+    # Every term must match; the last one also as a prefix for search-as-you-type.
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += '*'
+    return ' '.join(quoted)
+
+
+def _postgresql_match(terms):
+    # As for SQLite: only the last term is a prefix.
+    return ' & '.join(terms[:-1] + [f'{terms[-1]}:*'])
+
+
+def _match_subquery(terms, kind):
+    """SQL selecting the ``object_id`` of every ``kind`` document matching ``terms``."""
+    if connection.vendor == 'sqlite':
+        return (
+            'SELECT d.object_id FROM core_searchdocument_fts f '
+            'JOIN core_searchdocument d ON d.id = f.rowid '
+            'WHERE f.core_searchdocument_fts MATCH %s AND d.kind = %s',
+            [_sqlite_match(terms), kind],
+        )
+    if connection.vendor == 'postgresql':
+        return (
+            "SELECT object_id FROM core_searchdocument "
+            "WHERE search_vector @@ to_tsquery('english', %s) AND kind = %s",
+            [_postgresql_match(terms), kind],
+        )
+    condition = ' AND '.join(['(LOWER(title) LIKE %s OR LOWER(body) LIKE %s)'] * len(terms))
+    params = []
+    for term in terms:
+        params.extend([f'%{term}%', f'%{term}%'])
+    return f'SELECT object_id FROM core_searchdocument WHERE {condition} AND kind = %s', params + [kind]
+
+
+def search(query, kinds=None, limit=20, offset=0):
+    """Return ranked ``SearchHit``s for ``query``, best match first.
+
+    Terms are ANDed and the last term matches as a prefix. Snippets are
+    HTML-safe with matches wrapped in ``<mark>``.
+    """
+    terms = _terms(query)
+    if not terms:
+        return []
+    kinds = list(kinds or _registry)
+    kind_placeholders = ', '.join(['%s'] * len(kinds))
+
+    if connection.vendor == 'sqlite':
+        sql = (
+            'SELECT d.kind, d.object_id, d.title, '
+            f"snippet(core_searchdocument_fts, 1, '{_START}', '{_STOP}', '…', 24), "
+            'bm25(core_searchdocument_fts, 10.0, 1.0) AS rank '
+            'FROM core_searchdocument_fts '
+            'JOIN core_searchdocument d ON d.id = core_searchdocument_fts.rowid '
+            f'WHERE core_searchdocument_fts MATCH %s AND d.kind IN ({kind_placeholders}) '
+            'ORDER BY rank LIMIT %s OFFSET %s'
+        )
+        params = [_sqlite_match(terms), *kinds, limit, offset]
+    elif connection.vendor == 'postgresql':
+        sql = (
+            'SELECT kind, object_id, title, '
+            "ts_headline('english', body, q, %s), "
+            'ts_rank(search_vector, q) AS rank '
+            "FROM core_searchdocument, to_tsquery('english', %s) q "
+            f'WHERE search_vector @@ q AND kind IN ({kind_placeholders}) '
+            'ORDER BY rank DESC LIMIT %s OFFSET %s'
+        )
+        headline = f'StartSel={_START}, StopSel={_STOP}, MaxWords=35, MinWords=15'
+        params = [headline, _postgresql_match(terms), *kinds, limit, offset]
+    else:
+        documents = SearchDocument.objects.filter(kind__in=kinds)
+        for term in terms:
+            documents = documents.filter(Q(title__icontains=term) | Q(body__icontains=term))
+        return [
+            SearchHit(d.kind, d.object_id, d.title, _highlight(d.body[:200]), 0)
+            for d in documents.order_by('-updated_at')[offset:offset + limit]
+        ]
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return [SearchHit(kind, object_id, title, _highlight(snippet), rank) for kind, object_id, title, snippet, rank in rows]
+
+
+def search_queryset(queryset, query, ranked=False, limit=500):
+    """Restrict ``queryset`` to objects matching ``query``.
+
+    Unranked, the match is a subquery and the caller keeps its own ordering
+    and pagination. Ranked, the best ``limit`` matches are returned in
+    relevance order with a ``search_rank`` annotation.
+    """
+    terms = _terms(query)
+    if not terms:
+        return queryset
+    kind = _kind_for(queryset.model)
+    if not ranked:
+        return queryset.filter(pk__in=RawSQL(*_match_subquery(terms, kind)))
+
+    hits = search(query, kinds=[kind], limit=limit)
+    if not hits:
+        return queryset.none()
+    order = Case(
+        *[When(pk=hit.object_id, then=Value(position)) for position, hit in enumerate(hits)],
+        output_field=IntegerField(),
+    )
+    return queryset.filter(pk__in=[hit.object_id for hit in hits]).annotate(search_rank=order).order_by('search_rank')
+
+
+def search_objects(queryset, query, limit=50, offset=0):
+    """Return model instances for the best matches, each with ``search_snippet`` set."""
+    hits = search(query, kinds=[_kind_for(queryset.model)], limit=limit, offset=offset)
+    objects = queryset.in_bulk([hit.object_id for hit in hits])
+    results = []
+    for hit in hits:
+        instance = objects.get(hit.object_id)
+        if instance is not None:
+            instance.search_snippet = hit.snippet
+            instance.search_rank = hit.rank
+            results.append(instance)
+    return results
@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+
+class SMTPSink:
+    """A minimal local SMTP server that accepts and counts messages.
+
+    It stands in for a real relay when exercising the outbox: ``delay``
+    adds latency per message and ``fail_rate`` rejects a share of them
+    with a temporary error, to exercise retries. Recipients in ``refuse``
+    are rejected for good, and ``disconnect_after`` drops each connection
+    after that many accepted messages.
+    """
+
+    def __init__(self, host='127.0.0.1', port=1025, delay=0.0, fail_rate=0.0, seed=None,
+                 refuse=(), disconnect_after=0):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.refuse = {address.lower() for address in refuse}
+        self.disconnect_after = disconnect_after
+        self.rng = random.Random(seed)
+        self.received = 0
+        self.rejected = 0
+        self.connections = 0
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        accepted = 0
+
+        async def reply(line):
+            writer.write(f'{line}\r\n'.encode())
+            await writer.drain()
+
+        await reply('220 localhost SMTP sink')
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode(errors='replace').strip().upper()
+            if command.startswith('EHLO'):
+                await reply('250-localhost')
+                await reply('250 8BITMIME')
+            elif command.startswith('RCPT') and command.partition('<')[2].partition('>')[0].lower() in self.refuse:
+                await reply('550 No such user here')
+            elif command.startswith(('HELO', 'MAIL', 'RCPT', 'RSET', 'NOOP')):
+                await reply('250 OK')
+            elif command == 'DATA':
+                await reply('354 End data with <CR><LF>.<CR><LF>')
+                while (await reader.readline()) not in (b'.\r\n', b'.\n', b''):
+                    pass
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if self.rng.random() < self.fail_rate:
+                    self.rejected += 1
+                    await reply('451 Temporary failure, try again later')
+                else:
+                    self.received += 1
+                    accepted += 1
+                    await reply('250 Queued')
+                    if accepted == self.disconnect_after:
+                        break
+            elif command == 'QUIT':
+                await reply('221 Bye')
+                break
+            else:
+                await reply('502 Command not implemented')
+        writer.close()
+
+    async def start(self):
+        """Start listening and return the server; port 0 picks a free port."""
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        return server
+
+    async def serve(self):
+        server = await self.start()
+        async with server:
+            await server.serve_forever()
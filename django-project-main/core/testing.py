@@ -0,0 +1,34 @@
+from contextlib import contextmanager
+
+from django.urls import resolve
+
+from .querylog import QueryRecorder, get_query_budget
+
+
+class QueryBudgetTestMixin:
+    """TestCase helpers that fail on query budget overruns and N+1 patterns."""
+
+    n_plus_one_threshold = 5
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with QueryRecorder() as recorder:
+            yield recorder
+        if len(recorder) > budget:
+            self.fail(f'Expected at most {budget} queries, got {len(recorder)}\n{recorder.report()}')
+
+    def assertWithinQueryBudget(self, path, data=None, budget=None):
+        """GET ``path`` and check it against ``budget`` or the view's declared budget."""
+        if budget is None:
+            budget = get_query_budget(resolve(path).func)
+        if budget is None:
+            self.fail(f'No query budget declared for {path}')
+        with self.assertMaxQueries(budget) as recorder:
+            response = self.client.get(path, data)
+        self.assertNoNPlusOne(recorder)
+        return response
+
+    def assertNoNPlusOne(self, recorder, threshold=None):
+        repeated = recorder.repeated(threshold or self.n_plus_one_threshold)
+        if repeated:
+            self.fail('Repeated queries look like N+1:\n' + '\n'.join(f'  {group}' for group in repeated))
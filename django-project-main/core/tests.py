@@ -1,3 +1,506 @@
-from django.test import TestCase
+import asyncio
+import json
+import io
+import random
+import struct
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import aclose_old_connections
+from channels.routing import URLRouter
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.mail import get_connection
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import notifications, outbox
+from .caching import get_or_build
+from .counters import BufferedCounter
+from .geo import KDTree, haversine_km
+from .loadtest import BenchmarkChannelLayer, SimulatedClient, SocketClient, percentiles
+from .models import Category, ChatMessage, Destination, Notification, OutboundEmail
+from .pagination import InvalidCursor, KeysetPaginator, encode_cursor
+from .routing import websocket_urlpatterns
+from .search import _postgresql_match, _sqlite_match
+from .smtp_sink import SMTPSink
+from .testing import QueryBudgetTestMixin
+from .versions import bump_version
+
+
+def create_destination(name, **fields):
+    return Destination.objects.create(
+        name=name, slug=name.lower(), description='', country='Portugal', city=name,
+        latitude=Decimal('38.7'), longitude=Decimal('-9.1'), image='destinations/city.jpg', **fields
+    )
+
+
+class KeysetPaginatorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        now = timezone.now()
+        for number in range(5):
+            destination = create_destination(f'City{number}')
+            # Two rows share a timestamp so the id breaks the tie.
+            Destination.objects.filter(pk=destination.pk).update(created_at=now - timedelta(hours=number // 2))
+
+    def paginator(self):
+        return KeysetPaginator(Destination.objects.all(), per_page=2)
+
+    def test_pages_cover_every_row_once(self):
+        seen = []
+        cursor = None
+        while True:
+            page = self.paginator().get_page(cursor)
+            seen.extend(destination.pk for destination in page)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+        expected = list(Destination.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_malformed_cursors_are_invalid(self):
+        for values in (
+            ['2024-01-01T00:00:00+00:00', 'abc'],
+            [1, 2],
+            ['not a date', 1],
+            [None, 1],
+            [['2024-01-01'], 1],
+            ['2024-01-01T00:00:00+00:00', True],
+            ['2024-01-01T00:00:00+00:00', 10 ** 30],
+            ['2024-01-01T00:00:00+00:00', {'id': 1}],
+        ):
+            with self.subTest(values=values):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator().get_page(encode_cursor(values))
+        for token in ('!!!', 'eyJhIjogMX0', encode_cursor(['2024-01-01T00:00:00+00:00'])):
+            with self.subTest(token=token):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator().get_page(token)
+
+    def walk(self, paginator):
+        pages = []
+        cursor = None
+        while True:
+            page = paginator.get_page(cursor)
+            pages.append([destination.pk for destination in page])
+            if not page.has_next:
+                return pages
+            cursor = page.next_cursor
+
+    def test_every_page_size_walks_ties_in_order_without_an_empty_last_page(self):
+        for descending in (True, False):
+            prefix = '-' if descending else ''
+            expected = list(Destination.objects.order_by(f'{prefix}created_at', f'{prefix}id').values_list('pk', flat=True))
+            for per_page in range(1, 7):
+                with self.subTest(descending=descending, per_page=per_page):
+                    pages = self.walk(KeysetPaginator(Destination.objects.all(), per_page=per_page, descending=descending))
+                    self.assertEqual(sum(pages, []), expected)
+                    # Five rows: an exact multiple ends on a full page, not on an empty one.
+                    self.assertEqual(len(pages), -(-5 // per_page))
+                    self.assertTrue(all(pages))
+
+    def test_empty_results_and_cursors_past_the_end(self):
+        page = KeysetPaginator(Destination.objects.none(), per_page=2).get_page()
+        self.assertEqual((list(page), page.has_next), ([], False))
+
+        last = Destination.objects.order_by('created_at', 'id').first()
+        page = self.paginator().get_page(encode_cursor([last.created_at, last.pk]))
+        self.assertEqual((list(page), page.has_next), ([], False))
+
+    def test_cursor_rows_stay_put_when_newer_rows_arrive(self):
+        first = self.paginator().get_page()
+        second = [destination.pk for destination in self.paginator().get_page(first.next_cursor)]
+        create_destination('Newest')
+        self.assertEqual([destination.pk for destination in self.paginator().get_page(first.next_cursor)], second)
+
+    def test_cursor_values_are_range_checked(self):
+        now = timezone.now().isoformat()
+        for values in ([now, -(2 ** 63) - 1], [now, 2 ** 63], ['2024-13-01T00:00:00+00:00', 1], [now, 1.5]):
+            with self.subTest(values=values):
+                with self.assertRaises(InvalidCursor):
+                    self.paginator().get_page(encode_cursor(values))
+        with self.assertRaises(InvalidCursor):
+            self.paginator().get_page(encode_cursor([now, 1, 2]))
+
+    def test_numeric_strings_are_accepted(self):
+        page = self.paginator().get_page(encode_cursor([timezone.now().isoformat(), '999']))
+        self.assertEqual(len(page), 2)
+
+
+class OutboxTests(TestCase):
+    """Send the outbox to a local SMTP sink running on its own thread."""
+
+    def start_sink(self, **options):
+        sink = SMTPSink(port=0, **options)
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(sink.start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
+        self.addCleanup(stop)
+        return sink, get_connection(
+            'django.core.mail.backends.smtp.EmailBackend', host=sink.host, port=sink.port,
+            username='', password='', use_tls=False, use_ssl=False, timeout=5,
+        )
+
+    def enqueue(self, *recipients):
+        return [outbox.enqueue(f'Hello {to}', 'Body', [to]) for to in recipients]
+
+    def statuses(self):
+        return dict(OutboundEmail.objects.values_list('to__0', 'status'))
+
+    def test_refusals_fail_only_their_own_message(self):
+        sink, connection = self.start_sink(refuse=['bounce@example.com'])
+        self.enqueue('a@example.com', 'bounce@example.com', 'b@example.com')
+        self.assertEqual(outbox.send_batch(connection=connection), (2, 1))
+        self.assertEqual(self.statuses(), {
+            'a@example.com': 'sent', 'bounce@example.com': 'failed', 'b@example.com': 'sent',
+        })
+        # A permanent refusal is not retried, and did not cost a reconnect.
+        self.assertEqual(OutboundEmail.objects.get(status='failed').attempts, 1)
+        self.assertEqual(sink.connections, 1)
+
+    def test_temporary_refusal_is_rescheduled(self):
+        sink, connection = self.start_sink(fail_rate=1.0)
+        email, = self.enqueue('a@example.com')
+        self.assertEqual(outbox.send_batch(connection=connection), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('451', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        self.assertEqual(sink.connections, 1)
+
+    def test_dropped_connection_is_reopened_and_sent_rows_are_kept(self):
+        sink, connection = self.start_sink(disconnect_after=2)
+        self.enqueue('a@example.com', 'b@example.com', 'c@example.com', 'd@example.com', 'e@example.com')
+        # Reopened once: four get through, the fifth waits for the next batch.
+        self.assertEqual(outbox.send_batch(connection=connection), (4, 1))
+        self.assertEqual(sink.connections, 2)
+        self.assertEqual(OutboundEmail.objects.filter(status='sent').count(), 4)
+        self.assertEqual(OutboundEmail.objects.get(status='pending').attempts, 1)
+
+
+class BufferedCounterTests(TestCase):
+    def setUp(self):
+        self.email = outbox.enqueue('Hello', 'Body', ['a@example.com'])
+        self.counter = BufferedCounter(OutboundEmail, 'attempts', flush_interval=3600)
+        self.addCleanup(self.counter.flush)
+
+    def test_increments_are_written_together_by_the_timer(self):
+        with self.assertNumQueries(0):
+            self.counter.incr(self.email.pk)
+            self.counter.incr(self.email.pk, 2)
+        self.assertTrue(self.counter._timer.is_alive())
+        self.assertEqual(self.counter.value(self.email), 3)
+        self.assertEqual(self.counter.flush(), 1)
+        self.assertIsNone(self.counter._timer)
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.attempts, 3)
+
+    def test_failed_flush_keeps_the_increments_for_the_next_timer(self):
+        self.counter.incr(self.email.pk, 2)
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=DatabaseError('database is locked')), \
+                self.assertLogs('core.counters', 'ERROR'):
+            self.assertEqual(self.counter.flush(), 0)
+        self.assertEqual(self.counter.pending(self.email.pk), 2)
+        self.assertTrue(self.counter._timer.is_alive())
+        self.assertEqual(self.counter.flush(), 1)
+        self.email.refresh_from_db()
+        self.assertEqual(self.email.attempts, 2)
+
+
+class KDTreeTests(TestCase):
+    def setUp(self):
+        rng = random.Random(5)
+        # Spread over the globe plus clusters at a pole and across the antimeridian.
+        self.points = [(n, rng.uniform(-90, 90), rng.uniform(-180, 180)) for n in range(400)]
+        self.points += [(400 + n, rng.uniform(85, 90), rng.uniform(-180, 180)) for n in range(50)]
+        self.points += [(450 + n, rng.uniform(-20, 20), rng.choice([-1, 1]) * rng.uniform(178, 180)) for n in range(50)]
+        self.tree = KDTree(self.points)
+        self.centres = [(0, 0), (89.5, 10), (5, 179.9), (-45, -60), (38.7, -9.1)]
+
+    def brute_force(self, lat, lon):
+        return sorted((haversine_km(lat, lon, plat, plon), key) for key, plat, plon in self.points)
+
+    def test_within_matches_brute_force_haversine(self):
+        for lat, lon in self.centres:
+            expected = self.brute_force(lat, lon)
+            for radius in (1, 250, 1500, 8000, 25000):
+                found = self.tree.within(lat, lon, radius)
+                wanted = [key for distance, key in expected if distance <= radius]
+                self.assertEqual(sorted(key for _, key in found), sorted(wanted), (lat, lon, radius))
+                for (distance, key), (expected_distance, _) in zip(found, [e for e in expected if e[1] in wanted]):
+                    self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_nearest_matches_brute_force_haversine(self):
+        for lat, lon in self.centres:
+            expected = self.brute_force(lat, lon)
+            found = self.tree.nearest(lat, lon, k=7, exclude=[expected[0][1]])
+            self.assertEqual([key for _, key in found], [key for _, key in expected[1:8]])
+            for (distance, _), (expected_distance, _) in zip(found, expected[1:8]):
+                self.assertAlmostEqual(distance, expected_distance, places=6)
+
+    def test_negative_or_missing_radius_finds_nothing(self):
+        self.assertEqual(self.tree.within(0, 0, -20000), [])
+        self.assertEqual(self.tree.within(0, 0, float('nan')), [])
+        self.assertEqual(KDTree([]).within(0, 0, 100), [])
+
+    def test_nearby_view_rejects_bad_radius(self):
+        create_destination('Lisbon')
+        url = reverse('core:nearby_destinations')
+        for radius in ('0', '-5', 'nan', 'inf'):
+            response = self.client.get(url, {'lat': 38.7, 'lon': -9.1, 'radius': radius})
+            self.assertEqual(response.status_code, 400, radius)
+        self.assertEqual(self.client.get(url, {'lat': 38.7, 'lon': -9.1, 'limit': 0}).status_code, 400)
+        response = self.client.get(url, {'lat': 38.7, 'lon': -9.1, 'radius': 10})
+        self.assertEqual([result['name'] for result in response.json()['results']], ['Lisbon'])
+
+
+class SearchMatchTests(TestCase):
+    def test_only_the_last_term_matches_as_a_prefix(self):
+        self.assertEqual(_postgresql_match(['lisbon', 'tra']), 'lisbon & tra:*')
+        self.assertEqual(_sqlite_match(['lisbon', 'tra']), '"lisbon" "tra"*')
+        self.assertEqual(_postgresql_match(['porto']), 'porto:*')
+
+
+class HomeCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_home_is_rebuilt_only_after_content_changes(self):
+        create_destination('Lisbon')
+        self.assertContains(self.client.get(reverse('core:home')), 'Lisbon')
+        with self.assertNumQueries(0):
+            self.assertContains(self.client.get(reverse('core:home')), 'Lisbon')
+
+        create_destination('Porto')
+        self.assertContains(self.client.get(reverse('core:home')), 'Porto')
+        Destination.objects.get(name='Porto').delete()
+        self.assertNotContains(self.client.get(reverse('core:home')), 'Porto')
+
+    def test_expired_entry_is_rebuilt(self):
+        build = mock.Mock(side_effect=['first', 'second'])
+        self.assertEqual(get_or_build('test:expiry', build, timeout=60), 'first')
+        self.assertEqual(get_or_build('test:expiry', build, timeout=60), 'first')
+        with mock.patch('core.caching.time.time', return_value=time.time() + 61):
+            self.assertEqual(get_or_build('test:expiry', build, timeout=60), 'second')
+        self.assertEqual(build.call_count, 2)
+
+    def test_stale_entry_is_served_while_another_caller_rebuilds(self):
+        get_or_build('test:stale', lambda: 'old', version_names=['test'])
+        bump_version('test')
+        # Someone else holds the rebuild lock.
+        cache.add('lock:test:stale', 1, 30)
+        build = mock.Mock(return_value='new')
+        self.assertEqual(get_or_build('test:stale', build, version_names=['test']), 'old')
+        build.assert_not_called()
+        cache.delete('lock:test:stale')
+        self.assertEqual(get_or_build('test:stale', build, version_names=['test']), 'new')
+
+    def test_cold_cache_waits_for_the_rebuild_then_builds_itself(self):
+        cache.add('lock:test:cold', 1, 30)
+        build = mock.Mock(return_value='built')
+        started = time.monotonic()
+        self.assertEqual(get_or_build('test:cold', build, wait=0.2), 'built')
+        self.assertGreaterEqual(time.monotonic() - started, 0.2)
+        build.assert_called_once()
+
+
+class DestinationListQueryBudgetTests(QueryBudgetTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for number in range(3):
+            Category.objects.create(name=f'Theme{number}', slug=f'theme{number}', description='', icon='')
+        for number in range(15):
+            create_destination(f'Town{number}', min_price=Decimal(100 + number))
+
+    def test_destination_list(self):
+        self.assertWithinQueryBudget(reverse('core:destination_list'))
+        self.assertWithinQueryBudget(reverse('core:destination_list'), {'sort': 'price_asc', 'page': 2})
+        self.assertWithinQueryBudget(reverse('core:destination_list'), {'category': 'theme1'})
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ConsumerTests(TransactionTestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='traveller@example.com', password='secret', username='traveller', first_name='Ana',
+        )
+        self.application = URLRouter(websocket_urlpatterns)
+        # Counts the hops to close stale connections that dispatch makes.
+        patcher = mock.patch('channels.consumer.aclose_old_connections', side_effect=aclose_old_connections)
+        self.closes = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client_for(self, path, user):
+        return SimulatedClient(self.application, path, user)
+
+    def test_chat_messages_are_stored_then_relayed_to_the_room(self):
+        async def run():
+            ana = self.client_for('ws/chat/lisbon/', self.user)
+            guest = self.client_for('ws/chat/lisbon/', AnonymousUser())
+            for client in (ana, guest):
+                self.assertTrue(await client.connect())
+                self.assertEqual(json.loads(await client.receive_message())['messages'], [])
+
+            await ana.send_message(json.dumps({'message': '  Meet at the tram stop  '}))
+            for client in (ana, guest):
+                event = json.loads(await client.receive_message())
+                self.assertEqual(
+                    (event['type'], event['user'], event['message']), ('chat_message', 'Ana', 'Meet at the tram stop')
+                )
+            # connect twice and one receive; the relayed messages skip the hop.
+            self.assertEqual(self.closes.await_count, 3)
+
+            await guest.send_message(json.dumps({'message': 'Anonymous hello'}))
+            await ana.send_message(json.dumps({'action': 'load_history', 'before': event['id'] + 1}))
+            page = json.loads(await ana.receive_message())
+            self.assertEqual([message['message'] for message in page['messages']], ['Meet at the tram stop'])
+            self.assertTrue(await guest.receive_nothing())
+            for client in (ana, guest):
+                await client.disconnect()
+            return event['id']
+
+        message_id = async_to_sync(run)()
+        self.assertEqual(list(ChatMessage.objects.values_list('pk', 'room', 'user')), [(message_id, 'lisbon', self.user.pk)])
+
+    def test_notifications_are_sent_to_the_users_group(self):
+        Notification.objects.create(user=self.user, kind='booking', title='Booking confirmed')
+        other = get_user_model().objects.create_user(email='other@example.com', password='secret', username='other')
+
+        async def run():
+            self.assertFalse(await self.client_for('ws/notifications/', AnonymousUser()).connect())
+            client = self.client_for('ws/notifications/', self.user)
+            self.assertTrue(await client.connect())
+            inbox = json.loads(await client.receive_message())
+            self.assertEqual((inbox['type'], inbox['unread']), ('inbox', 1))
+            self.assertEqual([item['title'] for item in inbox['notifications']], ['Booking confirmed'])
+            closes = self.closes.await_count
+
+            audience = get_user_model().objects.filter(pk__in=[self.user.pk, other.pk])
+            stats = await notifications.adispatch(audience, 'trip', 'Departure tomorrow')
+            self.assertEqual(stats.recipients, 2)
+            pushed = json.loads(await client.receive_message())
+            self.assertEqual((pushed['kind'], pushed['title']), ('trip', 'Departure tomorrow'))
+            self.assertTrue(await client.receive_nothing())
+            self.assertEqual(self.closes.await_count, closes)
+            await client.disconnect()
+
+        async_to_sync(run)()
+        self.assertEqual(Notification.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Notification.objects.filter(user=other).count(), 1)
+
+
+async def _read_client_frame(reader):
+    """One masked frame from a SocketClient, as (opcode, payload)."""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    mask = await reader.readexactly(4)
+    payload = await reader.readexactly(length)
+    return first & 0x0F, bytes(byte ^ mask[index % 4] for index, byte in enumerate(payload))
+
+
+def _server_frame(opcode, payload, final=True):
+    length = len(payload)
+    header = struct.pack('!BB', (0x80 if final else 0) | opcode, length) if length < 126 else \
+        struct.pack('!BBH', (0x80 if final else 0) | opcode, 126, length)
+    return header + payload
+
+
+class LoadTestHarnessTests(TestCase):
+    def test_percentiles_are_nearest_rank(self):
+        self.assertEqual(percentiles(range(100, 0, -1)), {50: 51, 90: 91, 99: 100})
+        self.assertEqual(percentiles([7]), {50: 7, 90: 7, 99: 7})
+        self.assertEqual(percentiles([]), {})
+
+    def test_benchmark_layer_sweeps_expired_messages_once_a_second(self):
+        layer = BenchmarkChannelLayer()
+        with mock.patch('core.loadtest.time.monotonic', side_effect=[100.0, 100.5, 101.2]), \
+                mock.patch('channels.layers.InMemoryChannelLayer._clean_expired') as sweep:
+            for _ in range(3):
+                layer._clean_expired()
+        self.assertEqual(sweep.call_count, 2)
+
+    def test_socket_client_speaks_websocket_frames(self):
+        seen = []
+        served = asyncio.Event()
+
+        async def serve(reader, writer):
+            await reader.readuntil(b'\r\n\r\n')
+            writer.write(b'HTTP/1.1 101 Switching Protocols\r\n\r\n')
+            opcode, text = await _read_client_frame(reader)
+            seen.append((opcode, text))
+            # A ping, then the text echoed back in two fragments.
+            writer.write(_server_frame(0x9, b'still there?'))
+            writer.write(_server_frame(0x1, text[:100], final=False) + _server_frame(0x0, text[100:]))
+            seen.append(await _read_client_frame(reader))
+            writer.write(_server_frame(0x8, struct.pack('!H', 1000)))
+            await writer.drain()
+            seen.append(await _read_client_frame(reader))
+            writer.close()
+            served.set()
+
+        async def run():
+            server = await asyncio.start_server(serve, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            client = SocketClient(f'ws://127.0.0.1:{port}', '/ws/chat/lisbon/', [('Cookie', 'sessionid=abc')])
+            self.assertTrue(await client.connect(5))
+            text = json.dumps({'message': 'x' * 300})
+            await client.send_message(text)
+            self.assertEqual(await client.receive_message(5), text)
+            self.assertIsNone(await client.receive_message(5))
+            await client.disconnect()
+            await asyncio.wait_for(served.wait(), 5)
+            server.close()
+            await server.wait_closed()
+            return text
+
+        text = asyncio.run(run())
+        self.assertEqual(seen, [(0x1, text.encode()), (0xA, b'still there?'), (0x8, struct.pack('!H', 1000))])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class BenchmarkWebsocketsCommandTests(TransactionTestCase):
+    def test_in_process_run_reports_and_cleans_up(self):
+        out = io.StringIO()
+        call_command(
+            'benchmark_websockets', clients=6, mix='1:2:0', ramp=1000, users=3, rooms=2,
+            round_trips=6, concurrency=2, stdout=out,
+        )
+        output = out.getvalue()
+        self.assertIn('Ramped up 6 of 6 connections', output)
+        self.assertIn('notification: 2 connected, 0 failed', output)
+        self.assertIn('chat: 4 connected, 0 failed', output)
+        self.assertEqual(output.count('round trip p50'), 2)
+        self.assertNotIn('booking:', output)
+        self.assertFalse(get_user_model().objects.filter(username__startswith='loadtest-').exists())
+        self.assertFalse(ChatMessage.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+
+    def test_bad_options_are_rejected(self):
+        for options in ({'mix': '1:1'}, {'mix': '0:0:0'}, {'mix': 'a:b:c'}, {'serve': True}):
+            with self.subTest(options=options):
+                with self.assertRaises(CommandError):
+                    call_command('benchmark_websockets', clients=3, mix=options.pop('mix', '1:1:0'), **options)
+        with self.assertRaisesMessage(CommandError, 'No tours with upcoming departures'):
+            call_command('benchmark_websockets', clients=3, mix='0:0:1')
@@ -15,8 +15,17 @@ urlpatterns = [
     
     # Destinations
     path('destinations/', views.destination_list, name='destination_list'),
+    path('destinations/nearby/', views.nearby_destinations, name='nearby_destinations'),
     path('destinations/<slug:slug>/', views.destination_detail, name='destination_detail'),
     
+    # Chat history
+    path('chat/<slug:room>/history/', views.chat_history, name='chat_history'),
+    
+    # Notification inbox
+    path('notifications/', views.notification_list, name='notification_list'),
+    path('notifications/<int:notification_id>/read/', views.notification_read, name='notification_read'),
+    path('notifications/read-all/', views.notification_read_all, name='notification_read_all'),
+    
     # FAQ page
     path('faq/', views.faq, name='faq'),
     
@@ -0,0 +1,30 @@
+from django.core.cache import cache
+
+_PREFIX = 'version:'
+
+
+def get_version(name):
+    """Return the current version number of ``name``, starting at 1."""
+    key = _PREFIX + name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(name):
+    """Move ``name`` to a new version so everything derived from it is rebuilt."""
+    key = _PREFIX + name
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.set(key, 2, None)
+        return 2
+
+
+def bumps(name):
+    """Return a signal receiver that bumps ``name``."""
+    def receiver(*args, **kwargs):
+        bump_version(name)
+    return receiver
@@ -1,26 +1,33 @@
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Count, Avg, Q
 from django.conf import settings
-from django.core.mail import send_mail
 from django.contrib import messages
-from django.http import HttpResponse
+from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
+from django.db.models import F
+from decimal import Decimal, InvalidOperation
+import math
 from .models import Destination, Category
-from bookings.models import Tour
-from blog.models import Post
+from bookings.facets import get_tour_index
 from django.core.paginator import Paginator
+from . import notifications, outbox
+from accounts.wishlists import wishlist_ids
+from .geo import get_destination_index
+from .chat import history
+from .home import get_home_context
+from .querylog import query_budget
+from .search import search_queryset
 
+def _decimal_or_none(value):
+    try:
+        return Decimal(value) if value else None
+    except InvalidOperation:
+        return None
+
+@query_budget(8)
 def home(request):
-    featured_destinations = Destination.objects.filter(is_active=True)[:6]
-    featured_tours = Tour.objects.filter(is_active=True)[:6]
-    categories = Category.objects.filter(is_active=True)
-    latest_posts = Post.objects.filter(status='published').order_by('-published_at')[:3]
-    
-    context = {
-        'featured_destinations': featured_destinations,
-        'featured_tours': featured_tours,
-        'categories': categories,
-        'latest_posts': latest_posts,
-    }
+    context = get_home_context()
+    context['wishlisted'] = sorted(wishlist_ids(request.user))
     return render(request, 'core/home.html', context)
 
 def about(request):
@@ -43,12 +50,12 @@ def contact(request):
         """
         
         try:
-            send_mail(
+            # Queued; the send_outbox worker delivers it
+            outbox.enqueue(
                 subject=f'Contact Form: {subject}',
-                message=email_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[settings.CONTACT_EMAIL],
-                fail_silently=False,
+                body=email_message,
+                to=[settings.CONTACT_EMAIL],
+                reply_to=[email] if email else None,
             )
             if request.htmx:
                 return HttpResponse('<div class="alert alert-success">Thank you for your message! We will get back to you soon.</div>')
@@ -63,11 +70,13 @@ def contact(request):
     }
     return render(request, 'core/contact.html', context)
 
+@query_budget(5)
 def destination_list(request):
-    # Get all categories with destination counts
-    categories = Category.objects.annotate(
-        destination_count=Count('tour__destination', distinct=True)
-    ).order_by('name')
+    # Get all categories with destination counts from the facet index
+    destination_counts = get_tour_index().destination_counts('category')
+    categories = list(Category.objects.order_by('name'))
+    for category in categories:
+        category.destination_count = destination_counts.get(category.slug, 0)
     
     # Get selected category from query params
     selected_category_slug = request.GET.get('category')
@@ -76,17 +85,14 @@ def destination_list(request):
     
     if selected_category_slug:
         selected_category = get_object_or_404(Category, slug=selected_category_slug)
-        destinations = destinations.filter(tour__category=selected_category).distinct()
+        destinations = destinations.filter(tour__categories=selected_category).distinct()
     
     # Search functionality
     search_query = request.GET.get('q')
+    sort_by = request.GET.get('sort')
     if search_query:
-        destinations = destinations.filter(
-            Q(name__icontains=search_query) |
-            Q(city__icontains=search_query) |
-            Q(country__icontains=search_query) |
-            Q(description__icontains=search_query)
-        )
+        # Rank by relevance unless the user picked another order
+        destinations = search_queryset(destinations, search_query, ranked=not sort_by)
     
     # Filter by featured destinations (using is_active instead)
     featured_only = request.GET.get('featured')
@@ -94,22 +100,23 @@ def destination_list(request):
         destinations = destinations.filter(is_active=True)
     
     # Filter by price range
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    if min_price:
-        destinations = destinations.filter(min_price__gte=float(min_price))
-    if max_price:
-        destinations = destinations.filter(min_price__lte=float(max_price))
+    min_price = _decimal_or_none(request.GET.get('min_price'))
+    max_price = _decimal_or_none(request.GET.get('max_price'))
+    if min_price is not None:
+        destinations = destinations.filter(min_price__gte=min_price)
+    if max_price is not None:
+        destinations = destinations.filter(min_price__lte=max_price)
     
-    # Sort destinations
-    sort_by = request.GET.get('sort')
+    # Sort destinations on their maintained summary columns
     if sort_by == 'price_asc':
-        destinations = destinations.order_by('min_price')
+        destinations = destinations.order_by(F('min_price').asc(nulls_last=True), 'name')
     elif sort_by == 'price_desc':
-        destinations = destinations.order_by('-min_price')
+        destinations = destinations.order_by(F('min_price').desc(nulls_last=True), 'name')
+    elif sort_by == 'departure':
+        destinations = destinations.order_by(F('next_departure').asc(nulls_last=True), 'name')
     elif sort_by == 'name':
         destinations = destinations.order_by('name')
-    else:
+    elif not search_query:
         destinations = destinations.order_by('-created_at', 'name')
     
     # Pagination
@@ -132,10 +139,17 @@ def destination_list(request):
 def destination_detail(request, slug):
     destination = get_object_or_404(Destination, slug=slug)
     
-    # Get related destinations (same category, excluding current)
-    related_destinations = Destination.objects.filter(
-        category=destination.category
-    ).exclude(id=destination.id)[:3]
+    # Get related destinations (nearest ones, excluding current)
+    nearest = get_destination_index().nearest(
+        float(destination.latitude), float(destination.longitude), k=3, exclude=[destination.id]
+    )
+    related_by_id = Destination.objects.in_bulk([pk for _, pk in nearest])
+    related_destinations = []
+    for distance_km, pk in nearest:
+        related = related_by_id.get(pk)
+        if related is not None:
+            related.distance_km = distance_km
+            related_destinations.append(related)
     
     # Get available tours for this destination
     tours = destination.tours.filter(is_active=True)
@@ -147,6 +161,51 @@ def destination_detail(request, slug):
     }
     return render(request, 'core/destination_detail.html', context)
 
+def nearby_destinations(request):
+    """Return destinations near a point as JSON.
+
+    Takes ``lat`` and ``lon`` plus either ``radius`` (km) or ``k`` for the
+    k nearest; at most ``limit`` results are returned.
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+        radius = float(request.GET['radius']) if request.GET.get('radius') else None
+        k = int(request.GET.get('k', 10))
+        limit = min(int(request.GET.get('limit', 50)), 200)
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'lat and lon are required; radius, k and limit must be numbers'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({'error': 'lat/lon out of range'}, status=400)
+    if radius is not None and not 0 < radius < math.inf:
+        return JsonResponse({'error': 'radius must be a positive number of km'}, status=400)
+    if k < 1 or limit < 1:
+        return JsonResponse({'error': 'k and limit must be at least 1'}, status=400)
+    
+    index = get_destination_index()
+    if radius is not None:
+        matches = index.within(lat, lon, radius)[:limit]
+    else:
+        matches = index.nearest(lat, lon, k=min(k, limit))
+    
+    destinations = Destination.objects.in_bulk([pk for _, pk in matches])
+    results = []
+    for distance_km, pk in matches:
+        destination = destinations.get(pk)
+        if destination is None:
+            continue
+        results.append({
+            'id': destination.id,
+            'name': destination.name,
+            'slug': destination.slug,
+            'city': destination.city,
+            'country': destination.country,
+            'latitude': float(destination.latitude),
+            'longitude': float(destination.longitude),
+            'distance_km': round(distance_km, 2),
+        })
+    return JsonResponse({'results': results})
+
 def faq(request):
     """Display the FAQ page."""
     return render(request, 'core/faq.html')
@@ -263,3 +322,36 @@ def team(request):
         'special_posts': special_posts
     }
     return render(request, 'core/team.html', context)
+
+def chat_history(request, room):
+    """A page of a chat room's history as JSON: ``?before=<message id>&limit=N``."""
+    before = request.GET.get('before')
+    limit = request.GET.get('limit')
+    if (before and not before.isdigit()) or (limit and not limit.isdigit()):
+        return JsonResponse({'error': 'before and limit must be numbers'}, status=400)
+    messages = history(room, int(before) if before else None, int(limit) if limit else None)
+    return JsonResponse({
+        'room': room,
+        'messages': messages,
+        'before': messages[0]['id'] if messages else None,
+    })
+
+@login_required
+def notification_list(request):
+    """The user's unread notifications as JSON, newest first."""
+    return JsonResponse({
+        'unread': notifications.unread_count(request.user),
+        'notifications': notifications.unread(request.user),
+    })
+
+@login_required
+@require_POST
+def notification_read(request, notification_id):
+    marked = notifications.mark_read(request.user, [notification_id])
+    return JsonResponse({'marked': marked, 'unread': notifications.unread_count(request.user)})
+
+@login_required
+@require_POST
+def notification_read_all(request):
+    marked = notifications.mark_read(request.user)
+    return JsonResponse({'marked': marked, 'unread': 0})
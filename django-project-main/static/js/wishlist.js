@@ -1,4 +1,15 @@
 document.addEventListener('DOMContentLoaded', function() {
+    // Mark hearts on pages that render them from a shared cache
+    const wishlisted = document.getElementById('wishlisted-tours');
+    if (wishlisted) {
+        const tourIds = new Set(JSON.parse(wishlisted.textContent));
+        document.querySelectorAll('.wishlist-btn[data-tour-id]').forEach(button => {
+            if (tourIds.has(Number(button.dataset.tourId))) {
+                button.classList.add('active');
+            }
+        });
+    }
+
     // Handle wishlist toggle buttons
     document.querySelectorAll('.wishlist-btn').forEach(button => {
         button.addEventListener('click', function() {
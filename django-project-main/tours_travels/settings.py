@@ -73,8 +73,14 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django_htmx.middleware.HtmxMiddleware',
     'allauth.account.middleware.AccountMiddleware',
+    'core.middleware.QueryBudgetMiddleware',
 ]
 
+# Query budgets (see core.querylog.query_budget)
+QUERY_BUDGET_ENABLED = os.getenv('QUERY_BUDGET_ENABLED', 'False') == 'True'
+QUERY_BUDGET_RAISE = os.getenv('QUERY_BUDGET_RAISE', 'False') == 'True'
+QUERY_BUDGET_N_PLUS_ONE_THRESHOLD = int(os.getenv('QUERY_BUDGET_N_PLUS_ONE_THRESHOLD', 5))
+
 ROOT_URLCONF = 'tours_travels.urls'
 
 TEMPLATES = [
@@ -96,6 +102,54 @@ TEMPLATES = [
 WSGI_APPLICATION = 'tours_travels.wsgi.application'
 ASGI_APPLICATION = 'tours_travels.asgi.application'
 
+# Channels
+# Use Redis when available so background workers can reach websocket groups.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        },
+    }
+
+
+# Cache
+# Shared through Redis so cache versions bump across processes. This has its
+# own setting: with REDIS_URL (channels) alone every cache call would need a
+# running Redis server, so the default stays the per-process memory cache.
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        },
+    }
+
+HOME_CACHE_TIMEOUT = 60 * 60
+
+# Seconds between flushes of buffered counters such as blog view counts
+COUNTER_FLUSH_INTERVAL = 10
+
+# Invoice PDFs, rendered by a process pool and cached on disk by content hash
+INVOICE_ROOT = BASE_DIR / 'var' / 'invoices'
+INVOICE_RENDER_WORKERS = 2
+INVOICE_RENDER_ON_CONFIRM = True
+INVOICE_RENDER_TIMEOUT = 30
+INVOICE_RETENTION_DAYS = 30  # PDFs unused for longer are deleted by prune_invoices
+
+# Blog comment threads
+COMMENT_THREADS_PER_PAGE = 20
+COMMENT_MAX_DEPTH = 5
+COMMENT_CACHE_TIMEOUT = 60 * 60
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -104,6 +158,17 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Background workers write concurrently with requests: take the write
+        # lock up front and wait for it instead of failing with "locked".
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than the shared in-memory database, so tests that
+        # write from several threads wait for the lock like the server does.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -193,14 +258,65 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'Tours & Travels <noreply@localhost>')
 CONTACT_EMAIL = os.getenv('CONTACT_EMAIL', 'contact@localhost')
 
+# Email outbox, drained by the send_outbox worker
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_LEASE_SECONDS = 300
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_RETRY_BASE = 60  # seconds; doubles on every attempt
+OUTBOX_RETRY_MAX = 60 * 60
+
 # Stripe settings
 STRIPE_PUBLIC_KEY = os.getenv('STRIPE_PUBLIC_KEY', '')
 STRIPE_SECRET_KEY = os.getenv('STRIPE_SECRET_KEY', '')
+STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET', '')  # webhook events are refused without it
 
 # PayPal settings
 PAYPAL_CLIENT_ID = os.getenv('PAYPAL_CLIENT_ID', '')
 PAYPAL_SECRET = os.getenv('PAYPAL_SECRET', '')
 PAYPAL_MODE = os.getenv('PAYPAL_MODE', 'sandbox')  # or 'live' for production
+PAYPAL_WEBHOOK_ID = os.getenv('PAYPAL_WEBHOOK_ID', '')  # webhook events are refused without it
+
+# Payment webhooks are stored on receipt and applied by process_webhooks workers
+WEBHOOK_WORKERS = 4
+WEBHOOK_BATCH_SIZE = 200
+WEBHOOK_LEASE_SECONDS = 300
+WEBHOOK_MAX_ATTEMPTS = 5
+PAYMENT_CURRENCY = 'USD'  # payments in another currency are held for review
 
 # Google Maps API Key
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
+
+# Booking holds
+BOOKING_HOLD_MINUTES = int(os.getenv('BOOKING_HOLD_MINUTES', 15))
+BOOKING_HOLD_SWEEP_BATCH = int(os.getenv('BOOKING_HOLD_SWEEP_BATCH', 500))
+
+# Seat availability pushed to tour_<id> websocket groups
+SEAT_UPDATES_PER_SECOND = 2
+SEAT_SNAPSHOT_TIMEOUT = 5 * 60
+
+# Per-process tour availability calendars. Changes made by other processes
+# only invalidate them through a shared cache, so without one they expire fast.
+AVAILABILITY_CALENDAR_TTL = 60 if CACHE_REDIS_URL else 5  # seconds
+
+# Listing summaries (min price, next departure, open seats) after bookings
+SUMMARY_REFRESH_DELAY = 30  # seconds seat changes are collected before one refresh
+
+# Chat history
+CHAT_FLUSH_INTERVAL = 0.005  # seconds a message may wait to share an INSERT
+CHAT_BATCH_SIZE = 500
+CHAT_BUFFER_SIZE = 200  # recent messages per room kept in the cache
+CHAT_HISTORY_LIMIT = 50
+CHAT_MAX_LENGTH = 2000
+
+# Notification fan-out
+NOTIFICATION_CHUNK_SIZE = 1000  # recipients read and stored per query
+NOTIFICATION_CONCURRENCY = 100  # channel layer sends in flight
+
+# Wishlists
+WISHLIST_CACHE_TIMEOUT = 24 * 60 * 60  # per-user tour id sets, dropped on change
+
+# Tour recommendations, rebuilt by rebuild_recommendations
+RECOMMENDATION_LIMIT = 20  # stored per user
+RECOMMENDATION_NEIGHBOURS = 50  # similar tours kept per tour
+RECOMMENDATION_CONTENT_WEIGHT = 0.3  # share of category/amenity overlap in tour similarity
+RECOMMENDATION_INTEREST_WEIGHT = 0.5  # pull of a user's travel style and interests
@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class VendorsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'vendors'
+
+    def ready(self):
+        from core.ratings import track_ratings
+        from .models import VendorReview
+
+        track_ratings(VendorReview, 'vendor')
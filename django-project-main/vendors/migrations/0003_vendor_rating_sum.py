@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 21:00
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_rating_sums(apps, schema_editor):
+    Vendor = apps.get_model('vendors', 'Vendor')
+    VendorReview = apps.get_model('vendors', 'VendorReview')
+    sums = VendorReview.objects.values('vendor').annotate(total=Sum('rating')).order_by()
+    Vendor.objects.bulk_update(
+        [Vendor(pk=row['vendor'], rating_sum=row['total']) for row in sums], ['rating_sum'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vendors', '0002_vendor_rating_avg_vendor_rating_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vendor',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_rating_sums, migrations.RunPython.noop),
+    ]
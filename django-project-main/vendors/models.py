@@ -45,6 +45,11 @@ class Vendor(models.Model):
     bank_account_number = models.CharField(max_length=50)
     bank_routing_number = models.CharField(max_length=50)
     
+    # Review aggregates, maintained from VendorReview signals
+    rating_avg = models.FloatField(default=0)  # rating_sum / rating_count, kept for ordering
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -58,10 +63,7 @@ class Vendor(models.Model):
         return self.company_name
 
     def get_rating(self):
-        reviews = self.vendorreview_set.all()
-        if not reviews:
-            return 0
-        return sum(review.rating for review in reviews) / len(reviews)
+        return self.rating_avg
 
 class VendorReview(Review):
     vendor = models.ForeignKey(Vendor, on_delete=models.CASCADE)
@@ -3,6 +3,7 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Vendor, VendorDocument
 from bookings.models import Tour, Booking
+from core.querylog import query_budget
 
 def vendor_list(request):
     vendors = Vendor.objects.filter(status='approved')
@@ -17,6 +18,7 @@ def vendor_register(request):
     return render(request, 'vendors/vendor_register.html')
 
 @login_required
+@query_budget(8)
 def vendor_dashboard(request):
     vendor = get_object_or_404(Vendor, user=request.user)
     tours = Tour.objects.filter(vendor=vendor)